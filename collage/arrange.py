@@ -13,11 +13,119 @@ import os
 import math
 import json
 import re
+import struct
+import sys
+import time
+import base64
+import hashlib
+import copy
+import inspect
+import functools
+import contextlib
+from io import BytesIO
+import PIL
 from PIL import Image
 
+import metrics
+import composite
+import layout_search
+from atomic import write_atomic
+from fetch import FETCH_CONCURRENCY
+from layout_search import search_layout
+from resize_cache import ResizeCache, RESIZE_CACHE_MAX_BYTES, image_digest
 
-def load_product_images(input_dir):
-    """Load all image files from the input directory."""
+# Decode at least this many times the final size before the LANCZOS step
+# (same idea as Image.thumbnail's reducing_gap)
+DECODE_REDUCING_GAP = 2.0
+# Part of every render fingerprint: bump it to invalidate cached renders when
+# the pixels change in a way layout_version() can't see (e.g. an asset or a
+# helper outside the code it hashes)
+RENDER_VERSION = 1
+
+
+class LazyImage:
+    """
+    A product image known only from its header until it is resized.
+
+    Layout planning only needs width/height, so the pixels are decoded once,
+    in resize(), at roughly the final size: JPEG draft mode picks a DCT
+    scale and reduce() shrinks other formats before the final LANCZOS pass.
+    """
+
+    def __init__(self, source):
+        self.source = source  # path or seekable file object
+        with self._open() as img:
+            self.size = img.size
+            self.mode = img.mode
+        self._info = {}
+        self._decoded = None  # set by preload()
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @property
+    def info(self):
+        # Content hash of the encoded file, used as the ResizeCache key
+        if "digest" not in self._info:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(b"file:")
+            if hasattr(self.source, "getbuffer"):
+                h.update(self.source.getbuffer())
+            else:
+                with open(self.source, "rb") as f:
+                    h.update(f.read())
+            self._info["digest"] = h.hexdigest()
+        return self._info
+
+    def _open(self):
+        if hasattr(self.source, "seek"):
+            self.source.seek(0)
+        return Image.open(self.source)
+
+    def decode(self, size):
+        """
+        Decode to RGBA for a resize to `size`: JPEG draft mode picks the
+        smallest DCT scale still DECODE_REDUCING_GAP times that size. No
+        resampling happens here.
+        """
+        img = self._open()
+        if img.format == "JPEG":
+            img.draft(
+                "RGB",
+                (int(size[0] * DECODE_REDUCING_GAP), int(size[1] * DECODE_REDUCING_GAP)),
+            )
+        if img.mode != "RGBA":
+            img = img.convert("RGBA")
+        return img
+
+    def preload(self, size):
+        """
+        A copy of this image decoded now for the largest size it will be
+        resized to, so several resize() calls share one decode.
+        """
+        loaded = copy.copy(self)
+        loaded._decoded = self.decode(size)
+        return loaded
+
+    def resize(self, size, resample=Image.Resampling.LANCZOS):
+        """Decode straight to an RGBA image of the given size."""
+        img = self._decoded if self._decoded is not None else self.decode(size)
+        return img.resize(size, resample, reducing_gap=DECODE_REDUCING_GAP)
+
+
+def load_product_images(input_dir, cutout_cache=None):
+    """
+    Load all image files from the input directory.
+
+    Images are returned as LazyImage (header only) and decoded later at
+    their final size. With a CutoutCache, each raw product photo is instead
+    replaced by its extracted cutout (extracting it only on a cache miss).
+    """
     image_extensions = {".png", ".jpg", ".jpeg", ".bmp", ".gif"}
     image_files = [
         f
@@ -28,21 +136,117 @@ def load_product_images(input_dir):
     images = []
     for filename in sorted(image_files):
         filepath = os.path.join(input_dir, filename)
-        img = Image.open(filepath)
-        # Convert to RGBA to handle transparency if present
-        if img.mode != "RGBA":
-            img = img.convert("RGBA")
-        images.append((filename, img))
+        images.append((filename, load_cutout(filepath, cutout_cache)))
 
     return images
 
 
+def load_cutout(source, cutout_cache=None):
+    """
+    Open a product image lazily (see LazyImage), or return its cached RGBA
+    cutout if a CutoutCache is given.
+    """
+    img = None
+    if cutout_cache is not None:
+        with metrics.stage("extract"):
+            cutouts, _, _ = cutout_cache.get_or_extract(source)
+        if cutouts:
+            img = cutouts[0].convert("RGBA")
+    if img is None:
+        # No cache, or nothing extracted: the photo as-is
+        img = LazyImage(source)
+
+    metrics.count("items")
+    metrics.count("inputPixels", img.width * img.height)
+    return img
+
+
+def load_store_images(store, ids=None):
+    """
+    Load cutouts from a CutoutStore (all of them, or the given ids) as
+    read-only images backed by its memory-mapped packs: nothing is decoded
+    or copied until they are resized. Named "<id>.png" like
+    load_product_images names extract.py's output files.
+    """
+    images = []
+    for item_id in sorted(ids if ids is not None else store.ids()):
+        try:
+            img = store.get(item_id)
+        except KeyError:
+            print(f"Warning: {item_id} is not in the cutout store")
+            continue
+        metrics.count("items")
+        metrics.count("inputPixels", img.width * img.height)
+        images.append((f"{item_id}.png", img))
+    return images
+
+
+def load_manifest_images(manifest, cutout_cache=None, concurrency=FETCH_CONCURRENCY, store=None):
+    """
+    Load the images listed in a manifest, fetching remote ones concurrently.
+
+    manifest: {"items": [{"itemId": 12, "url": "https://..."} |
+                         {"itemId": 12, "path": "/local/file.jpg"} |
+                         {"itemId": 12, "cutout": "<store id>"}, ...],
+               "inspirationUrl": "https://..." | "inspiration": "/local/file.jpg"}
+
+    Each downloaded image's header is parsed as soon as its download
+    completes, while the others are still in flight. Failed downloads are
+    skipped with a warning. Items are named item-{id}.{ext} like the route's
+    temp files, so bounding boxes carry their item ids.
+
+    "cutout" items are read from `store` (a CutoutStore), already extracted.
+
+    Returns (images, inspiration) where inspiration is a path, a BytesIO or None.
+    """
+    from fetch import fetch_all
+
+    images = []
+    entries = []
+    for item in manifest.get("items", []):
+        if item.get("cutout") and store is not None:
+            for _, img in load_store_images(store, [item["cutout"]]):
+                images.append((f"item-{item['itemId']}.png", img))
+            continue
+        source = item.get("path") or item.get("url")
+        if not source:
+            continue
+        ext = ".png" if source.endswith(".png") else ".jpg"
+        name = f"item-{item['itemId']}{ext}"
+        if item.get("path"):
+            images.append((name, load_cutout(item["path"], cutout_cache)))
+        else:
+            entries.append({"url": source, "name": name})
+
+    inspiration = manifest.get("inspiration")
+    if manifest.get("inspirationUrl"):
+        entries.append({"url": manifest["inspirationUrl"], "inspiration": True})
+
+    for entry, data, error in fetch_all(entries, concurrency):
+        label = entry.get("name", "inspiration photo")
+        if error is not None:
+            print(f"Warning: failed to download {label}: {error}")
+            continue
+
+        if entry.get("inspiration"):
+            inspiration = data
+        else:
+            images.append((entry["name"], load_cutout(data, cutout_cache)))
+        print(f"Downloaded {label}")
+
+    # Same order as load_product_images
+    images.sort(key=lambda item: item[0])
+    return images, inspiration
+
+
 def arrange_products_masonry(
     images,
     canvas_width=800,
     canvas_height=1000,
     bg_color=(255, 255, 255, 255),
     outer_padding=40,  # padding between canvas edge and columns
+    resize_cache=None,
+    optimize_layout=False,
 ):
     """
     Arrange product images in a masonry layout:
@@ -53,6 +257,35 @@ def arrange_products_masonry(
     - Then, within each column, items are vertically distributed:
         * Edge columns: space-between (touch top & bottom)
         * Middle columns: space-around (float more inside)
+
+    With a ResizeCache, resized items are reused across collages. With
+    optimize_layout, the column count and item order are searched for the
+    largest products (see layout_search).
+    """
+    with metrics.stage("plan"):
+        layout = plan_masonry(images, canvas_width, canvas_height, outer_padding, optimize_layout)
+    if layout is None:
+        return None
+
+    return paint_masonry(
+        images, layout, canvas_width, canvas_height, bg_color, outer_padding, resize_cache
+    )
+
+
+def plan_masonry(
+    images, canvas_width=800, canvas_height=1000, outer_padding=40, optimize=False
+):
+    """
+    Compute the masonry layout (see arrange_products_masonry) from image
+    sizes alone.
+
+    With optimize, the column count and placement order come from
+    layout_search.search_layout (the layout with the most product area)
+    instead of the item-count rule and input order.
+
+    Returns a dict with num_cols, col_width, the placement order, the final
+    (w, h) of each image and its (col_idx, y) placement, or None if there
+    are no images.
     """
     num_images = len(images)
     if num_images == 0:
@@ -69,6 +302,17 @@ def arrange_products_masonry(
     else:
         num_cols = 4
 
+    order = list(range(num_images))
+    if optimize:
+        num_cols, order, report = search_layout(
+            [img.size for _, img in images], num_cols, canvas_width, canvas_height, outer_padding
+        )
+        gain = report["area"] / report["defaultArea"] - 1 if report["defaultArea"] else 0.0
+        print(
+            f"Layout search: {report['candidates']} candidates in {report['elapsedMs']:.1f}ms, "
+            f"product area {gain:+.1%}"
+        )
+
     # Compute column width
     total_h_padding = outer_padding * (num_cols + 1)
     col_width = (canvas_width - total_h_padding) // num_cols
@@ -93,13 +337,14 @@ def arrange_products_masonry(
     def plan_layout(sizes, vertical_gap=20):
         """Given a list of (w, h), assign each to a column and return placements + max col height."""
         heights = [outer_padding] * num_cols  # current bottom of each column
-        placements = []  # for each image index: (col_idx, y)
+        placements = [None] * len(sizes)  # for each image index: (col_idx, y)
 
-        for w, h in sizes:
+        for i in order:
+            w, h = sizes[i]
             # choose column with smallest current height
             col_idx = min(range(num_cols), key=lambda i: heights[i])
             y = heights[col_idx]
-            placements.append((col_idx, y))
+            placements[i] = (col_idx, y)
             heights[col_idx] += h + vertical_gap
 
         max_height = max(heights) if heights else outer_padding
@@ -131,8 +376,8 @@ def arrange_products_masonry(
 
     # ---- Vertically redistribute within each column ----
     cols = [[] for _ in range(num_cols)]
-    for i, (c_idx, y) in enumerate(placements):
-        cols[c_idx].append(i)
+    for i in order:
+        cols[placements[i][0]].append(i)
 
     for c_idx in range(num_cols):
         indices = cols[c_idx]
@@ -167,67 +412,104 @@ def arrange_products_masonry(
             placements[img_index] = (c_idx, y)
             y += final_sizes[img_index][1] + spacing
 
+    return {
+        "num_cols": num_cols,
+        "col_width": col_width,
+        "order": order,
+        "sizes": final_sizes,
+        "placements": placements,
+    }
+
+
+def paint_masonry(
+    images,
+    layout,
+    canvas_width=800,
+    canvas_height=1000,
+    bg_color=(255, 255, 255, 255),
+    outer_padding=40,
+    resize_cache=None,
+):
+    """
+    Paste images onto a new canvas at the positions from plan_masonry.
+    Returns (canvas, bounding boxes).
+    """
     # Create canvas
     canvas = Image.new("RGBA", (canvas_width, canvas_height), bg_color)
+    metrics.count("canvasBytes", canvas_width * canvas_height * 4)
 
     # Collect bounding boxes for each product
     bounding_boxes = []
 
     # Paste each image
-    for (filename, img), (w, h), (col_idx, y) in zip(images, final_sizes, placements):
+    for filename, img, (w, h), (x, y), col_idx in item_placements(images, layout, outer_padding):
+        img_resized = resized_item(img, (w, h), resize_cache)
+
+        with metrics.stage("paste"):
+            canvas.paste(img_resized, (x, y), img_resized)
+        print(f"  Placed {filename} at ({x}, {y}) in column {col_idx}")
+
+        box = item_box(filename, x, y, w, h)
+        if box:
+            bounding_boxes.append(box)
+
+    print("\nImages arranged in masonry layout with mixed space-between/space-around")
+    return canvas, bounding_boxes
+
+
+def item_placements(images, layout, outer_padding=40):
+    """
+    Yield (filename, image, (w, h), (x, y), column) for every item that
+    plan_masonry gave a non-empty size.
+    """
+    col_width = layout["col_width"]
+    for (filename, img), (w, h), (col_idx, y) in zip(images, layout["sizes"], layout["placements"]):
         if w == 0 or h == 0:
             continue
 
-        img_resized = img.resize((w, h), Image.Resampling.LANCZOS)
-
         # X position: left padding + column offset + center within column width
         x_col_start = outer_padding + col_idx * (col_width + outer_padding)
         x = x_col_start + (col_width - w) // 2
+        yield filename, img, (w, h), (x, int(y)), col_idx
 
-        canvas.paste(img_resized, (x, int(y)), img_resized)
-        print(f"  Placed {filename} at ({x}, {int(y)}) in column {col_idx}")
-
-        # Extract clothing item ID from filename (format: item-{id}.{ext})
-        match = re.match(r'item-(\d+)\.\w+', filename)
-        if match:
-            item_id = int(match.group(1))
-            bounding_boxes.append({
-                'itemId': item_id,
-                'x': x,
-                'y': int(y),
-                'width': w,
-                'height': h
-            })
-
-    print("\nImages arranged in masonry layout with mixed space-between/space-around")
-    return canvas, bounding_boxes
 
+def resized_item(img, size, resize_cache=None):
+    """An item resized to its final size with LANCZOS, through the cache if given."""
+    with metrics.stage("resize"):
+        if resize_cache is not None:
+            return resize_cache.resize(img, size)
+        return img.resize(size, Image.Resampling.LANCZOS)
 
-def merge_with_inspiration(inspiration_path, collage_img, bounding_boxes, gap=40):
-    """
-    Merge inspiration photo (left) with clothing collage (right).
 
-    Inspiration photo is scaled to fit within 800x1000 (matching collage size).
-    Uses contain behavior - entire image visible, scaled as large as possible.
+def item_box(filename, x, y, w, h):
+    """Bounding box of a placed item, or None if its filename has no item ID."""
+    # Extract clothing item ID from filename (format: item-{id}.{ext})
+    match = re.match(r'item-(\d+)\.\w+', filename)
+    if not match:
+        return None
+    return {
+        'itemId': int(match.group(1)),
+        'x': x,
+        'y': y,
+        'width': w,
+        'height': h
+    }
 
-    Args:
-        inspiration_path: Path to the inspiration photo
-        collage_img: PIL Image of the clothing collage (800x1000)
-        bounding_boxes: List of bounding box dicts with x, y, width, height
-        gap: Gap in pixels between the two images (default 40)
 
-    Returns:
-        Tuple of (PIL Image of the merged collage, adjusted bounding boxes)
+def scale_inspiration(inspiration_path, target_width, target_height):
+    """
+    Scale the inspiration photo to fit (contain) the target size. Returns
+    the scaled RGBA image and the (x, y) offset that centers it.
     """
     # Load inspiration photo
     print(f"\nLoading inspiration photo from {inspiration_path}")
-    inspiration = Image.open(inspiration_path)
-    if inspiration.mode != "RGBA":
-        inspiration = inspiration.convert("RGBA")
-
-    # Target dimensions (match collage size)
-    target_width = 800
-    target_height = 1000
+    if isinstance(inspiration_path, Image.Image):
+        inspiration = inspiration_path.convert("RGBA")
+    elif isinstance(inspiration_path, LazyImage):
+        inspiration = inspiration_path  # preloaded for several variants
+    else:
+        inspiration = LazyImage(inspiration_path)
+        metrics.count("inspirationPixels", inspiration.width * inspiration.height)
 
     # Calculate scale to fit within the target area (contain behavior)
     # Scale so the entire image fits, maintaining aspect ratio
@@ -235,22 +517,71 @@ def merge_with_inspiration(inspiration_path, collage_img, bounding_boxes, gap=40
     scale_height = target_height / inspiration.height
     scale = min(scale_width, scale_height)  # Use min to contain/fit
 
-    # Resize to fit within bounds
+    # Resize to fit within bounds (decoded straight at about this size)
     new_width = int(inspiration.width * scale)
     new_height = int(inspiration.height * scale)
     inspiration_scaled = inspiration.resize((new_width, new_height), Image.Resampling.LANCZOS)
     print(f"Inspiration photo scaled to {new_width}x{new_height} (fit within {target_width}x{target_height})")
 
-    # Create a white background canvas of target size
-    inspiration_canvas = Image.new("RGBA", (target_width, target_height), (255, 255, 255, 255))
-
-    # Center the scaled image on the canvas
+    # Center the scaled image in the target area
     paste_x = (target_width - new_width) // 2
     paste_y = (target_height - new_height) // 2
+    return inspiration_scaled, (paste_x, paste_y)
+
+
+def inspiration_panel(inspiration_path, target_width, target_height):
+    """
+    Scale the inspiration photo to fit (contain) and center it on a white
+    canvas of the target size.
+    """
+    inspiration_scaled, (paste_x, paste_y) = scale_inspiration(
+        inspiration_path, target_width, target_height
+    )
+
+    # Create a white background canvas of target size
+    inspiration_canvas = Image.new("RGBA", (target_width, target_height), (255, 255, 255, 255))
+    metrics.count("canvasBytes", target_width * target_height * 4)
     inspiration_canvas.paste(inspiration_scaled, (paste_x, paste_y), inspiration_scaled)
     print(f"Inspiration photo centered at ({paste_x}, {paste_y})")
+    return inspiration_canvas
+
+
+def merge_with_inspiration(
+    inspiration_path, collage_img, bounding_boxes, gap=40, panel_cache=None
+):
+    """
+    Merge inspiration photo (left) with clothing collage (right).
 
-    # Collage is already 800x1000
+    Inspiration photo is scaled to fit within the collage size (800x1000 by default).
+    Uses contain behavior - entire image visible, scaled as large as possible.
+
+    Args:
+        inspiration_path: Path, file-like object or already decoded PIL Image
+            of the inspiration photo
+        collage_img: PIL Image of the clothing collage (800x1000)
+        bounding_boxes: List of bounding box dicts with x, y, width, height
+        gap: Gap in pixels between the two images (default 40)
+        panel_cache: RenderCache holding inspiration panels by fingerprint (optional)
+
+    Returns:
+        Tuple of (PIL Image of the merged collage, adjusted bounding boxes)
+    """
+    # Target dimensions (match collage size)
+    target_width = collage_img.width
+    target_height = collage_img.height
+
+    if panel_cache is not None and not isinstance(inspiration_path, Image.Image):
+        panel_key = panel_fingerprint(inspiration_path, target_width, target_height)
+        inspiration_canvas = panel_cache.get_panel(panel_key, (target_width, target_height))
+        if inspiration_canvas is None:
+            inspiration_canvas = inspiration_panel(inspiration_path, target_width, target_height)
+            panel_cache.put_panel(panel_key, inspiration_canvas)
+        else:
+            print(f"\nInspiration panel reused from cache")
+    else:
+        inspiration_canvas = inspiration_panel(inspiration_path, target_width, target_height)
+
+    # Collage is already target size
     collage_width = collage_img.width
     collage_height = collage_img.height
 
@@ -262,6 +593,7 @@ def merge_with_inspiration(inspiration_path, collage_img, bounding_boxes, gap=40
 
     # Create white canvas
     merged = Image.new("RGBA", (total_width, canvas_height), (255, 255, 255, 255))
+    metrics.count("canvasBytes", total_width * canvas_height * 4)
 
     # Paste inspiration canvas on left (no vertical offset needed, same height)
     merged.paste(inspiration_canvas, (0, 0), inspiration_canvas)
@@ -282,19 +614,1176 @@ def merge_with_inspiration(inspiration_path, collage_img, bounding_boxes, gap=40
     return merged, adjusted_boxes
 
 
+def compose_collage(
+    images,
+    layout,
+    canvas_width=800,
+    canvas_height=1000,
+    inspiration=None,
+    bg_color=(255, 255, 255, 255),
+    outer_padding=40,
+    gap=40,
+    resize_cache=None,
+    panel_cache=None,
+):
+    """
+    Paint the product panel (paint_masonry) and, with an inspiration photo,
+    the inspiration panel to its left (merge_with_inspiration) straight into
+    one preallocated buffer. Only the pixels under each item and under the
+    scaled photo are blended (see composite), and no intermediate canvases
+    are made; the pixels and bounding boxes are the same as those paths'.
+
+    Args:
+        images: List of (filename, image) tuples
+        layout: plan_masonry result for images at this canvas size
+        inspiration: Path, file-like object or image of the inspiration photo (optional)
+        resize_cache: ResizeCache for the item resizes (optional)
+        panel_cache: RenderCache holding inspiration panels by fingerprint (optional)
+
+    Returns:
+        Tuple of (PIL Image, bounding boxes)
+    """
+    collage_x = canvas_width + gap if inspiration is not None else 0
+    total_width = collage_x + canvas_width
+
+    buffer = composite.new_buffer(total_width, canvas_height)
+    if bg_color != composite.WHITE:
+        composite.fill(buffer[:, collage_x:], bg_color)
+    metrics.count("canvasBytes", buffer.nbytes)
+    print(f"Composing {total_width}x{canvas_height} canvas")
+
+    if inspiration is not None:
+        with metrics.stage("merge"):
+            draw_inspiration(buffer, inspiration, canvas_width, canvas_height, panel_cache)
+
+    bounding_boxes = []
+    drawn = []
+    for filename, img, (w, h), (x, y), col_idx in item_placements(images, layout, outer_padding):
+        img_resized = resized_item(img, (w, h), resize_cache)
+
+        with metrics.stage("paste"):
+            composite.blend(buffer, img_resized, collage_x + x, y)
+        print(f"  Placed {filename} at ({collage_x + x}, {y}) in column {col_idx}")
+        drawn.append((collage_x + x, y, w, h))
+
+        box = item_box(filename, collage_x + x, y, w, h)
+        if box:
+            bounding_boxes.append(box)
+
+    if inspiration is not None:
+        # Pasting the product panel onto the white merged canvas blends it
+        # once more with its own alpha; opaque pixels come through as they
+        # are, so with an opaque background only the items need it
+        with metrics.stage("merge"):
+            if bg_color[3] == 255:
+                for box in composite.disjoint_boxes(drawn):
+                    composite.flatten(buffer, box)
+            else:
+                composite.flatten(buffer, (collage_x, 0, canvas_width, canvas_height))
+
+    return composite.to_image(buffer), bounding_boxes
+
+
+def draw_inspiration(buffer, inspiration, target_width, target_height, panel_cache=None):
+    """
+    Draw the inspiration panel (inspiration_panel, merged as
+    merge_with_inspiration does) into the white left part of the buffer.
+    """
+    if panel_cache is not None and not isinstance(inspiration, Image.Image):
+        panel_key = panel_fingerprint(inspiration, target_width, target_height)
+        panel = panel_cache.get_panel(panel_key, (target_width, target_height))
+        if panel is not None:
+            print(f"\nInspiration panel reused from cache")
+            # Blending the panel over white is what pasting it onto the merged canvas does
+            composite.blend(buffer, panel, 0, 0)
+            return
+    else:
+        panel_key = None
+
+    scaled, (paste_x, paste_y) = scale_inspiration(inspiration, target_width, target_height)
+    composite.blend(buffer, scaled, paste_x, paste_y)
+    print(f"Inspiration photo centered at ({paste_x}, {paste_y})")
+    if panel_key is not None:
+        panel = buffer[:target_height, :target_width].copy()
+        panel_cache.put_panel(panel_key, composite.to_image(panel))
+    composite.flatten(buffer, (paste_x, paste_y, scaled.width, scaled.height))
+
+
+def render_collage(
+    images,
+    inspiration=None,
+    canvas_width=800,
+    canvas_height=1000,
+    resize_cache=None,
+    render_cache=None,
+    optimize_layout=False,
+):
+    """
+    Run the full layout for one outfit: masonry collage plus optional inspiration merge.
+
+    Args:
+        images: List of (filename, PIL Image) tuples
+        inspiration: Path or file-like object of the inspiration photo (optional)
+        canvas_width: Width of the product panel
+        canvas_height: Height of the product panel
+        resize_cache: ResizeCache shared across collages (optional)
+        render_cache: RenderCache for the inspiration panel (optional)
+        optimize_layout: Search column counts and orderings for the largest products
+
+    Returns:
+        Tuple of (PIL Image, bounding boxes), or (None, []) if there was nothing to arrange
+    """
+    with metrics.stage("plan"):
+        layout = plan_masonry(images, canvas_width, canvas_height, optimize=optimize_layout)
+    if layout is None:
+        return None, []
+
+    return compose_collage(
+        images,
+        layout,
+        canvas_width,
+        canvas_height,
+        inspiration=inspiration,
+        resize_cache=resize_cache,
+        panel_cache=render_cache,
+    )
+
+
+# Canvas variants: the product panel size of each output, whether the
+# inspiration photo is merged in on the left (doubling the width plus gap),
+# and optionally a fixed output size the render is centered (letterboxed)
+# in, e.g. when there is no inspiration photo to merge
+VARIANTS = {
+    "panel": {"width": 800, "height": 1000, "inspiration": False},
+    "merged": {"width": 800, "height": 1000, "inspiration": True},
+    "square": {"width": 600, "height": 600, "inspiration": False},
+    "og": {"width": 580, "height": 630, "inspiration": True, "canvas": (1200, 630)},
+}
+
+
+def contain_size(size, box):
+    """Largest (w, h) with the aspect ratio of size that fits inside box."""
+    scale = min(box[0] / size[0], box[1] / size[1])
+    return int(size[0] * scale), int(size[1] * scale)
+
+
+def letterbox(img, bounding_boxes, size, bg_color=(255, 255, 255, 255)):
+    """Center a render on a canvas of the given size; returns it and the shifted boxes."""
+    if img.size == tuple(size):
+        return img, bounding_boxes
+    canvas = Image.new("RGBA", size, bg_color)
+    metrics.count("canvasBytes", size[0] * size[1] * 4)
+    offset_x = (size[0] - img.width) // 2
+    offset_y = (size[1] - img.height) // 2
+    canvas.paste(img, (offset_x, offset_y))
+    print(f"Letterboxed {img.width}x{img.height} into {size[0]}x{size[1]}")
+    shifted = [
+        {**box, "x": box["x"] + offset_x, "y": box["y"] + offset_y} for box in bounding_boxes
+    ]
+    return canvas, shifted
+
+
+def render_variants(
+    images, variants, inspiration=None, resize_cache=None, optimize_layout=False
+):
+    """
+    Render several canvas variants of one outfit from a single decode pass.
+
+    Every variant is planned from the image headers first. Each lazily loaded
+    item (and the inspiration photo) is then decoded once, for the largest
+    size any variant needs (LazyImage.preload), and every variant resizes
+    from that decode exactly once, as a single render would, with its own
+    bounding boxes. A variant with a "canvas" size is letterboxed to it.
+
+    Args:
+        images: List of (filename, image) tuples
+        variants: Dict of name -> {"width", "height", "inspiration"} (see VARIANTS)
+        inspiration: Path, file-like object or image of the inspiration photo (optional)
+        resize_cache: ResizeCache used for the shared decode (optional)
+        optimize_layout: Search each variant's layout for the largest products
+
+    Returns:
+        Dict of name -> (PIL Image, bounding boxes); empty if there was nothing to arrange
+    """
+    with metrics.stage("plan"):
+        layouts = {
+            name: plan_masonry(images, spec["width"], spec["height"], optimize=optimize_layout)
+            for name, spec in variants.items()
+        }
+    if not images or any(layout is None for layout in layouts.values()):
+        return {}
+
+    # Decode each lazy item once, for the largest size any variant pastes it
+    # at; already decoded images (cutouts) are resized from themselves
+    shared = []
+    for index, (filename, img) in enumerate(images):
+        largest = max(
+            (layout["sizes"][index] for layout in layouts.values()),
+            key=lambda size: size[0] * size[1],
+        )
+        if isinstance(img, LazyImage) and largest[0] and largest[1]:
+            with metrics.stage("resize"):
+                img = img.preload(largest)
+        shared.append((filename, img))
+
+    # Same for the inspiration photo, at the largest panel it is merged into
+    merged_boxes = [
+        (spec["width"], spec["height"]) for spec in variants.values() if spec["inspiration"]
+    ]
+    shared_inspiration = None
+    if inspiration is not None and merged_boxes:
+        if isinstance(inspiration, Image.Image):
+            shared_inspiration = inspiration
+        else:
+            source = LazyImage(inspiration)
+            largest = max(
+                (contain_size(source.size, box) for box in merged_boxes),
+                key=lambda size: size[0] * size[1],
+            )
+            metrics.count("inspirationPixels", source.width * source.height)
+            with metrics.stage("merge"):
+                shared_inspiration = source.preload(largest)
+
+    rendered = {}
+    for name, spec in variants.items():
+        print(f"\nRendering variant {name} ({spec['width']}x{spec['height']})")
+        img, bounding_boxes = compose_collage(
+            shared,
+            layouts[name],
+            spec["width"],
+            spec["height"],
+            inspiration=shared_inspiration if spec["inspiration"] else None,
+            resize_cache=resize_cache,
+        )
+        if spec.get("canvas"):
+            img, bounding_boxes = letterbox(img, bounding_boxes, spec["canvas"])
+        rendered[name] = img, bounding_boxes
+
+    return rendered
+
+
+# ---------------------------------------------------------------------------
+# Output encoding
+# ---------------------------------------------------------------------------
+
+OUTPUT_FORMATS = ("png", "webp", "avif", "jpeg")
+DEFAULT_QUALITY = 85  # lossy formats
+PNG_COMPRESS_LEVEL = 6  # zlib level, 0-9
+FORMAT_EXTENSIONS = {"png": ".png", "webp": ".webp", "avif": ".avif", "jpeg": ".jpg"}
+
+
+def format_from_path(path):
+    """Output format implied by a file extension, defaulting to png."""
+    ext = os.path.splitext(path.lower())[1]
+    for fmt, fmt_ext in FORMAT_EXTENSIONS.items():
+        if ext == fmt_ext or (fmt == "jpeg" and ext == ".jpeg"):
+            return fmt
+    return "png"
+
+
+def flatten_onto_white(img):
+    """
+    An RGB copy of an RGBA collage composited over opaque white. Pasting
+    items and panels with their own alpha as the mask leaves partly
+    transparent pixels on the canvas (alpha down to ~190 along anti-aliased
+    edges), so its alpha is never fully opaque, even though it is meant to
+    be shown on white.
+    """
+    if img.mode != "RGBA":
+        return img.convert("RGB")
+    alpha = img.getchannel("A")
+    if alpha.getextrema() == (255, 255):
+        return img.convert("RGB")
+    flattened = Image.new("RGB", img.size, (255, 255, 255))
+    flattened.paste(img, mask=alpha)
+    return flattened
+
+
+def encode_collage(
+    img,
+    fmt="png",
+    quality=DEFAULT_QUALITY,
+    png_compress_level=PNG_COMPRESS_LEVEL,
+    png_optimize=False,
+):
+    """
+    Encode a collage to bytes.
+
+    The canvas is flattened onto white first, so every format gets the same
+    opaque RGB image. JPEG is written progressive; WebP/AVIF/JPEG use `quality`; PNG uses
+    `png_compress_level` and, optionally, the slower `png_optimize` pass.
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {fmt!r}; expected one of {OUTPUT_FORMATS}")
+
+    img = flatten_onto_white(img)
+    buffer = BytesIO()
+
+    if fmt == "png":
+        img.save(buffer, "PNG", compress_level=png_compress_level, optimize=png_optimize)
+    elif fmt == "jpeg":
+        img.save(buffer, "JPEG", quality=quality, progressive=True, optimize=True)
+    elif fmt == "webp":
+        img.save(buffer, "WEBP", quality=quality, method=4)
+    else:
+        from PIL import features
+
+        if not features.check("avif"):
+            raise RuntimeError("This Pillow build has no AVIF support")
+        img.save(buffer, "AVIF", quality=quality)
+
+    return buffer.getvalue()
+
+
+def save_collage(img, output_file, fmt=None, **encode_options):
+    """Encode a collage (format from the extension unless given) and write it atomically."""
+    data = encode_collage(img, fmt or format_from_path(output_file), **encode_options)
+    write_atomic(output_file, data)
+    return len(data)
+
+
+def encoding_report(img, quality=DEFAULT_QUALITY):
+    """Bytes and encode time of one collage in every available format/setting."""
+    from PIL import features
+
+    candidates = [
+        ("png", {"png_compress_level": 6}),
+        ("png", {"png_compress_level": 9, "png_optimize": True}),
+        ("jpeg", {"quality": quality}),
+        ("webp", {"quality": quality}),
+    ]
+    if features.check("avif"):
+        candidates.append(("avif", {"quality": quality}))
+
+    # Baseline: what main() used to write (RGBA PNG, default settings)
+    start = time.perf_counter()
+    buffer = BytesIO()
+    img.save(buffer, "PNG")
+    report = [
+        {
+            "format": "png-rgba-baseline",
+            "options": {},
+            "bytes": buffer.tell(),
+            "encodeMs": round((time.perf_counter() - start) * 1000, 2),
+        }
+    ]
+
+    for fmt, options in candidates:
+        start = time.perf_counter()
+        data = encode_collage(img, fmt, **options)
+        report.append(
+            {
+                "format": fmt,
+                "options": options,
+                "bytes": len(data),
+                "encodeMs": round((time.perf_counter() - start) * 1000, 2),
+            }
+        )
+
+    return report
+
+
+# ---------------------------------------------------------------------------
+# Fingerprints
+#
+# A render is identified by the hashes of its input images, the layout code,
+# the canvas size and the encoder settings. With a RenderCache, a render whose
+# fingerprint was seen before is answered from disk without decoding anything.
+# ---------------------------------------------------------------------------
+
+
+@functools.lru_cache(maxsize=None)
+def layout_version():
+    """
+    Hash of everything that decides a render's pixels and bytes: the layout,
+    decode, resize, compositing and encoding code, their settings and the
+    Pillow version, so changing any of them invalidates old renders.
+    """
+    code = [
+        LazyImage,
+        ResizeCache,
+        composite,
+        layout_search,
+        plan_masonry,
+        item_placements,
+        resized_item,
+        item_box,
+        scale_inspiration,
+        compose_collage,
+        draw_inspiration,
+        render_collage,
+        flatten_onto_white,
+        encode_collage,
+    ]
+    payload = {
+        "renderVersion": RENDER_VERSION,
+        "decodeReducingGap": DECODE_REDUCING_GAP,
+        "pillow": PIL.__version__,
+        "source": "".join(inspect.getsource(obj) for obj in code),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def panel_fingerprint(inspiration, target_width, target_height):
+    """Fingerprint of an inspiration panel: photo content, panel size and layout code."""
+    payload = {
+        "layout": layout_version(),
+        "inspiration": LazyImage(inspiration).info["digest"],
+        "size": [target_width, target_height],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def render_fingerprint(
+    images, inspiration, canvas_width, canvas_height, fmt, encode_options, optimize_layout=False
+):
+    """Fingerprint of a finished, encoded collage."""
+    payload = {
+        "layout": layout_version(),
+        "items": [[name, image_digest(img)] for name, img in images],
+        "inspiration": LazyImage(inspiration).info["digest"] if inspiration is not None else None,
+        "canvas": [canvas_width, canvas_height],
+        "optimizeLayout": optimize_layout,
+        "format": fmt,
+        "encode": encode_options,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def render_and_encode(
+    images,
+    inspiration=None,
+    canvas_width=800,
+    canvas_height=1000,
+    resize_cache=None,
+    render_cache=None,
+    fmt="png",
+    encode_options=None,
+    optimize_layout=False,
+):
+    """
+    Render and encode one collage, answering from the RenderCache when its
+    fingerprint has been rendered before.
+
+    Returns a dict with the encoded bytes ("data"), "boundingBoxes", "width",
+    "height" and whether it was a cache "hit", or None if there was nothing
+    to arrange.
+    """
+    encode_options = encode_options or {}
+
+    if render_cache is not None:
+        fingerprint = render_fingerprint(
+            images, inspiration, canvas_width, canvas_height, fmt, encode_options, optimize_layout
+        )
+        cached = render_cache.get(fingerprint)
+        if cached is not None:
+            data, meta = cached
+            print(f"Unchanged inputs (fingerprint {fingerprint[:12]}), reusing previous render")
+            return dict(meta, data=data, hit=True)
+
+    collage, bounding_boxes = render_collage(
+        images,
+        inspiration=inspiration,
+        canvas_width=canvas_width,
+        canvas_height=canvas_height,
+        resize_cache=resize_cache,
+        render_cache=render_cache,
+        optimize_layout=optimize_layout,
+    )
+    if collage is None:
+        return None
+
+    with metrics.stage("encode"):
+        data = encode_collage(collage, fmt, **encode_options)
+    meta = {
+        "boundingBoxes": bounding_boxes,
+        "width": collage.width,
+        "height": collage.height,
+        "format": fmt,
+    }
+    if render_cache is not None:
+        render_cache.put(fingerprint, data, meta)
+
+    return dict(meta, data=data, hit=False, image=collage)
+
+
+# ---------------------------------------------------------------------------
+# Worker mode
+#
+# A long-lived process that renders collages on request, so each collage only
+# pays for the render itself instead of interpreter start-up and PIL imports.
+# Frames are a 4-byte big-endian length followed by a UTF-8 JSON body, both on
+# stdin/stdout and on the Unix socket.
+#
+# Request:  {"id": ..., "items": [{"name": "item-12.png", "path": "..."} |
+#                                 {"name": "item-12.png", "data": "<base64>"}],
+#            "inspiration": {"path": ...} | {"data": ...} | null,
+#            "canvasWidth": 800, "canvasHeight": 1000,
+#            "format": "png" | "webp" | "avif" | "jpeg", "quality": 85,
+#            "optimizeLayout": false}
+#           {"op": "stats"} returns the worker's throughput counters.
+# Reply:    {"id": ..., "ok": true, "image": "<base64>", "format": "png",
+#            "boundingBoxes": [...], "width": ..., "height": ..., "renderMs": ...,
+#            "metrics": {"stagesMs": {...}, "counters": {...}, ...}}
+#           {"id": ..., "ok": false, "error": "..."}
+# ---------------------------------------------------------------------------
+
+FRAME_HEADER = struct.Struct(">I")
+
+
+def read_frame(stream):
+    """
+    Read one length-prefixed JSON frame. Returns None at end of stream and
+    raises ValueError if the body is not JSON (the stream stays in sync).
+    """
+    header = stream.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    body = stream.read(length)
+    if len(body) < length:
+        return None
+    return json.loads(body.decode("utf-8"))
+
+
+def write_frame(stream, message):
+    """Write one length-prefixed JSON frame and flush it."""
+    body = json.dumps(message).encode("utf-8")
+    stream.write(FRAME_HEADER.pack(len(body)) + body)
+    stream.flush()
+
+
+def payload_source(entry):
+    """Resolve an image given as {"path": ...} or {"data": <base64>} to something Image.open accepts."""
+    if entry.get("data") is not None:
+        return BytesIO(base64.b64decode(entry["data"]))
+    return entry["path"]
+
+
+def load_payload_images(items, cutout_cache=None):
+    """Load the (filename, image) list for a worker request (see load_cutout)."""
+    images = []
+    for index, entry in enumerate(items):
+        name = entry.get("name") or os.path.basename(entry.get("path") or f"item-{index}.png")
+        images.append((name, load_cutout(payload_source(entry), cutout_cache)))
+    return images
+
+
+class WorkerStats:
+    """Throughput counters reported by the worker."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.render_seconds = 0.0
+
+    def as_dict(self):
+        uptime = time.perf_counter() - self.started
+        served = self.requests - self.errors
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "uptimeSeconds": round(uptime, 3),
+            "requestsPerSecond": round(self.requests / uptime, 3) if uptime > 0 else 0.0,
+            "renderRequestsPerSecond": (
+                round(served / self.render_seconds, 3) if self.render_seconds > 0 else 0.0
+            ),
+            "meanRenderMs": (
+                round(1000 * self.render_seconds / served, 3) if served else 0.0
+            ),
+        }
+
+
+def handle_request(request, stats, caches):
+    """
+    Render one worker request and build its reply. caches holds the
+    worker's "cutout", "resize" and "render" caches (any may be None).
+    """
+    if request.get("op") == "stats":
+        reply = {"id": request.get("id"), "ok": True, "stats": stats.as_dict()}
+        for name, cache in caches.items():
+            if cache is not None:
+                reply[f"{name}Cache"] = cache.stats()
+        return reply
+
+    stats.requests += 1
+    start = time.perf_counter()
+    try:
+        # Keep layout chatter off the frame stream
+        with contextlib.redirect_stdout(sys.stderr), metrics.collect() as collected:
+            with metrics.stage("load"):
+                images = load_payload_images(request.get("items") or [], caches.get("cutout"))
+            inspiration = request.get("inspiration")
+            fmt = request.get("format", "png")
+            result = render_and_encode(
+                images,
+                inspiration=payload_source(inspiration) if inspiration else None,
+                canvas_width=int(request.get("canvasWidth", 800)),
+                canvas_height=int(request.get("canvasHeight", 1000)),
+                resize_cache=caches.get("resize"),
+                render_cache=caches.get("render"),
+                fmt=fmt,
+                encode_options={"quality": int(request.get("quality", DEFAULT_QUALITY))},
+                optimize_layout=bool(request.get("optimizeLayout", False)),
+            )
+        if result is None:
+            raise ValueError("No images to arrange")
+    except Exception as e:
+        stats.errors += 1
+        return {"id": request.get("id"), "ok": False, "error": str(e)}
+
+    elapsed = time.perf_counter() - start
+    stats.render_seconds += elapsed
+    return {
+        "id": request.get("id"),
+        "ok": True,
+        "image": base64.b64encode(result["data"]).decode("ascii"),
+        "format": fmt,
+        "boundingBoxes": result["boundingBoxes"],
+        "width": result["width"],
+        "height": result["height"],
+        "cached": result["hit"],
+        "renderMs": round(elapsed * 1000, 3),
+        "metrics": collected.as_dict(),
+    }
+
+
+def serve_stream(stream_in, stream_out, stats, caches):
+    """Answer frames from stream_in until it closes."""
+    while True:
+        try:
+            request = read_frame(stream_in)
+            if request is not None and not isinstance(request, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            # Only the body was bad: its length was read, so the next frame is intact
+            stats.requests += 1
+            stats.errors += 1
+            write_frame(stream_out, {"id": None, "ok": False, "error": f"Malformed frame: {e}"})
+            continue
+        if request is None:
+            return
+        write_frame(stream_out, handle_request(request, stats, caches))
+
+
+def serve(socket_path=None, caches=None):
+    """
+    Run the render worker on stdin/stdout, or on a Unix socket if socket_path is given.
+    The worker always keeps an in-memory ResizeCache across requests.
+    """
+    stats = WorkerStats()
+    caches = dict(caches or {})
+    if caches.get("resize") is None:
+        caches["resize"] = ResizeCache()
+
+    if not socket_path:
+        print("Collage worker listening on stdin", file=sys.stderr)
+        serve_stream(sys.stdin.buffer, sys.stdout.buffer, stats, caches)
+        print(f"Collage worker stats: {json.dumps(stats.as_dict())}", file=sys.stderr)
+        return
+
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            serve_stream(self.rfile, self.wfile, stats, caches)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    with socketserver.UnixStreamServer(socket_path, Handler) as server:
+        print(f"Collage worker listening on {socket_path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print(f"Collage worker stats: {json.dumps(stats.as_dict())}", file=sys.stderr)
+            os.unlink(socket_path)
+
+
+def time_worker(request, num_requests, worker_args=()):
+    """Seconds a fresh --serve worker takes for num_requests copies of a request."""
+    import subprocess
+
+    worker = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", *worker_args],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        # Warm-up request so start-up cost isn't counted, as in a long-lived worker
+        write_frame(worker.stdin, request)
+        read_frame(worker.stdout)
+
+        start = time.perf_counter()
+        for i in range(num_requests):
+            write_frame(worker.stdin, dict(request, id=i))
+            reply = read_frame(worker.stdout)
+            if not reply or not reply.get("ok"):
+                raise RuntimeError(f"Worker request failed: {reply}")
+        return time.perf_counter() - start
+    finally:
+        worker.stdin.close()
+        worker.wait()
+
+
+def benchmark_worker(input_dir, inspiration_path=None, num_requests=20):
+    """
+    Compare requests/sec of one exec of arrange.py per collage against a
+    persistent worker fed over stdin. The same collage is sent every time,
+    so the worker is timed twice: with its ResizeCache off ("worker", the
+    render itself, comparable to exec-per-call) and on
+    ("workerResizeCached", every resize a cache hit after the warm-up).
+    """
+    import subprocess
+    import tempfile
+
+    script = os.path.abspath(__file__)
+    filenames = sorted(
+        f
+        for f in os.listdir(input_dir)
+        if os.path.splitext(f.lower())[1] in {".png", ".jpg", ".jpeg", ".bmp", ".gif"}
+    )
+    request = {
+        "items": [{"name": f, "path": os.path.join(input_dir, f)} for f in filenames],
+        "inspiration": {"path": inspiration_path} if inspiration_path else None,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        command = [sys.executable, script, input_dir, os.path.join(tmp, "collage.png")]
+        if inspiration_path:
+            command += ["--inspiration", inspiration_path]
+
+        start = time.perf_counter()
+        for _ in range(num_requests):
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        exec_seconds = time.perf_counter() - start
+
+    worker_seconds = time_worker(request, num_requests, ["--resize-cache-mb", "0"])
+    cached_seconds = time_worker(request, num_requests)
+
+    results = {
+        "requests": num_requests,
+        "items": len(filenames),
+        "execPerCall": {
+            "seconds": round(exec_seconds, 3),
+            "requestsPerSecond": round(num_requests / exec_seconds, 3),
+        },
+        "worker": {
+            "seconds": round(worker_seconds, 3),
+            "requestsPerSecond": round(num_requests / worker_seconds, 3),
+        },
+        "workerResizeCached": {
+            "seconds": round(cached_seconds, 3),
+            "requestsPerSecond": round(num_requests / cached_seconds, 3),
+        },
+    }
+    print(json.dumps(results, indent=2))
+    return results
+
+
+def open_caches(
+    cutout_dir=None,
+    resize_dir=None,
+    resize_bytes=RESIZE_CACHE_MAX_BYTES,
+    render_dir=None,
+    keep_resized=False,
+):
+    """
+    Build the cache set used by rendering: "cutout" (CutoutCache), "resize"
+    (ResizeCache; in memory only if keep_resized, since a single render
+    gains nothing from it) and "render" (RenderCache). Unset ones are None.
+    """
+    caches = {"cutout": None, "resize": None, "render": None}
+    if cutout_dir:
+        from cutout_cache import CutoutCache
+
+        caches["cutout"] = CutoutCache(cutout_dir)
+    if resize_dir or keep_resized:
+        caches["resize"] = ResizeCache(resize_bytes, resize_dir)
+    if render_dir:
+        from render_cache import RenderCache
+
+        caches["render"] = RenderCache(render_dir)
+    return caches
+
+
+# ---------------------------------------------------------------------------
+# Batch mode
+#
+# Re-renders many outfits from a JSONL manifest over a process pool. Each
+# line is a load_manifest_images manifest plus an "outfitId". Collages are
+# written to <out_dir>/outfit-<id>.<ext> and one result line per outfit is
+# appended to <out_dir>/results.jsonl as it finishes. Outfits that already
+# have a successful result are skipped, so an interrupted run resumes
+# where it stopped.
+# ---------------------------------------------------------------------------
+
+BATCH_RESULTS_FILE = "results.jsonl"
+
+_batch_caches = {}
+
+
+def init_batch_worker(cache_options):
+    """Pool initializer: per-process caches shared by every job in that process."""
+    _batch_caches.update(open_caches(**cache_options, keep_resized=True))
+
+
+def render_batch_job(job, out_dir, fmt="png", encode_options=None, optimize_layout=False):
+    """Render one manifest line; errors are returned in the result, not raised."""
+    start = time.perf_counter()
+    outfit_id = job.get("outfitId")
+    result = {"outfitId": outfit_id, "output": None, "boundingBoxes": None, "error": None}
+    try:
+        with metrics.quiet_stdout(True), metrics.collect() as collected:
+            with metrics.stage("load"):
+                images, inspiration = load_manifest_images(job, _batch_caches.get("cutout"))
+            rendered = render_and_encode(
+                images,
+                inspiration=inspiration,
+                resize_cache=_batch_caches.get("resize"),
+                render_cache=_batch_caches.get("render"),
+                fmt=fmt,
+                encode_options=encode_options,
+                optimize_layout=optimize_layout,
+            )
+        if rendered is None:
+            raise ValueError("No images to arrange")
+
+        output = os.path.join(out_dir, f"outfit-{outfit_id}{FORMAT_EXTENSIONS[fmt]}")
+        write_atomic(output, rendered["data"])
+
+        result["output"] = output
+        result["boundingBoxes"] = rendered["boundingBoxes"]
+        result["cached"] = rendered["hit"]
+        result["metrics"] = collected.as_dict()
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def completed_outfits(results_path):
+    """Outfit ids with a successful line in an existing results file."""
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # line cut short by an interruption
+            if not result.get("error"):
+                done.add(result.get("outfitId"))
+    return done
+
+
+def run_batch(
+    manifest_path,
+    out_dir,
+    workers=None,
+    cache_options=None,
+    fmt="png",
+    encode_options=None,
+    optimize_layout=False,
+):
+    """
+    Render every outfit in a JSONL manifest over a process pool, resuming
+    past runs. cache_options are passed to open_caches in every worker.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    os.makedirs(out_dir, exist_ok=True)
+    results_path = os.path.join(out_dir, BATCH_RESULTS_FILE)
+    done = completed_outfits(results_path)
+
+    with open(manifest_path) as f:
+        jobs = [json.loads(line) for line in f if line.strip()]
+    pending = [job for job in jobs if job.get("outfitId") not in done]
+    print(f"{len(jobs)} outfits in manifest, {len(jobs) - len(pending)} already done")
+
+    start = time.perf_counter()
+    failed = 0
+    with open(results_path, "a") as results, ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_batch_worker,
+        initargs=(cache_options or {},),
+    ) as pool:
+        futures = [
+            pool.submit(render_batch_job, job, out_dir, fmt, encode_options, optimize_layout)
+            for job in pending
+        ]
+        for count, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results.write(json.dumps(result) + "\n")
+            results.flush()
+            if result["error"]:
+                failed += 1
+                print(f"  [{count}/{len(pending)}] outfit {result['outfitId']} failed: {result['error']}")
+            else:
+                print(f"  [{count}/{len(pending)}] outfit {result['outfitId']} in {result['seconds']:.2f}s")
+
+    elapsed = time.perf_counter() - start
+    rate = len(pending) / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Rendered {len(pending) - failed}/{len(pending)} collages in {elapsed:.1f}s "
+        f"({rate:.1f}/s), results in {results_path}"
+    )
+
+
+def write_variants(
+    images,
+    variants,
+    output_file,
+    inspiration=None,
+    resize_cache=None,
+    fmt=None,
+    encode_options=None,
+    optimize_layout=False,
+):
+    """Render and save every variant; returns their files and bounding boxes by name."""
+    fmt = fmt or format_from_path(output_file)
+    stem = os.path.splitext(output_file)[0]
+
+    summary = {}
+    for name, (img, bounding_boxes) in render_variants(
+        images, variants, inspiration, resize_cache, optimize_layout
+    ).items():
+        path = f"{stem}-{name}{FORMAT_EXTENSIONS[fmt]}"
+        with metrics.stage("encode"):
+            num_bytes = save_collage(img, path, fmt, **(encode_options or {}))
+        print(f"Variant {name} saved to {path} ({img.width}x{img.height}, {num_bytes} bytes)")
+        summary[name] = {
+            "file": path,
+            "width": img.width,
+            "height": img.height,
+            "boundingBoxes": bounding_boxes,
+        }
+
+    return summary
+
+
+def print_block(name, payload):
+    """Print a JSON payload between ===NAME=== markers on stdout, for the API to capture."""
+    print(f"\n==={name}===")
+    print(json.dumps(payload))
+    print(f"==={name}_END===")
+
+
 def main():
     """Process all extracted images and create collage."""
-    import sys
     import argparse
 
     # Parse command line arguments
     parser = argparse.ArgumentParser(description="Arrange product images into a collage")
-    parser.add_argument("input_dir", help="Directory containing product images")
-    parser.add_argument("output_file", help="Output path for the collage")
+    parser.add_argument("input_dir", nargs="?", help="Directory containing product images")
+    parser.add_argument("output_file", nargs="?", help="Output path for the collage")
     parser.add_argument("--inspiration", help="Path to inspiration photo to merge (optional)")
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run as a long-lived render worker reading framed JSON requests",
+    )
+    parser.add_argument("--socket", help="Unix socket path for --serve (default: stdin/stdout)")
+    parser.add_argument(
+        "--bench-requests",
+        type=int,
+        help="Benchmark N collages from input_dir: exec-per-call vs. worker requests/sec",
+    )
+    parser.add_argument(
+        "--cutout-cache",
+        metavar="DIR",
+        help="Extract product cutouts through this content-addressed cache before arranging",
+    )
+    parser.add_argument(
+        "--store",
+        metavar="DIR",
+        help="Read cutouts from a packed store (extract.py --store) instead of input_dir; "
+        "the only positional argument is then the output file",
+    )
+    parser.add_argument(
+        "--items",
+        help="Comma-separated store ids to arrange with --store (default: all of them)",
+    )
+    parser.add_argument(
+        "--resize-cache-dir",
+        metavar="DIR",
+        help="Persist resized items here so later runs skip the LANCZOS resize",
+    )
+    parser.add_argument(
+        "--resize-cache-mb",
+        type=int,
+        default=RESIZE_CACHE_MAX_BYTES // 1024**2,
+        help="In-memory budget for resized items in MiB (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--manifest",
+        metavar="FILE",
+        help="JSON manifest of item ids and image URLs to fetch ('-' for stdin); "
+        "the only positional argument is then the output file",
+    )
+    parser.add_argument(
+        "--fetch-concurrency",
+        type=int,
+        default=FETCH_CONCURRENCY,
+        help="Simultaneous downloads for --manifest (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--batch",
+        metavar="JSONL",
+        help="Render every outfit in a JSONL manifest over a process pool (resumable)",
+    )
+    parser.add_argument("--out-dir", help="Output directory for --batch")
+    parser.add_argument(
+        "--workers", type=int, help="Processes for --batch (default: one per core)"
+    )
+
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        help="Output format (default: from the output file extension, else png)",
+    )
+    parser.add_argument(
+        "--quality",
+        type=int,
+        default=DEFAULT_QUALITY,
+        help="Quality for webp/avif/jpeg (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--png-compress-level",
+        type=int,
+        default=PNG_COMPRESS_LEVEL,
+        help="zlib level for png, 0-9 (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--png-optimize", action="store_true", help="Extra (slower) png optimize pass"
+    )
+    parser.add_argument(
+        "--variants",
+        help="Comma-separated canvas variants to render in one pass "
+        f"({', '.join(VARIANTS)}); each is written as <output>-<name>.<ext>",
+    )
+    parser.add_argument(
+        "--encode-report",
+        action="store_true",
+        help="Also print bytes and encode time of the collage in every format",
+    )
+
+    parser.add_argument(
+        "--render-cache",
+        metavar="DIR",
+        help="Reuse previous renders and inspiration panels when input fingerprints match",
+    )
+    parser.add_argument(
+        "--optimize-layout",
+        action="store_true",
+        help="Search column counts and item orders for the layout with the largest products",
+    )
+
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Write per-stage times, peak RSS, input pixels and cache stats as JSON "
+        "to FILE, or print them as a METRICS_JSON block with '-'",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="Only print the JSON blocks, no per-image chatter"
+    )
+    parser.add_argument(
+        "--profile", metavar="FILE", help="Run under cProfile, dumping stats to FILE"
+    )
+    parser.add_argument(
+        "--trace-allocations",
+        action="store_true",
+        help="Run under tracemalloc and report the top allocation sites",
+    )
 
     args = parser.parse_args()
 
+    cache_options = {
+        "cutout_dir": args.cutout_cache,
+        "resize_dir": args.resize_cache_dir,
+        "resize_bytes": args.resize_cache_mb * 1024**2,
+        "render_dir": args.render_cache,
+    }
+    encode_options = {
+        "quality": args.quality,
+        "png_compress_level": args.png_compress_level,
+        "png_optimize": args.png_optimize,
+    }
+
+    if args.batch:
+        if not args.out_dir:
+            parser.error("--batch needs --out-dir")
+        run_batch(
+            args.batch,
+            args.out_dir,
+            args.workers,
+            cache_options,
+            args.format or "png",
+            encode_options,
+            args.optimize_layout,
+        )
+        return
+
+    if (args.manifest or args.store) and not args.output_file:
+        # With a manifest or a store there is no input directory
+        args.input_dir, args.output_file = None, args.input_dir
+
+    caches = open_caches(**cache_options, keep_resized=args.serve)
+
+    if args.serve:
+        serve(args.socket, caches)
+        return
+
+    if args.bench_requests:
+        if not args.input_dir:
+            parser.error("--bench-requests needs input_dir")
+        benchmark_worker(args.input_dir, args.inspiration, args.bench_requests)
+        return
+
+    if not args.output_file or not (args.input_dir or args.manifest or args.store):
+        parser.error("input_dir (or --manifest or --store) and output_file are required")
+
+    variant_names = None
+    if args.variants:
+        variant_names = [name.strip() for name in args.variants.split(",") if name.strip()]
+        unknown = [name for name in variant_names if name not in VARIANTS]
+        if unknown:
+            parser.error(f"unknown variants: {', '.join(unknown)}")
+
+    with metrics.collect() as collected:
+        with metrics.quiet_stdout(args.quiet), metrics.profiled(
+            args.profile, args.trace_allocations
+        ):
+            blocks = render_cli(args, caches, encode_options, variant_names)
+        collected.extra["caches"] = {
+            name: cache.stats() for name, cache in caches.items() if cache is not None
+        }
+
+    for name, payload in blocks.items():
+        print_block(name, payload)
+
+    if args.metrics == "-":
+        print_block("METRICS_JSON", collected.as_dict())
+    elif args.metrics:
+        write_atomic(args.metrics, json.dumps(collected.as_dict(), indent=2).encode())
+
+
+def render_cli(args, caches, encode_options, variant_names=None):
+    """
+    Load, render and save the collage (or its variants) for main().
+
+    Returns the JSON blocks to print: BOUNDING_BOXES_JSON, or VARIANTS_JSON
+    with variant_names; empty if there was nothing to arrange.
+    """
+    cutout_cache = caches["cutout"]
+    resize_cache = caches["resize"]
     input_dir = args.input_dir
     output_file = args.output_file
     inspiration_path = args.inspiration
@@ -304,47 +1793,94 @@ def main():
     if output_dir:
         os.makedirs(output_dir, exist_ok=True)
 
+    store = None
+    if args.store:
+        from cutout_store import CutoutStore
+
+        store = CutoutStore(args.store)
+
     # Load images
-    print(f"Loading images from {input_dir}/\n")
-    images = load_product_images(input_dir)
+    inspiration = None
+    with metrics.stage("load"):
+        if args.manifest:
+            print(f"Fetching images from manifest {args.manifest}\n")
+            if args.manifest == "-":
+                manifest = json.load(sys.stdin)
+            else:
+                with open(args.manifest) as f:
+                    manifest = json.load(f)
+            images, inspiration = load_manifest_images(
+                manifest, cutout_cache, args.fetch_concurrency, store
+            )
+        elif store is not None:
+            print(f"Loading cutouts from store {args.store}/\n")
+            ids = [i.strip() for i in args.items.split(",") if i.strip()] if args.items else None
+            images = load_store_images(store, ids)
+        else:
+            print(f"Loading images from {input_dir}/\n")
+            images = load_product_images(input_dir, cutout_cache)
 
     if not images:
-        print(f"No images found in {input_dir}/")
-        return
+        print(f"No images found in {input_dir or args.manifest or args.store}")
+        return {}
+
+    if inspiration is None and inspiration_path:
+        if os.path.exists(inspiration_path):
+            inspiration = inspiration_path
+        else:
+            print(f"\nWarning: Inspiration photo not found at {inspiration_path}, using collage only")
 
     print(f"Loaded {len(images)} images\n")
 
-    # Arrange into collage (masonry + flexy vertical spacing)
-    collage, bounding_boxes = arrange_products_masonry(
+    if variant_names:
+        summary = write_variants(
+            images,
+            {name: VARIANTS[name] for name in variant_names},
+            output_file,
+            inspiration,
+            resize_cache,
+            args.format,
+            encode_options,
+            args.optimize_layout,
+        )
+        # Output every variant's bounding boxes as JSON to stdout
+        return {"VARIANTS_JSON": summary}
+
+    # Arrange into collage (masonry + flexy vertical spacing), merge the
+    # inspiration photo if provided, and encode
+    fmt = args.format or format_from_path(output_file)
+    rendered = render_and_encode(
         images,
+        inspiration=inspiration,
         canvas_width=800,
         canvas_height=1000,
+        resize_cache=resize_cache,
+        render_cache=caches["render"],
+        fmt=fmt,
+        encode_options=encode_options,
+        optimize_layout=args.optimize_layout,
     )
 
-    if not collage:
-        return
+    if not rendered:
+        return {}
 
-    # If inspiration photo provided, merge it with the collage
-    if inspiration_path and os.path.exists(inspiration_path):
-        print(f"\nMerging with inspiration photo...")
-        final_collage, final_bounding_boxes = merge_with_inspiration(
-            inspiration_path, collage, bounding_boxes
-        )
-    else:
-        if inspiration_path:
-            print(f"\nWarning: Inspiration photo not found at {inspiration_path}, using collage only")
-        final_collage = collage
-        final_bounding_boxes = bounding_boxes
+    final_bounding_boxes = rendered["boundingBoxes"]
 
     # Save final result
-    final_collage.save(output_file, "PNG")
-    print(f"\nCollage saved to {output_file}")
-    print(f"Size: {final_collage.width}x{final_collage.height}")
+    write_atomic(output_file, rendered["data"])
+    print(f"\nCollage saved to {output_file} ({fmt}, {len(rendered['data'])} bytes)")
+    print(f"Size: {rendered['width']}x{rendered['height']}")
+
+    if args.encode_report and not rendered["hit"]:
+        print("\nEncoding report:")
+        for entry in encoding_report(rendered["image"], args.quality):
+            print(f"  {json.dumps(entry)}")
+    for name, cache in caches.items():
+        if cache is not None:
+            print(f"{name.capitalize()} cache: {json.dumps(cache.stats())}")
 
     # Output bounding boxes as JSON to stdout (for the API to capture)
-    print(f"\n===BOUNDING_BOXES_JSON===")
-    print(json.dumps(final_bounding_boxes))
-    print(f"===BOUNDING_BOXES_JSON_END===")
+    return {"BOUNDING_BOXES_JSON": final_bounding_boxes}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Atomic file writes for the collage caches, stores and pipeline.
+
+Data goes to a temp file next to the target (named with the pid, so
+concurrent processes never share one) which then replaces the target with
+os.replace: readers see the old file or the whole new one, never a
+partial write.
+
+Usage:
+    write_atomic("cache/renders/abc.json", data)
+    with atomic_file("store/index.jsonl", "w") as f:
+        f.write(line)
+"""
+
+import os
+import shutil
+import contextlib
+
+
+@contextlib.contextmanager
+def atomic_file(path, mode="wb"):
+    """Open a temp file that replaces path when the block exits without an error."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+
+
+def write_atomic(path, data):
+    """Write bytes through a temp file so readers never see a partial file; returns the size."""
+    with atomic_file(path) as f:
+        f.write(data)
+    return len(data)
+
+
+def copy_atomic(source_path, path):
+    """Copy a file into place through a temp file."""
+    with open(source_path, "rb") as source, atomic_file(path) as f:
+        shutil.copyfileobj(source, f)
@@ -0,0 +1,738 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the collage pipeline (extract.py and arrange.py).
+
+Generates synthetic fixtures into a temporary directory: product shots on
+light, slightly noisy backgrounds with small specks (JPEG), cutouts with
+real transparency (RGBA PNG) and inspiration photos, in several sizes. It
+then times each stage separately across image sizes and item counts:
+
+    estimate_background_color    per product shot size
+    extract_products_from_image  per size, alpha and non-alpha
+    load_product_images          per item count
+    render_collage               per item count, with and without layout search
+    render_collage_merged        per inspiration size, the panel included
+    arrange_from_store           per item count, loading mapped cutouts included
+    composite                    per item count, with and without the
+                                 inspiration panel, PIL paste onto separate
+                                 canvases vs. NumPy blending into one buffer
+    encode                       per output format
+
+render_collage is what arrange.py, the worker and the pipeline run
+(compose_collage painting into one buffer). The PIL paste path it replaced
+is timed on the same cases as labelled reference stages, marked with
+"reference" in the report and summarized against their main stage:
+
+    arrange_products_masonry     reference for render_collage
+    merge_with_inspiration       reference for render_collage_merged
+
+Before timing, the composite cases check that both compositors paint the
+same pixels (to within COMPOSITE_TOLERANCE) and the same bounding boxes.
+Every case is timed `repeat` times, then rebuilt in a freshly spawned
+process to measure memory: the peak RSS while it runs and its growth over
+the RSS at the start (the peak is reset through /proc/self/clear_refs where
+Linux allows it), plus the tracemalloc peak, which covers Python and NumPy
+allocations but not PIL's image buffers. Cases that paint collages also
+report the bytes of the canvases they allocated (the canvasBytes counter).
+
+Results are written as JSON so runs on two commits can be compared. To
+benchmark an older commit, run this suite against its modules: with
+COLLAGE_BENCH_TREE set to another checkout's collage/ directory, extract.py,
+arrange.py and friends are imported from there, and stages that tree does
+not have yet (e.g. composite before compose_collage) are skipped:
+
+    git worktree add ../collage-base <other commit>
+    COLLAGE_BENCH_TREE=../collage-base/collage ./ve/bin/python bench.py --output before.json
+    ./ve/bin/python bench.py --output after.json --compare before.json
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+import contextlib
+import numpy as np
+from PIL import Image
+
+# Another checkout's collage/ directory to benchmark in place of this one
+# (inherited by the spawned memory-pass processes)
+BENCH_TREE = os.environ.get("COLLAGE_BENCH_TREE")
+if BENCH_TREE:
+    sys.path.insert(0, os.path.abspath(BENCH_TREE))
+
+import extract
+import arrange
+import metrics  # this directory's copy if the tree predates it
+from metrics import peak_rss, proc_status_bytes, reset_peak_rss
+
+PRODUCT_SIZES = ((600, 800), (1200, 1600), (2400, 3200))
+INSPIRATION_SIZES = ((1080, 1350), (3024, 4032))
+ITEM_COUNTS = (3, 6, 12)
+REPEAT = 3
+SEED = 1234
+SPECKS = 40  # noisy specks per product shot, all below MIN_COMPONENT_PIXELS
+COMPOSITE_TOLERANCE = 0  # largest channel difference allowed between the two compositors
+
+
+# ---------------------------------------------------------------------------
+# Synthetic fixtures
+# ---------------------------------------------------------------------------
+
+
+def product_pixels(width, height, rng):
+    """
+    An (H, W) boolean product mask: an ellipse body plus a bar, like a
+    bag with a strap, covering roughly half the frame at a random offset.
+    """
+    yy, xx = np.ogrid[:height, :width]
+    cx = width * rng.uniform(0.4, 0.6)
+    cy = height * rng.uniform(0.45, 0.6)
+    rx = width * rng.uniform(0.2, 0.35)
+    ry = height * rng.uniform(0.2, 0.35)
+    body = ((xx - cx) / rx) ** 2 + ((yy - cy) / ry) ** 2 <= 1.0
+
+    bar_top = int(cy - ry * 1.3)
+    bar = (
+        (yy >= bar_top)
+        & (yy < bar_top + max(2, height // 40))
+        & (np.abs(xx - cx) < rx * 0.6)
+    )
+    return body | bar
+
+
+def product_shot(width, height, rng, alpha=False, specks=SPECKS):
+    """
+    A synthetic product photo. Without alpha: an off-white, slightly noisy
+    background with small dark specks (what extract.py is tuned for). With
+    alpha: the same product on a fully transparent background.
+    """
+    mask = product_pixels(width, height, rng)
+    color = rng.integers(20, 200, size=3)
+
+    if alpha:
+        pixels = np.zeros((height, width, 4), dtype=np.uint8)
+        pixels[mask, :3] = color
+        pixels[mask, 3] = 255
+        return Image.fromarray(pixels, "RGBA")
+
+    background = rng.integers(238, 256, size=3)
+    noise = rng.integers(-3, 4, size=(height, width, 1))
+    pixels = np.clip(background + noise, 0, 255).astype(np.uint8)
+    pixels[mask] = color
+
+    # Specks: 1-3px dots anywhere on the background
+    for _ in range(specks):
+        y = int(rng.integers(0, height - 3))
+        x = int(rng.integers(0, width - 3))
+        size = int(rng.integers(1, 4))
+        pixels[y : y + size, x : x + size] = rng.integers(0, 120)
+
+    return Image.fromarray(pixels, "RGB")
+
+
+def inspiration_photo(width, height, rng):
+    """A smooth, photo-like RGB image: upscaled low-res noise over a gradient."""
+    coarse = rng.integers(0, 256, size=(12, 9, 3), dtype=np.uint8)
+    img = Image.fromarray(coarse, "RGB").resize((width, height), Image.Resampling.BICUBIC)
+    gradient = np.linspace(0.6, 1.0, height, dtype=np.float32)[:, None, None]
+    pixels = (np.asarray(img, dtype=np.float32) * gradient).astype(np.uint8)
+    return Image.fromarray(pixels, "RGB")
+
+
+def save_fixture(img, path):
+    if img.mode == "RGBA":
+        img.save(path, "PNG")
+    else:
+        img.save(path, "JPEG", quality=90)
+    return path
+
+
+def generate_fixtures(root, product_sizes, inspiration_sizes, item_counts, seed=SEED):
+    """
+    Write every fixture under root and return their paths:
+    {"products": {(w, h, alpha): path}, "inspirations": {(w, h): path},
+     "itemDirs": {count: dir}}
+    """
+    rng = np.random.default_rng(seed)
+    fixtures = {"products": {}, "inspirations": {}, "itemDirs": {}}
+
+    for width, height in product_sizes:
+        for alpha in (False, True):
+            ext = "png" if alpha else "jpg"
+            path = os.path.join(root, f"product-{width}x{height}-{'alpha' if alpha else 'rgb'}.{ext}")
+            fixtures["products"][(width, height, alpha)] = save_fixture(
+                product_shot(width, height, rng, alpha), path
+            )
+
+    for width, height in inspiration_sizes:
+        path = os.path.join(root, f"inspiration-{width}x{height}.jpg")
+        fixtures["inspirations"][(width, height)] = save_fixture(
+            inspiration_photo(width, height, rng), path
+        )
+
+    # Item sets: a mix of cutouts and photos with varied aspect ratios
+    for count in item_counts:
+        item_dir = os.path.join(root, f"items-{count}")
+        os.makedirs(item_dir, exist_ok=True)
+        for index in range(count):
+            width = int(rng.integers(500, 1400))
+            height = int(width * rng.uniform(0.6, 2.2))
+            alpha = index % 2 == 0
+            ext = "png" if alpha else "jpg"
+            save_fixture(
+                product_shot(width, height, rng, alpha),
+                os.path.join(item_dir, f"item-{index:02d}.{ext}"),
+            )
+        fixtures["itemDirs"][count] = item_dir
+
+    return fixtures
+
+
+# ---------------------------------------------------------------------------
+# Stages
+#
+# A case is a stage name plus its params. prepare_case turns one into the
+# call to time (and an untimed setup whose result is passed to it), so the
+# same case can be rebuilt in a fresh process for the memory pass.
+# ---------------------------------------------------------------------------
+
+
+# Pipeline functions each stage calls: stages whose functions the benchmarked
+# tree lacks are skipped
+STAGE_FUNCTIONS = {
+    "estimate_background_color": ["extract.estimate_background_color"],
+    "extract_products_from_image": ["extract.extract_products_from_image"],
+    "load_product_images": ["arrange.load_product_images"],
+    "render_collage": ["arrange.load_product_images", "arrange.render_collage"],
+    "render_collage_merged": ["arrange.load_product_images", "arrange.render_collage"],
+    "arrange_products_masonry": ["arrange.load_product_images", "arrange.arrange_products_masonry"],
+    "arrange_from_store": [
+        "arrange.load_product_images",
+        "arrange.load_store_images",
+        "arrange.render_collage",
+    ],
+    "merge_with_inspiration": [
+        "arrange.load_product_images",
+        "arrange.arrange_products_masonry",
+        "arrange.merge_with_inspiration",
+    ],
+    "composite": [
+        "arrange.load_product_images",
+        "arrange.plan_masonry",
+        "arrange.item_placements",
+        "arrange.scale_inspiration",
+        "arrange.compose_collage",
+        "arrange.paint_masonry",
+        "arrange.merge_with_inspiration",
+    ],
+    "encode": [
+        "arrange.load_product_images",
+        "arrange.render_collage",
+        "arrange.encode_collage",
+    ],
+}
+
+# Reference stages (the PIL paste path) -> the main stage they are timed against
+REFERENCE_STAGES = {
+    "arrange_products_masonry": "render_collage",
+    "merge_with_inspiration": "render_collage_merged",
+}
+
+
+def missing_functions(stage):
+    """The functions a stage needs that the benchmarked modules don't have."""
+    modules = {"extract": extract, "arrange": arrange}
+    missing = []
+    for name in STAGE_FUNCTIONS[stage]:
+        module, function = name.split(".")
+        if not hasattr(modules[module], function):
+            missing.append(name)
+    return missing
+
+
+def has_layout_search():
+    """Whether arrange_products_masonry takes optimize_layout (trees before layout search don't)."""
+    import inspect
+
+    return "optimize_layout" in inspect.signature(arrange.arrange_products_masonry).parameters
+
+
+def encoder_available(fmt):
+    try:
+        arrange.encode_collage(Image.new("RGB", (8, 8)), fmt)
+        return True
+    except (KeyError, OSError, ValueError):
+        return False
+
+
+def stage_cases(fixtures):
+    """Yield (stage, params) for every case the fixtures and modules support."""
+    for stage in STAGE_FUNCTIONS:
+        missing = missing_functions(stage)
+        if missing:
+            print(f"  Skipping {stage}: no {', '.join(missing)} in this tree", file=sys.stderr)
+    for stage, params in all_cases(fixtures):
+        if not missing_functions(stage):
+            yield stage, params
+
+
+def all_cases(fixtures):
+    for width, height, alpha in fixtures["products"]:
+        if not alpha:
+            yield "estimate_background_color", {"width": width, "height": height}
+    for width, height, alpha in fixtures["products"]:
+        yield "extract_products_from_image", {"width": width, "height": height, "alpha": alpha}
+    for count in fixtures["itemDirs"]:
+        yield "load_product_images", {"items": count}
+    for count in fixtures["itemDirs"]:
+        for optimize in (False, True):
+            yield "render_collage", {"items": count, "optimizeLayout": optimize}
+    for width, height in fixtures["inspirations"]:
+        yield "render_collage_merged", merged_params(fixtures, width, height)
+    for count in fixtures["itemDirs"]:
+        yield "arrange_from_store", {"items": count}
+    for count in fixtures["itemDirs"]:
+        for optimize in (False, True) if has_layout_search() else (False,):
+            yield "arrange_products_masonry", {"items": count, "optimizeLayout": optimize}
+    for width, height in fixtures["inspirations"]:
+        yield "merge_with_inspiration", merged_params(fixtures, width, height)
+    for count in fixtures["itemDirs"]:
+        for inspiration in (False, True):
+            for engine in ("paste", "buffer"):
+                yield "composite", {"items": count, "inspiration": inspiration, "engine": engine}
+    for fmt in getattr(arrange, "OUTPUT_FORMATS", ()):
+        if encoder_available(fmt):
+            yield "encode", {"format": fmt}
+        else:
+            print(f"  Skipping encode {fmt}: not supported by this Pillow", file=sys.stderr)
+
+
+def merged_params(fixtures, width, height):
+    """Params of a merged render: the largest item set with one inspiration size."""
+    return {"items": max(fixtures["itemDirs"]), "width": width, "height": height}
+
+
+def sample_collage(fixtures):
+    """
+    A finished collage from the largest item set merged with the smallest
+    inspiration photo, for the encode stage.
+    """
+    item_dir = fixtures["itemDirs"][max(fixtures["itemDirs"])]
+    path = fixtures["inspirations"][min(fixtures["inspirations"])]
+    return arrange.render_collage(arrange.load_product_images(item_dir), inspiration=path)
+
+
+def composite_inputs(fixtures, params):
+    """
+    Items, their layout and a warmed ResizeCache for a composite case, plus
+    the inspiration photo already decoded at its panel size, so the case
+    times compositing alone.
+    """
+    from resize_cache import ResizeCache
+
+    images = arrange.load_product_images(fixtures["itemDirs"][params["items"]])
+    layout = arrange.plan_masonry(images)
+    resize_cache = ResizeCache()
+    for _, img, size, _, _ in arrange.item_placements(images, layout):
+        resize_cache.resize(img, size)
+    inspiration = None
+    if params["inspiration"]:
+        path = fixtures["inspirations"][min(fixtures["inspirations"])]
+        inspiration, _ = arrange.scale_inspiration(path, 800, 1000)
+    return images, layout, resize_cache, inspiration
+
+
+def prepare_case(stage, params, fixtures, out_dir):
+    """Return (run, setup) for one case; setup may be None."""
+    if stage == "estimate_background_color":
+        path = fixtures["products"][(params["width"], params["height"], False)]
+        img = np.asarray(Image.open(path).convert("RGB"))
+        return (lambda: extract.estimate_background_color(img)), None
+
+    if stage == "extract_products_from_image":
+        path = fixtures["products"][(params["width"], params["height"], params["alpha"])]
+        return (lambda: extract.extract_products_from_image(path, out_dir)), None
+
+    if stage == "load_product_images":
+        item_dir = fixtures["itemDirs"][params["items"]]
+        return (lambda: arrange.load_product_images(item_dir)), None
+
+    if stage == "render_collage":
+        item_dir = fixtures["itemDirs"][params["items"]]
+        # Fresh lazy images each run, so every run decodes and resizes
+        return (
+            lambda images: arrange.render_collage(
+                images, optimize_layout=params["optimizeLayout"]
+            )
+        ), lambda: (arrange.load_product_images(item_dir),)
+
+    if stage == "render_collage_merged":
+        item_dir = fixtures["itemDirs"][params["items"]]
+        path = fixtures["inspirations"][(params["width"], params["height"])]
+        return (
+            lambda images: arrange.render_collage(images, inspiration=path)
+        ), lambda: (arrange.load_product_images(item_dir),)
+
+    if stage == "arrange_products_masonry":
+        item_dir = fixtures["itemDirs"][params["items"]]
+        # Only passed when set: trees before layout search don't take it
+        options = {"optimize_layout": True} if params["optimizeLayout"] else {}
+        return (
+            lambda images: arrange.arrange_products_masonry(images, **options)
+        ), lambda: (arrange.load_product_images(item_dir),)
+
+    if stage == "arrange_from_store":
+        from cutout_store import CutoutStore
+
+        item_dir = fixtures["itemDirs"][params["items"]]
+        store_dir = os.path.join(out_dir, f"store-{params['items']}")
+        if not os.path.exists(store_dir):
+            store = CutoutStore(store_dir)
+            for name, img in arrange.load_product_images(item_dir):
+                store.put(os.path.splitext(name)[0], img.resize(img.size))
+        # A fresh store each run, so nothing is mapped yet
+        return (
+            lambda: arrange.render_collage(arrange.load_store_images(CutoutStore(store_dir)))
+        ), None
+
+    if stage == "merge_with_inspiration":
+        item_dir = fixtures["itemDirs"][params["items"]]
+        path = fixtures["inspirations"][(params["width"], params["height"])]
+
+        def paste_merged(images):
+            collage, bounding_boxes = arrange.arrange_products_masonry(images)
+            return arrange.merge_with_inspiration(path, collage, bounding_boxes)
+
+        return paste_merged, lambda: (arrange.load_product_images(item_dir),)
+
+    if stage == "composite":
+        images, layout, resize_cache, inspiration = composite_inputs(fixtures, params)
+        if params["engine"] == "buffer":
+            return (
+                lambda: arrange.compose_collage(
+                    images, layout, inspiration=inspiration, resize_cache=resize_cache
+                )
+            ), None
+
+        def paste():
+            collage, bounding_boxes = arrange.paint_masonry(
+                images, layout, resize_cache=resize_cache
+            )
+            if inspiration is not None:
+                collage, bounding_boxes = arrange.merge_with_inspiration(
+                    inspiration, collage, bounding_boxes
+                )
+            return collage, bounding_boxes
+
+        return paste, None
+
+    if stage == "encode":
+        merged, _ = sample_collage(fixtures)
+        return (lambda: arrange.encode_collage(merged, params["format"])), None
+
+    raise ValueError(f"Unknown stage {stage}")
+
+
+def check_composite(fixtures, tolerance=COMPOSITE_TOLERANCE):
+    """
+    Render every composite case with both engines and return the largest
+    channel difference; raises RuntimeError past the tolerance or if the
+    bounding boxes differ.
+    """
+    worst = 0
+    for count in fixtures["itemDirs"]:
+        for inspiration in (False, True):
+            params = {"items": count, "inspiration": inspiration}
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                buffer_run, _ = prepare_case("composite", dict(params, engine="buffer"), fixtures, None)
+                paste_run, _ = prepare_case("composite", dict(params, engine="paste"), fixtures, None)
+                buffer_img, buffer_boxes = buffer_run()
+                paste_img, paste_boxes = paste_run()
+            difference = int(
+                np.abs(np.asarray(buffer_img, dtype=np.int16) - np.asarray(paste_img)).max()
+            )
+            if difference > tolerance or buffer_boxes != paste_boxes:
+                raise RuntimeError(
+                    f"Compositors disagree for {json.dumps(params)}: "
+                    f"max difference {difference}, boxes equal: {buffer_boxes == paste_boxes}"
+                )
+            worst = max(worst, difference)
+    return worst
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+
+def time_case(run, setup=None, repeat=REPEAT):
+    """Time run(*setup()) `repeat` times; setup is not timed."""
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+    return {
+        "min": round(min(times), 5),
+        "median": round(statistics.median(times), 5),
+        "mean": round(statistics.fmean(times), 5),
+    }
+
+
+def memory_case(stage, params, fixtures, out_dir):
+    """
+    Run one case in this (fresh) process and report its memory: the peak RSS
+    while it ran, its growth over the RSS at the start, and the tracemalloc
+    peak from a second run.
+    """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        run, setup = prepare_case(stage, params, fixtures, out_dir)
+
+        args = setup() if setup else ()
+        gc.collect()
+        reset = reset_peak_rss()
+        rss_before = proc_status_bytes("VmRSS")
+        with metrics.collect() as collected:
+            run(*args)
+        rss_peak = peak_rss()
+
+        args = setup() if setup else ()
+        tracemalloc.start()
+        run(*args)
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "peakRssBytes": rss_peak,
+        # Only meaningful if the kernel's peak counter could be reset
+        "peakRssDeltaBytes": rss_peak - rss_before if reset and rss_before else None,
+        "peakTracedBytes": traced_peak,
+        "canvasBytes": collected.counters.get("canvasBytes"),
+    }
+
+
+def measure(stage, params, fixtures, out_dir, repeat=REPEAT):
+    """
+    Time a case here, then measure its memory in a freshly spawned process
+    so nothing freed by earlier cases hides its peak.
+    """
+    from multiprocessing import get_context
+    from concurrent.futures import ProcessPoolExecutor
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        run, setup = prepare_case(stage, params, fixtures, out_dir)
+        seconds = time_case(run, setup, repeat)
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        memory = pool.submit(memory_case, stage, params, fixtures, out_dir).result()
+
+    result = dict(stage=stage, params=params, seconds=seconds, **memory)
+    if stage in REFERENCE_STAGES:
+        result["reference"] = REFERENCE_STAGES[stage]
+    return result
+
+
+def reference_summary(results):
+    """
+    Median time of each main stage case over its reference case (the PIL
+    paste path) with the same params; below 1 means the main stage is faster.
+    """
+    main = {case_key(result): result for result in results if "reference" not in result}
+    summary = []
+    for result in results:
+        if "reference" not in result:
+            continue
+        params = json.dumps(result["params"], sort_keys=True)
+        counterpart = main.get((result["reference"], params))
+        if counterpart is None:
+            continue
+        summary.append(
+            {
+                "stage": result["reference"],
+                "reference": result["stage"],
+                "params": result["params"],
+                "ratio": round(counterpart["seconds"]["median"] / result["seconds"]["median"], 3),
+            }
+        )
+    return summary
+
+
+def environment():
+    """Where and on what the benchmark ran."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.abspath(BENCH_TREE or os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import PIL
+    import scipy
+
+    return {
+        "commit": commit,
+        "tree": os.path.abspath(BENCH_TREE) if BENCH_TREE else None,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+    }
+
+
+def run_suite(product_sizes, inspiration_sizes, item_counts, repeat=REPEAT, fixtures_dir=None):
+    """Generate fixtures, run every case and return the report dict."""
+    root = fixtures_dir or tempfile.mkdtemp(prefix="collage-bench-")
+    os.makedirs(root, exist_ok=True)
+    try:
+        print(f"Generating fixtures in {root}", file=sys.stderr)
+        fixtures = generate_fixtures(root, product_sizes, inspiration_sizes, item_counts)
+        out_dir = os.path.join(root, "out")
+        os.makedirs(out_dir, exist_ok=True)
+
+        composite_difference = None
+        if not missing_functions("composite"):
+            composite_difference = check_composite(fixtures)
+            print(
+                f"  Compositors agree (max channel difference {composite_difference})",
+                file=sys.stderr,
+            )
+
+        results = []
+        for stage, params in stage_cases(fixtures):
+            result = measure(stage, params, fixtures, out_dir, repeat)
+            delta = result["peakRssDeltaBytes"]
+            print(
+                f"  {stage}{' [reference]' if stage in REFERENCE_STAGES else ''} {json.dumps(params)}: "
+                f"{result['seconds']['median'] * 1000:.1f}ms, peak RSS "
+                f"{result['peakRssBytes'] / 1024**2:.0f} MiB"
+                + (f" (+{delta / 1024**2:.0f} MiB)" if delta is not None else "")
+                + (
+                    f", canvases {result['canvasBytes'] / 1024**2:.1f} MiB"
+                    if result["canvasBytes"]
+                    else ""
+                ),
+                file=sys.stderr,
+            )
+            results.append(result)
+    finally:
+        if not fixtures_dir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    summary = reference_summary(results)
+    for entry in summary:
+        print(
+            f"  {entry['stage']} vs. {entry['reference']} [reference] "
+            f"{json.dumps(entry['params'])}: time x{entry['ratio']:.2f}",
+            file=sys.stderr,
+        )
+
+    return {
+        "environment": environment(),
+        "repeat": repeat,
+        "compositeMaxDifference": composite_difference,
+        "results": results,
+        "versusReference": summary,
+    }
+
+
+def case_key(result):
+    return result["stage"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare(report, baseline):
+    """Print median time and peak memory of each case relative to a baseline report."""
+    previous = {case_key(result): result for result in baseline["results"]}
+    print(
+        f"\nvs. {baseline['environment'].get('commit') or 'baseline'}"
+        f" (median time, peak RSS):",
+        file=sys.stderr,
+    )
+    for result in report["results"]:
+        old = previous.get(case_key(result))
+        if old is None:
+            continue
+        time_ratio = result["seconds"]["median"] / old["seconds"]["median"]
+        rss_ratio = result["peakRssBytes"] / old["peakRssBytes"]
+        print(
+            f"  {result['stage']} {json.dumps(result['params'])}: "
+            f"time x{time_ratio:.2f}, rss x{rss_ratio:.2f}",
+            file=sys.stderr,
+        )
+
+
+def parse_sizes(text):
+    """'600x800,1200x1600' -> ((600, 800), (1200, 1600))"""
+    return tuple(tuple(int(n) for n in size.split("x")) for size in text.split(",") if size)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the collage pipeline stages")
+    parser.add_argument("--output", "-o", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Timed runs per case")
+    parser.add_argument(
+        "--sizes",
+        type=parse_sizes,
+        default=PRODUCT_SIZES,
+        help="Product shot sizes, e.g. 600x800,1200x1600",
+    )
+    parser.add_argument(
+        "--inspiration-sizes",
+        type=parse_sizes,
+        default=INSPIRATION_SIZES,
+        help="Inspiration photo sizes, e.g. 1080x1350",
+    )
+    parser.add_argument(
+        "--counts",
+        type=lambda text: tuple(int(n) for n in text.split(",") if n),
+        default=ITEM_COUNTS,
+        help="Items per collage, e.g. 3,6,12",
+    )
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="Smallest size and count only, one run per case",
+    )
+    parser.add_argument("--fixtures-dir", help="Keep the generated fixtures in this directory")
+    parser.add_argument("--compare", metavar="JSON", help="Baseline report to compare against")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.sizes = args.sizes[:1]
+        args.inspiration_sizes = args.inspiration_sizes[:1]
+        args.counts = args.counts[:1]
+        args.repeat = 1
+
+    report = run_suite(
+        args.sizes, args.inspiration_sizes, args.counts, args.repeat, args.fixtures_dir
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
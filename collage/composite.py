@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Alpha compositing into one preallocated RGBA buffer with NumPy.
+
+The PIL path builds a collage out of whole canvases: the product panel,
+a white inspiration panel, then a merged canvas that both are pasted onto
+with their own alpha as the mask. Here the output is a single (h, w, 4)
+uint8 array and every draw touches only the rows and columns of the item
+being drawn:
+
+    buffer = new_buffer(1640, 1000)
+    blend(buffer, item_pixels, x, y)   # Image.paste(item, (x, y), item)
+    flatten(buffer, (x, y, w, h))      # pasting the buffer onto white
+    img = to_image(buffer)             # shares the buffer's memory
+
+blend() works on the premultiplied source (src * alpha) plus the
+destination weighted by (255 - alpha), and rounds the sum with the same
+divide-by-255 that PIL's paste uses, so the results match Image.paste
+byte for byte. flatten() applies the second blend that pasting a panel
+onto a white canvas would, but only where it can change anything (pixels
+that are not fully opaque), which lets one buffer stand in for the
+intermediate canvases without changing the output.
+"""
+
+import numpy as np
+from PIL import Image
+
+WHITE = (255, 255, 255, 255)
+# Past this fraction of partly transparent pixels, blend the whole region
+# in place of gathering them (e.g. a photo with a soft alpha everywhere)
+DENSE_FRACTION = 0.25
+
+
+def new_buffer(width, height, color=WHITE):
+    """An (height, width, 4) uint8 buffer filled with an RGBA color."""
+    buffer = np.empty((height, width, 4), dtype=np.uint8)
+    fill(buffer, color)
+    return buffer
+
+
+def fill(pixels, color):
+    """Set (h, w, 4) uint8 pixels to an RGBA color, one word per pixel."""
+    _words(pixels)[...] = np.frombuffer(bytes(color), dtype=np.uint32)[0]
+
+
+def as_pixels(img):
+    """(h, w, 4) uint8 pixels of an image or array, converted to RGBA if needed."""
+    if isinstance(img, np.ndarray):
+        return img
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
+    return np.asarray(img)
+
+
+def _words(pixels):
+    """(h, w) uint32 view of (h, w, 4) uint8 pixels, one word per pixel."""
+    return pixels.view(np.uint32)[..., 0]
+
+
+def to_image(buffer):
+    """An RGBA Image sharing a C-contiguous buffer's memory (no copy)."""
+    height, width = buffer.shape[:2]
+    return Image.frombuffer("RGBA", (width, height), buffer, "raw", "RGBA", 0, 1)
+
+
+def _clip(buffer, width, height, x, y):
+    """The (dst, src) slices of a width x height draw at (x, y), or None if off-buffer."""
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + width, buffer.shape[1]), min(y + height, buffer.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    dst = (slice(y0, y1), slice(x0, x1))
+    src = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+    return dst, src
+
+
+def _buffer_index(buffer, dst_slice, index, width):
+    """Indexes into buffer.reshape(-1, 4) of flat indexes into a width-wide region."""
+    if not buffer.flags.c_contiguous:
+        raise ValueError("buffer must be C-contiguous")
+    stride = buffer.shape[1]
+    origin = dst_slice[0].start * stride + dst_slice[1].start
+    return index // width * stride + index % width + origin
+
+
+def _div255(value):
+    """In-place round(value / 255) for uint16 arrays, exactly as PIL's DIV255."""
+    value += 128
+    value += value >> 8
+    value >>= 8
+    return value
+
+
+def blend(buffer, src, x, y):
+    """
+    Composite src (an RGBA image or (h, w, 4) uint8 array) onto the buffer
+    at (x, y) using its own alpha, in place: the same pixels as
+    Image.paste(src, (x, y), src). Draws outside the buffer are clipped.
+
+    Opaque source pixels are copied as whole words and transparent ones
+    skipped; only the partly transparent ones (a cutout's anti-aliased
+    edge) are gathered and blended in 16-bit arithmetic. A mostly partly
+    transparent source is blended as a whole instead.
+    """
+    src = as_pixels(src)
+    clipped = _clip(buffer, src.shape[1], src.shape[0], x, y)
+    if clipped is None:
+        return
+    dst_slice, src_slice = clipped
+    dst = buffer[dst_slice]
+    src = src[src_slice]
+
+    # alpha - 1 wraps around: 254 is opaque, 255 transparent, the rest partial
+    code = src[..., 3] - np.uint8(1)
+    opaque = code == 254
+    if opaque.all():
+        dst[...] = src
+        return
+    index = np.flatnonzero(code < 254)
+    if len(index) > DENSE_FRACTION * code.size:
+        alpha = src[..., 3:4].astype(np.uint16)
+        out = src.astype(np.uint16)
+        out *= alpha
+        under = dst.astype(np.uint16)
+        under *= 255 - alpha
+        out += under
+        np.copyto(dst, _div255(out), casting="unsafe")
+        return
+
+    np.copyto(_words(dst), _words(src), where=opaque)
+    if not len(index):
+        return
+    pixels = buffer.reshape(-1, 4)
+    target = _buffer_index(buffer, dst_slice, index, src.shape[1])
+
+    out = src.reshape(-1, 4)[index].astype(np.uint16)
+    alpha = out[:, 3:4].copy()
+    out *= alpha  # premultiplied source
+    under = pixels[target].astype(np.uint16)
+    under *= 255 - alpha
+    out += under
+    pixels[target] = _div255(out)
+
+
+def flatten(buffer, box):
+    """
+    Composite the buffer's pixels inside box (x, y, width, height) over
+    opaque white using their own alpha, in place: what pasting the buffer
+    onto a white canvas with itself as the mask does there. Fully opaque
+    pixels are unchanged, so only boxes that were drawn into need it.
+    """
+    x, y, width, height = box
+    clipped = _clip(buffer, width, height, x, y)
+    if clipped is None:
+        return
+    dst_slice = clipped[0]
+    region = buffer[dst_slice]
+
+    index = np.flatnonzero(region[..., 3] != 255)
+    if not len(index):
+        return
+    if len(index) > DENSE_FRACTION * region.shape[0] * region.shape[1]:
+        alpha = region[..., 3:4].astype(np.uint16)
+        out = region.astype(np.uint16)
+        out *= alpha
+        out += 255 * (255 - alpha)
+        np.copyto(region, _div255(out), casting="unsafe")
+        return
+    pixels = buffer.reshape(-1, 4)
+    target = _buffer_index(buffer, dst_slice, index, region.shape[1])
+
+    out = pixels[target].astype(np.uint16)
+    alpha = out[:, 3:4].copy()
+    out *= alpha
+    out += 255 * (255 - alpha)
+    pixels[target] = _div255(out)
+
+
+def disjoint_boxes(boxes):
+    """
+    Merge overlapping (x, y, width, height) boxes into their bounding boxes
+    until none overlap, so flatten() visits every pixel at most once.
+    """
+    merged = [tuple(box) for box in boxes if box[2] > 0 and box[3] > 0]
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                ax, ay, aw, ah = merged[i]
+                bx, by, bw, bh = merged[j]
+                if ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah:
+                    x0, y0 = min(ax, bx), min(ay, by)
+                    x1, y1 = max(ax + aw, bx + bw), max(ay + ah, by + bh)
+                    merged[i] = (x0, y0, x1 - x0, y1 - y0)
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+    return merged
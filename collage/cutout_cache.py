@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Content-addressed on-disk cache of extracted product cutouts.
+
+Entries are keyed by the SHA-256 of the source image bytes plus the
+extraction parameters (every extract.py constant the result depends on and
+the selection/downscale options; see extraction_params), so the same
+supplier photo is only ever extracted once per parameter set, whichever
+outfit it appears in.
+
+Each entry is a metadata JSON file plus one RGBA PNG per cutout. The
+metadata file's mtime is the LRU clock: hits touch it, and when the cache
+grows past its byte cap the least recently used entries are removed until
+it is back under EVICT_LOW_WATER of the cap. The running size total lives
+in a small usage file that every process sharing the cache updates under
+a lock, so opening a cache reads one file; the entries themselves are only
+scanned to evict (which also resyncs the total).
+
+Usage:
+    cache = CutoutCache("cache/cutouts")
+    cutouts, info, hit = cache.get_or_extract("item-12.jpg")
+    print(cache.stats())
+"""
+
+import os
+import json
+import hashlib
+import functools
+from io import BytesIO
+from PIL import Image
+
+import extract
+from atomic import write_atomic
+
+try:
+    import fcntl
+except ImportError:  # Windows: single writer only
+    fcntl = None
+
+CACHE_MAX_BYTES = 2 * 1024**3  # 2 GiB
+# Evict down to this fraction of max_bytes, so a full cache rescans its
+# directory once per ~10% of turnover rather than on every put
+EVICT_LOW_WATER = 0.9
+CACHE_FORMAT = 1  # bump to invalidate every entry when the layout changes
+USAGE_FILE = "usage"  # {"bytes": n}, the entries' total size
+LOCK_FILE = "lock"
+
+
+def read_source(source):
+    """Return the raw bytes of a path, bytes object or binary file object."""
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if hasattr(source, "read"):
+        return source.read()
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def extraction_params(**options):
+    """The parameters an extraction result depends on, for the cache key."""
+    return {
+        "format": CACHE_FORMAT,
+        "border_width": extract.BORDER_WIDTH,
+        "color_eps": extract.COLOR_EPS,
+        "min_component_pixels": extract.MIN_COMPONENT_PIXELS,
+        "bg_samples": extract.BG_SAMPLES,
+        "refine_band": extract.REFINE_BAND,
+        "alpha_threshold": extract.ALPHA_THRESHOLD,
+        "alpha_min_transparent": extract.ALPHA_MIN_TRANSPARENT,
+        "policy": options.get("policy", extract.SELECT_POLICY),
+        "top_k": options.get("top_k", extract.TOP_K),
+        "downscale": options.get("downscale", extract.DOWNSCALE),
+    }
+
+
+class CutoutCache:
+    """LRU-evicted, content-addressed store of extraction results."""
+
+    def __init__(self, cache_dir, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, data, **options):
+        """Cache key for source bytes and extraction options."""
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps(extraction_params(**options), sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _cutout_path(self, key, index):
+        return os.path.join(self.cache_dir, f"{key}_{index}.png")
+
+    def _locked(self):
+        lock = open(self._path(LOCK_FILE), "a")
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock  # closing it releases the lock
+
+    def _entries(self):
+        """Yield (key, mtime, size in bytes) for every complete entry."""
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[: -len(".json")]
+            try:
+                meta_path = self._meta_path(key)
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                yield key, os.path.getmtime(meta_path), meta["bytes"]
+            except (OSError, ValueError, KeyError):
+                continue
+
+    def usage(self):
+        """Bytes the entries take up per the usage file, or None before the first put."""
+        try:
+            with open(self._path(USAGE_FILE)) as f:
+                return json.load(f)["bytes"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_usage(self, total):
+        write_atomic(self._path(USAGE_FILE), json.dumps({"bytes": total}).encode())
+
+    def _add_usage(self, size):
+        """Add an entry's size to the shared total; returns the new total."""
+        with self._locked():
+            total = self.usage()
+            if total is None:
+                # No usage file yet (e.g. a cache filled before there was
+                # one): count the entries once, the one just put included
+                total = sum(entry_size for _, _, entry_size in self._entries())
+            else:
+                total += size
+            self._write_usage(total)
+        return total
+
+    def get(self, key):
+        """Return (cutouts, info) for a key and mark it recently used, or None."""
+        meta_path = self._meta_path(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            cutouts = []
+            for index in range(meta["count"]):
+                with Image.open(self._cutout_path(key, index)) as img:
+                    img.load()
+                    cutouts.append(img)
+            os.utime(meta_path)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return cutouts, meta["info"]
+
+    def put(self, key, cutouts, info):
+        """Store an extraction result, then evict down to the byte cap."""
+        size = 0
+        for index, cutout in enumerate(cutouts):
+            path = self._cutout_path(key, index)
+            buffer = BytesIO()
+            cutout.save(buffer, "PNG")
+            size += write_atomic(path, buffer.getvalue())
+
+        meta = {"count": len(cutouts), "info": info, "bytes": size}
+        # The metadata file is written last: its presence marks the entry complete
+        write_atomic(self._meta_path(key), json.dumps(meta).encode())
+
+        if self._add_usage(size) > self.max_bytes:
+            self.evict()
+
+    def remove(self, key):
+        """Delete one entry (the usage total catches up at the next evict)."""
+        try:
+            with open(self._meta_path(key)) as f:
+                count = json.load(f)["count"]
+        except (OSError, ValueError, KeyError):
+            count = 0
+        for path in [self._meta_path(key)] + [self._cutout_path(key, i) for i in range(count)]:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is under its
+        low-water mark, and reset the usage total to what is left.
+        """
+        with self._locked():
+            entries = sorted(self._entries(), key=lambda entry: entry[1])
+            total = sum(size for _, _, size in entries)
+            for key, _, size in entries:
+                if total <= self.max_bytes * EVICT_LOW_WATER:
+                    break
+                self.remove(key)
+                total -= size
+                self.evictions += 1
+            self._write_usage(total)
+
+    def get_or_extract(self, source, **options):
+        """
+        Look up the cutouts for a source image (path, bytes or file object),
+        extracting and storing them on a miss.
+
+        Returns (cutouts, info, hit).
+        """
+        data = read_source(source)
+        key = self.key(data, **options)
+
+        cached = self.get(key)
+        if cached is not None:
+            cutouts, info = cached
+            return cutouts, info, True
+
+        cutouts, info = extract.extract_cutouts(Image.open(BytesIO(data)), **options)
+        self.put(key, cutouts, info)
+        return cutouts, info, False
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes": self.usage() or 0,
+            "maxBytes": self.max_bytes,
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def open_cache(cache_dir, max_bytes=CACHE_MAX_BYTES):
+    """One shared CutoutCache per directory per process (e.g. per pool worker)."""
+    return CutoutCache(cache_dir, max_bytes)
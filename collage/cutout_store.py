@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Packed store of product cutouts: raw RGBA pixel blocks in a few large
+append-only files, read back through mmap without decoding or copying.
+
+extract.py can append each cutout here instead of writing its own PNG, and
+arrange.py loads a collage's items as PIL images that point straight into
+the mapped pack files, so a render costs a few page faults per item rather
+than an open + PNG inflate per file. Layout:
+
+    <dir>/cutouts-0000.pack   uncompressed RGBA blocks, 64-byte aligned;
+    <dir>/cutouts-0001.pack   a new pack starts past PACK_MAX_BYTES
+    <dir>/index.jsonl         {"id", "pack", "offset", "width", "height",
+                               "digest"} per block, appended after its pixels
+
+A later index line for the same id replaces the earlier one, and alias()
+points a new id at an existing block (near-duplicate products share one
+cutout); compact() drops the blocks nothing refers to any more by copying
+the live ones into new packs under a new index, which starts with a
+{"generation": n} line. Other processes notice the new generation on
+their next refresh() and reload the index; the old packs stay on disk
+until the next compact(), so a reader still mapping them can finish. Appends
+are serialized by an flock, so several extract workers can share one
+store. The digest is the same pixel hash image_digest computes, so the
+resize and render caches key mapped cutouts without reading their pixels.
+
+Usage:
+    store = CutoutStore("cache/store")
+    store.put("item-12_obj1", cutout)
+    img = store.get("item-12_obj1")  # read-only RGBA Image backed by the mmap
+    pixels = store.array("item-12_obj1")  # (h, w, 4) uint8 view
+"""
+
+import os
+import json
+import mmap
+import hashlib
+import functools
+import numpy as np
+from PIL import Image
+
+from atomic import atomic_file
+
+try:
+    import fcntl
+except ImportError:  # Windows: single writer only
+    fcntl = None
+
+PACK_MAX_BYTES = 1024**3  # start a new pack file past 1 GiB
+BLOCK_ALIGN = 64
+INDEX_FILE = "index.jsonl"
+LOCK_FILE = "lock"
+
+
+def read_generation(f):
+    """Generation of an index file open at its start: 0 until the first compact()."""
+    first = f.readline()
+    if first.endswith(b"\n"):
+        header = json.loads(first)
+        if "generation" in header:
+            return header["generation"]
+    return 0
+
+
+def pixel_digest(width, height, data):
+    """Same hash as resize_cache.image_digest for an RGBA image of these pixels."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"RGBA:{width}x{height}:".encode())
+    h.update(data)
+    return h.hexdigest()
+
+
+class CutoutStore:
+    """Append-only packed RGBA cutouts, memory-mapped for reading."""
+
+    def __init__(self, store_dir, pack_max_bytes=PACK_MAX_BYTES):
+        self.store_dir = store_dir
+        self.pack_max_bytes = pack_max_bytes
+        self.index = {}
+        self.index_pos = 0
+        self.generation = 0  # bumped by every compact()
+        self.maps = {}  # pack number -> mmap
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(store_dir, exist_ok=True)
+        self.refresh()
+
+    def _path(self, name):
+        return os.path.join(self.store_dir, name)
+
+    def _pack_path(self, pack):
+        return self._path(f"cutouts-{pack:04d}.pack")
+
+    def refresh(self):
+        """
+        Read index lines appended since the last call (e.g. by other
+        processes), or the whole index again if compact() replaced it.
+        """
+        try:
+            with open(self._path(INDEX_FILE), "rb") as f:
+                generation = read_generation(f)
+                if generation != self.generation:
+                    # A new index: every offset in it and every pack changed
+                    self.generation = generation
+                    self.index = {}
+                    self.index_pos = 0
+                    self.maps = {}
+                f.seek(self.index_pos)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # being written; read it next time
+                    entry = json.loads(line)
+                    if "id" in entry:
+                        self.index[entry["id"]] = entry
+                    self.index_pos += len(line)
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, item_id):
+        return item_id in self.index
+
+    def ids(self):
+        return sorted(self.index)
+
+    def _map(self, pack, end):
+        """An mmap of a pack covering at least `end` bytes (remapped if it grew)."""
+        mapped = self.maps.get(pack)
+        if mapped is None or len(mapped) < end:
+            with open(self._pack_path(pack), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # An older, shorter map stays alive while images still use it
+            self.maps[pack] = mapped
+        return mapped
+
+    def _entry(self, item_id):
+        entry = self.index.get(item_id)
+        if entry is None:
+            self.refresh()
+            entry = self.index.get(item_id)
+        if entry is None:
+            self.misses += 1
+            raise KeyError(item_id)
+        self.hits += 1
+        return entry
+
+    def buffer(self, item_id):
+        """(memoryview of the RGBA bytes, (width, height), digest) of a cutout."""
+        entry = self._entry(item_id)
+        size = entry["width"] * entry["height"] * 4
+        end = entry["offset"] + size
+        try:
+            mapped = self._map(entry["pack"], end)
+        except FileNotFoundError:
+            # Its pack was removed by compact(): the index has moved on since
+            generation = self.generation
+            self.refresh()
+            if self.generation == generation:
+                raise
+            return self.buffer(item_id)
+        return memoryview(mapped)[entry["offset"] : end], (entry["width"], entry["height"]), entry["digest"]
+
+    def get(self, item_id):
+        """A read-only RGBA Image sharing the mapped pixels; raises KeyError."""
+        data, size, digest = self.buffer(item_id)
+        img = Image.frombuffer("RGBA", size, data, "raw", "RGBA", 0, 1)
+        img.info["digest"] = digest
+        return img
+
+    def array(self, item_id):
+        """An (h, w, 4) uint8 read-only view of a cutout; raises KeyError."""
+        data, (width, height), _ = self.buffer(item_id)
+        return np.frombuffer(data, dtype=np.uint8).reshape(height, width, 4)
+
+    def put(self, item_id, img):
+        """Append a cutout (converted to RGBA) and index it under item_id."""
+        if img.mode != "RGBA":
+            img = img.convert("RGBA")
+        data = img.tobytes()
+        entry = {
+            "id": item_id,
+            "width": img.width,
+            "height": img.height,
+            "digest": pixel_digest(img.width, img.height, data),
+        }
+        with self._locked():
+            pack, offset = self._append_block(data)
+            entry.update(pack=pack, offset=offset)
+            # The index line is written last: its presence marks the block complete
+            self._append_index(entry)
+        return entry
+
+    def alias(self, item_id, existing_id):
+        """Index item_id as the same pixels as existing_id; raises KeyError."""
+        entry = {**self._entry(existing_id), "id": item_id}
+        with self._locked():
+            self._append_index(entry)
+        return entry
+
+    def _append_index(self, entry):
+        with open(self._path(INDEX_FILE), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.index[entry["id"]] = entry
+
+    def _locked(self):
+        lock = open(self._path(LOCK_FILE), "a")
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock  # closing it releases the lock
+
+    def _packs(self):
+        return sorted(
+            int(name[len("cutouts-") : -len(".pack")])
+            for name in os.listdir(self.store_dir)
+            if name.startswith("cutouts-") and name.endswith(".pack")
+        )
+
+    def _append_block(self, data):
+        """Write data at the aligned end of the last pack; returns (pack, offset)."""
+        packs = self._packs()
+        pack = packs[-1] if packs else 0
+        path = self._pack_path(pack)
+        end = os.path.getsize(path) if os.path.exists(path) else 0
+        offset = -(-end // BLOCK_ALIGN) * BLOCK_ALIGN
+        if offset and offset + len(data) > self.pack_max_bytes:
+            pack, offset = pack + 1, 0
+            path = self._pack_path(pack)
+
+        with open(path, "ab") as f:
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(data)
+        return pack, offset
+
+    def compact(self):
+        """
+        Rewrite the live blocks into fresh packs under a new index generation.
+        Readers in other processes switch to it on their next refresh(). The
+        packs just copied from are kept until the next compact(), which
+        removes them along with any other pack the index no longer uses.
+        Returns the bytes the copied-from packs held beyond the live blocks.
+        """
+        with self._locked():
+            self.refresh()
+            packs = self._packs()
+            live_packs = {entry["pack"] for entry in self.index.values()}
+            # Superseded by the previous compact(): readers have had a whole
+            # generation to move off them (and buffer() recovers if not)
+            retired = [pack for pack in packs if pack not in live_packs]
+            before = sum(os.path.getsize(self._pack_path(pack)) for pack in live_packs)
+            first = packs[-1] + 1 if packs else 0
+
+            entries = []
+            moved = {}  # (old pack, old offset) -> new entry, so aliases stay shared
+            pack, offset = first, 0
+            out = open(self._pack_path(pack), "wb")
+            for item_id in self.ids():
+                block = (self.index[item_id]["pack"], self.index[item_id]["offset"])
+                if block in moved:
+                    entries.append({**self.index[item_id], **moved[block]})
+                    continue
+                data, _, _ = self.buffer(item_id)
+                if offset and offset + len(data) > self.pack_max_bytes:
+                    out.close()
+                    pack, offset = pack + 1, 0
+                    out = open(self._pack_path(pack), "wb")
+                out.write(b"\0" * (offset - out.tell()))
+                out.write(data)
+                moved[block] = {"pack": pack, "offset": offset}
+                entries.append({**self.index[item_id], **moved[block]})
+                offset = -(-(offset + len(data)) // BLOCK_ALIGN) * BLOCK_ALIGN
+            out.close()
+            if not moved:
+                os.unlink(self._pack_path(pack))  # nothing live: no packs at all
+
+            with atomic_file(self._path(INDEX_FILE), "w") as f:
+                f.write(json.dumps({"generation": self.generation + 1}) + "\n")
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+            for old in retired:
+                os.unlink(self._pack_path(old))
+
+            self.generation += 1
+            self.maps = {}
+            self.index = {entry["id"]: entry for entry in entries}
+            self.index_pos = os.path.getsize(self._path(INDEX_FILE))
+            new_packs = range(first, pack + 1) if moved else ()
+            after = sum(os.path.getsize(self._pack_path(p)) for p in new_packs)
+        return before - after
+
+    def stats(self):
+        pack_bytes = sum(os.path.getsize(self._pack_path(pack)) for pack in self._packs())
+        blocks = {(e["pack"], e["offset"]): e["width"] * e["height"] * 4 for e in self.index.values()}
+        live_bytes = sum(blocks.values())
+        return {
+            "items": len(self.index),
+            "generation": self.generation,
+            "packs": len(self._packs()),
+            "packBytes": pack_bytes,
+            "liveBytes": live_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def open_store(store_dir):
+    """One shared CutoutStore per directory per process (e.g. per pool worker)."""
+    return CutoutStore(store_dir)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or maintain a packed cutout store")
+    parser.add_argument("store_dir")
+    parser.add_argument(
+        "--import",
+        dest="import_dir",
+        metavar="DIR",
+        help="Append every PNG in DIR (e.g. extract.py output) under its file name",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Drop blocks replaced by later appends (old packs are removed by the next --compact)",
+    )
+    args = parser.parse_args()
+
+    store = CutoutStore(args.store_dir)
+    if args.import_dir:
+        names = sorted(f for f in os.listdir(args.import_dir) if f.lower().endswith(".png"))
+        for name in names:
+            with Image.open(os.path.join(args.import_dir, name)) as img:
+                store.put(os.path.splitext(name)[0], img)
+        print(f"Imported {len(names)} cutouts from {args.import_dir}")
+    if args.compact:
+        print(f"Compacted: {store.compact()} bytes freed")
+    print(json.dumps(store.stats()))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,35 +2,64 @@
 """
 Extract products from white/light-background images by
 background-color estimation + connected components.
-Each detected object is saved as its own PNG with transparent background.
+Each detected object is saved as its own PNG with transparent background,
+or with --store appended to a packed cutout store (see cutout_store.py).
 
 Requirements:
     pip install pillow numpy scipy
 """
 
 import os
+import sys
+import json
+import time
+import shutil
+import contextlib
 import numpy as np
 from PIL import Image
-from scipy.ndimage import label, binary_opening, binary_closing, binary_fill_holes
+from scipy.ndimage import (
+    label,
+    find_objects,
+    binary_dilation,
+    binary_erosion,
+)
+
+import metrics
 
 # Parameters you can tweak
 BORDER_WIDTH = 8  # how many pixels around the edge to sample for bg color
 COLOR_EPS = 0.04  # color distance threshold (0..1). Smaller = stricter
 MIN_COMPONENT_PIXELS = 200  # ignore tiny specks / noise
-
-
-def estimate_background_color(img_float):
+SELECT_POLICY = "largest"  # which component is the product: largest, central or top-k
+TOP_K = 1  # how many components the top-k policy keeps
+SELECT_POLICIES = ("largest", "central", "top-k")
+DOWNSCALE = 1  # >1 segments on a copy reduced by this factor, then refines the edges
+REFINE_BAND = 1  # width (in coarse pixels) of the boundary band refined at full res
+TILE_ROWS = 256  # rows per tile when thresholding / gathering component stats
+BG_SAMPLES = 4096  # max border pixels sampled per strip for the bg color median
+ALPHA_THRESHOLD = 128  # alpha above this counts as foreground in the alpha fast path
+ALPHA_MIN_TRANSPARENT = 0.01  # fraction of transparent pixels for alpha to count
+
+
+def estimate_background_color(img_rgb):
     """
     Estimate background color by averaging pixels along the image border.
-    img_float: (H, W, 3) in [0,1]
+    img_rgb: (H, W, 3) uint8; the result is in the same 0..255 scale
+
+    Each border strip is sampled with a stride so at most BG_SAMPLES pixels
+    per strip go into the median, whatever the image size.
     """
-    h, w, _ = img_float.shape
+    h, w, _ = img_rgb.shape
     b = BORDER_WIDTH
 
-    top = img_float[:b, :, :]
-    bottom = img_float[h - b : h, :, :]
-    left = img_float[:, :b, :]
-    right = img_float[:, w - b : w, :]
+    # Stride along the long side of each strip (views, no copies)
+    row_step = max(1, (b * w) // BG_SAMPLES)
+    col_step = max(1, (b * h) // BG_SAMPLES)
+
+    top = img_rgb[:b, ::row_step, :]
+    bottom = img_rgb[h - b : h, ::row_step, :]
+    left = img_rgb[::col_step, :b, :]
+    right = img_rgb[::col_step, w - b : w, :]
 
     border_pixels = np.concatenate(
         [
@@ -47,90 +76,592 @@ def estimate_background_color(img_float):
     return bg_color
 
 
-def extract_products_from_image(image_path, output_dir):
+def alpha_channel(image):
     """
-    Extract each product from a light-background image and save as PNGs.
+    Return the alpha channel as a uint8 array if it carries real transparency
+    (at least ALPHA_MIN_TRANSPARENT of the pixels below ALPHA_THRESHOLD),
+    otherwise None.
     """
-    print(f"Processing {os.path.basename(image_path)}")
+    if image.mode == "P" and "transparency" in image.info:
+        image = image.convert("RGBA")
+    if image.mode not in ("RGBA", "LA", "PA"):
+        return None
+
+    alpha = np.asarray(image.getchannel("A"))
+    if np.count_nonzero(alpha <= ALPHA_THRESHOLD) < ALPHA_MIN_TRANSPARENT * alpha.size:
+        return None
+    return alpha
+
+
+def distance_threshold(bg_color):
+    """
+    Integer form of the COLOR_EPS test against a 0..255 background color.
+
+    The median background can land on a half value, so everything is doubled:
+    |2p - 2bg|^2 > (2 * 255 * COLOR_EPS)^2 is exact in integer arithmetic
+    and needs no sqrt.
+    """
+    bg2 = np.rint(np.asarray(bg_color) * 2).astype(np.int32)
+    limit = int((2 * 255 * COLOR_EPS) ** 2)
+    return bg2, limit
+
+
+def color_distance_mask(img_rgb, bg_color, tile_rows=TILE_ROWS):
+    """
+    Pixels whose color is farther than COLOR_EPS from the background,
+    computed in row tiles so only one tile of uint16 temporaries is alive.
+
+    Each channel's squared distance comes from a 256-entry table, clipped
+    just past the limit (one channel over it decides the pixel), so the sum
+    of three fits in uint16 and the uint8 pixels are never promoted.
+    """
+    h, w = img_rgb.shape[:2]
+    bg2, limit = distance_threshold(bg_color)
+    doubled = np.arange(256, dtype=np.int32) * 2
+    tables = [np.minimum((doubled - b) ** 2, limit + 1).astype(np.uint16) for b in bg2]
+    mask = np.empty((h, w), dtype=bool)
+    total = np.empty((min(tile_rows, h), w), dtype=np.uint16)
+    channel = np.empty_like(total)
+
+    for y0 in range(0, h, tile_rows):
+        tile = img_rgb[y0 : y0 + tile_rows]
+        rows = tile.shape[0]
+        np.take(tables[0], tile[..., 0], out=total[:rows])
+        for c in (1, 2):
+            np.take(tables[c], tile[..., c], out=channel[:rows])
+            total[:rows] += channel[:rows]
+        np.greater(total[:rows], limit, out=mask[y0 : y0 + rows])
+
+    return mask
+
+
+def erode_cross(mask):
+    """binary_erosion with the 3x3 cross, as four shifted ANDs (edges erode)."""
+    out = mask.copy()
+    out[1:] &= mask[:-1]
+    out[:-1] &= mask[1:]
+    out[:, 1:] &= mask[:, :-1]
+    out[:, :-1] &= mask[:, 1:]
+    out[[0, -1]] = False
+    out[:, [0, -1]] = False
+    return out
+
+
+def dilate_cross(mask):
+    """binary_dilation with the 3x3 cross, as four shifted ORs."""
+    out = mask.copy()
+    out[1:] |= mask[:-1]
+    out[:-1] |= mask[1:]
+    out[:, 1:] |= mask[:, :-1]
+    out[:, :-1] |= mask[:, 1:]
+    return out
+
+
+def fill_holes(mask):
+    """
+    binary_fill_holes by labeling the background once: every background
+    region that does not touch the image edge is a hole.
+    """
+    background, num = label(~mask)
+    edge = np.concatenate([background[0], background[-1], background[:, 0], background[:, -1]])
+    outside = np.zeros(num + 1, dtype=bool)
+    outside[edge] = True
+    outside[0] = False  # label 0 is the foreground itself
+    return mask | ~outside[background]
+
+
+def foreground_mask(img_rgb, bg_color):
+    """
+    Full-resolution foreground mask: color distance from the background,
+    thresholded and cleaned up with morphology.
+    """
+    # Foreground mask: pixels far enough from background color
+    # (works even for white shoes because they're slightly off-bg)
+    fg_mask = color_distance_mask(img_rgb, bg_color)
+
+    # Clean up mask (remove noise, fill tiny gaps): opening, closing, holes.
+    # Same results as scipy's binary_opening/closing/fill_holes, much faster
+    fg_mask = dilate_cross(erode_cross(fg_mask))
+    fg_mask = erode_cross(dilate_cross(fg_mask))
+    fg_mask = fill_holes(fg_mask)
+    return fg_mask
+
+
+def foreground_mask_multires(image, img_rgb, bg_color, factor, band=REFINE_BAND):
+    """
+    Coarse-to-fine foreground mask for large images.
+
+    The distance threshold and morphology run on a copy reduced by `factor`.
+    The coarse mask is scaled back up, and only pixels in a band around its
+    boundary are re-thresholded against the full-resolution image.
+    """
+    h, w = img_rgb.shape[:2]
+
+    # Box-filtered reduction, so the coarse threshold sees averaged colors
+    small = np.asarray(image.reduce(factor))
+    coarse = foreground_mask(small, bg_color)
+
+    # Boundary band in coarse pixels: inside the dilation, outside the erosion
+    coarse_band = binary_dilation(coarse, iterations=band) & ~binary_erosion(
+        coarse, iterations=band, border_value=1
+    )
+
+    def upscale(mask):
+        return np.repeat(np.repeat(mask, factor, axis=0), factor, axis=1)[:h, :w]
+
+    fg_mask = upscale(coarse)
+    ys, xs = np.nonzero(upscale(coarse_band))
+
+    # Refine the band at full resolution
+    bg2, limit = distance_threshold(bg_color)
+    diff = img_rgb[ys, xs].astype(np.int32) * 2 - bg2
+    fg_mask[ys, xs] = (diff * diff).sum(axis=1) > limit
+    return fg_mask
+
+
+def compare_segmentation(paths, factors):
+    """
+    Report runtime and mask IoU of the coarse-to-fine mask at each downscale
+    factor against the full-resolution mask. An image that can't be measured
+    gets an "error" entry instead of stopping the report.
+    """
+    report = []
+    for path in paths:
+        entry = {"image": path, "error": None}
+        try:
+            image = Image.open(path).convert("RGB")
+            img = np.asarray(image)
+            bg_color = estimate_background_color(img)
+
+            start = time.perf_counter()
+            reference = foreground_mask(img, bg_color)
+            entry.update(
+                {
+                    "size": [image.width, image.height],
+                    "fullResSeconds": round(time.perf_counter() - start, 4),
+                    "factors": {},
+                }
+            )
+
+            for factor in factors:
+                start = time.perf_counter()
+                mask = foreground_mask_multires(image, img, bg_color, factor)
+                elapsed = time.perf_counter() - start
+
+                union = np.count_nonzero(mask | reference)
+                iou = np.count_nonzero(mask & reference) / union if union else 1.0
+                entry["factors"][str(factor)] = {
+                    "seconds": round(elapsed, 4),
+                    "speedup": round(entry["fullResSeconds"] / elapsed, 2) if elapsed else None,
+                    "iou": round(iou, 5),
+                }
+        except Exception as e:
+            entry["error"] = f"{type(e).__name__}: {e}"
+
+        print(json.dumps(entry), flush=True)
+        report.append(entry)
+
+    return report
+
+
+def component_stats(labeled, num, tile_rows=TILE_ROWS, centroids=True):
+    """
+    Area, bounding box and centroid of every label in one pass over the image,
+    accumulated in row tiles so no full-frame coordinate arrays are built.
+
+    Returns a dict of arrays indexed by label - 1:
+        area: (num,) pixel counts
+        bbox: list of (row slice, col slice) from find_objects
+        centroid: (num, 2) (y, x) centers of mass, or None if not `centroids`
+    """
+    h, w = labeled.shape
+    area = np.zeros(num + 1, dtype=np.int64)
+    sum_y = np.zeros(num + 1)
+    sum_x = np.zeros(num + 1)
+    col_index = np.tile(np.arange(w, dtype=np.float64), tile_rows)
+
+    for y0 in range(0, h, tile_rows):
+        tile = labeled[y0 : y0 + tile_rows]
+        rows = tile.shape[0]
+        flat = tile.ravel()
+        row_index = np.repeat(np.arange(y0, y0 + rows, dtype=np.float64), w)
+        area += np.bincount(flat, minlength=num + 1)
+        if not centroids:
+            continue
+        sum_y += np.bincount(flat, weights=row_index, minlength=num + 1)
+        sum_x += np.bincount(flat, weights=col_index[: rows * w], minlength=num + 1)
+
+    area, sum_y, sum_x = area[1:], sum_y[1:], sum_x[1:]
+    centroid = None
+    if centroids:
+        safe_area = np.maximum(area, 1)
+        centroid = np.stack([sum_y / safe_area, sum_x / safe_area], axis=1)
+
+    return {"area": area, "bbox": find_objects(labeled, num), "centroid": centroid}
 
-    # Load image
-    image = Image.open(image_path).convert("RGB")
-    img = np.array(image).astype(np.float32) / 255.0  # [0,1]
-    h, w = img.shape[:2]
 
-    # 1) Estimate background color
-    bg_color = estimate_background_color(img)
+def select_components(stats, shape, policy=SELECT_POLICY, top_k=TOP_K):
+    """
+    Pick which component ids are products, deterministically.
+
+    Components under MIN_COMPONENT_PIXELS are ignored. Then:
+        largest: the single largest component
+        central: the component whose centroid is closest to the image center
+        top-k:   the top_k largest components
+    Ties are broken by label id.
+    """
+    if policy not in SELECT_POLICIES:
+        raise ValueError(f"Unknown selection policy {policy!r}; expected one of {SELECT_POLICIES}")
+
+    area = stats["area"]
+    candidates = np.flatnonzero(area >= MIN_COMPONENT_PIXELS)
+    if candidates.size == 0:
+        return []
 
-    # 2) Compute per-pixel color distance from background
-    diff = img - bg_color[None, None, :]  # (H, W, 3)
-    dist = np.linalg.norm(diff, axis=2)  # (H, W)
+    if policy == "central":
+        h, w = shape
+        offset = stats["centroid"][candidates] - np.array([h / 2.0, w / 2.0])
+        # Normalize by image size so tall and wide images are treated alike
+        dist = np.hypot(offset[:, 0] / h, offset[:, 1] / w)
+        order = np.lexsort((candidates, dist))
+        count = 1
+    else:
+        order = np.lexsort((candidates, -area[candidates]))
+        count = top_k if policy == "top-k" else 1
 
-    # 3) Foreground mask: pixels far enough from background color
-    #    (works even for white shoes because they're slightly off-bg)
-    fg_mask = dist > COLOR_EPS
+    return [int(candidates[i]) + 1 for i in order[:count]]
 
-    # Clean up mask (remove noise, fill tiny gaps)
-    fg_mask = binary_opening(fg_mask, iterations=1)
-    fg_mask = binary_closing(fg_mask, iterations=1)
-    fg_mask = binary_fill_holes(fg_mask)
+
+def extract_cutouts(image, policy=SELECT_POLICY, top_k=TOP_K, downscale=DOWNSCALE):
+    """
+    Extract the product cutouts from an opened PIL image, in memory.
+
+    Returns (cutouts, info): a list of RGBA PIL images, and a dict with the
+    number of connected components found, which mask path was taken
+    ("alpha", "segment" or "segment-multires") and each cutout's bbox in
+    the source image. `policy` and `top_k` choose which components are kept
+    (see select_components). `downscale` > 1 uses the coarse-to-fine mask
+    (see foreground_mask_multires).
+    """
+    metrics.count("images")
+    metrics.count("inputPixels", image.width * image.height)
+
+    with metrics.stage("decode"):
+        alpha = alpha_channel(image)
+        # Load image; everything below works on this uint8 buffer
+        image = image.convert("RGB")
+        img = np.asarray(image)  # (H, W, 3) uint8
+
+    if alpha is not None:
+        # Already cut out: the alpha channel is the foreground mask
+        mask_path = "alpha"
+        with metrics.stage("mask"):
+            fg_mask = alpha > ALPHA_THRESHOLD
+    else:
+        # 1) Estimate background color
+        with metrics.stage("background"):
+            bg_color = estimate_background_color(img)
+
+        # 2-3) Foreground mask: pixels far enough from background color
+        with metrics.stage("mask"):
+            if downscale > 1:
+                mask_path = "segment-multires"
+                fg_mask = foreground_mask_multires(image, img, bg_color, downscale)
+            else:
+                mask_path = "segment"
+                fg_mask = foreground_mask(img, bg_color)
+
+    h, w = img.shape[:2]
+    print(f"  Mask path: {mask_path}")
+    info = {"components": 0, "path": mask_path, "boxes": []}
 
     if not fg_mask.any():
         print("  No foreground found, skipping.")
-        return
+        return [], info
 
     # 4) Connected components to separate objects
-    labeled, num = label(fg_mask)
+    with metrics.stage("label"):
+        labeled, num = label(fg_mask)
     print(f"  Found {num} connected component(s) (before size filter)")
+    info["components"] = num
+
+    # 5) Per-component area/bbox/centroid in one pass, then pick the product(s)
+    with metrics.stage("components"):
+        stats = component_stats(labeled, num, centroids=(policy == "central"))
+        selected = select_components(stats, (h, w), policy, top_k)
+
+    cutouts = []
+    with metrics.stage("crop"):
+        for comp_id in selected:
+            y_slice, x_slice = stats["bbox"][comp_id - 1]
+
+            # Crop RGB region
+            crop_rgb = img[y_slice, x_slice]
+
+            # Crop mask and turn into alpha channel (keeping soft source alpha)
+            crop_mask = labeled[y_slice, x_slice] == comp_id
+            if alpha is not None:
+                crop_alpha = np.where(crop_mask, alpha[y_slice, x_slice], 0)
+            else:
+                crop_alpha = crop_mask.astype(np.uint8) * 255
+
+            # 6) Build RGBA image
+            rgba = np.zeros((crop_rgb.shape[0], crop_rgb.shape[1], 4), dtype=np.uint8)
+            rgba[:, :, :3] = crop_rgb
+            rgba[:, :, 3] = crop_alpha
+
+            cutouts.append(Image.fromarray(rgba, "RGBA"))
+            info["boxes"].append(
+                {
+                    "x": x_slice.start,
+                    "y": y_slice.start,
+                    "width": x_slice.stop - x_slice.start,
+                    "height": y_slice.stop - y_slice.start,
+                }
+            )
+
+    if not selected:
+        print("  Only tiny components found; nothing saved.")
 
-    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    return cutouts, info
 
-    obj_index = 0
-    img_rgb_255 = (img * 255).astype(np.uint8)
 
-    for comp_id in range(1, num + 1):
-        comp_mask = labeled == comp_id
+def extract_products_from_image(image_path, output_dir, cache=None, store=None, **options):
+    """
+    Extract each product from a light-background image and save as PNGs,
+    or into `store` (a CutoutStore) under the same names without ".png".
 
-        # Skip tiny components
-        if comp_mask.sum() < MIN_COMPONENT_PIXELS:
-            continue
+    Returns a dict with the number of connected components found, the list
+    of saved output paths (store ids with a store), which mask path was
+    taken (see extract_cutouts; for a hit in `cache`, a CutoutCache, the
+    path of the extraction that filled it) and whether it was `cached`.
+    """
+    print(f"Processing {os.path.basename(image_path)}")
 
-        obj_index += 1
+    if cache is not None:
+        cutouts, info, hit = cache.get_or_extract(image_path, **options)
+        metrics.count("cacheHits" if hit else "cacheMisses")
+    else:
+        cutouts, info = extract_cutouts(Image.open(image_path), **options)
+        hit = False
 
-        # 5) Get bounding box of this component
-        ys, xs = np.where(comp_mask)
-        y_min, y_max = ys.min(), ys.max()
-        x_min, x_max = xs.min(), xs.max()
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
 
-        # Crop RGB region
-        crop_rgb = img_rgb_255[y_min : y_max + 1, x_min : x_max + 1]
+    saved = []
+    for obj_index, result in enumerate(cutouts, start=1):
+        out_name = f"{base_name}_obj{obj_index}.png"
+        with metrics.stage("save"):
+            if store is not None:
+                out_path = os.path.splitext(out_name)[0]
+                store.put(out_path, result)
+            else:
+                out_path = os.path.join(output_dir, out_name)
+                result.save(out_path, "PNG")
+        saved.append(out_path)
+        print(f"  Saved {out_name}")
 
-        # Crop mask and turn into alpha channel
-        crop_mask = comp_mask[y_min : y_max + 1, x_min : x_max + 1]
-        alpha = crop_mask.astype(np.uint8) * 255
+    return {
+        "components": info["components"],
+        "saved": saved,
+        "path": info["path"],
+        "cached": hit,
+    }
 
-        # 6) Build RGBA image
-        rgba = np.zeros((crop_rgb.shape[0], crop_rgb.shape[1], 4), dtype=np.uint8)
-        rgba[:, :, :3] = crop_rgb
-        rgba[:, :, 3] = alpha
 
-        result = Image.fromarray(rgba, "RGBA")
+def share_cutouts(saved, image_path, output_dir, store=None):
+    """
+    Give a near duplicate the cutouts already saved for its representative
+    (`saved`, as returned by extract_products_from_image): store aliases,
+    or hard links (copies where links are not possible) of the PNGs.
+    Returns the duplicate's own saved paths / store ids.
+    """
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    shared = []
+    for obj_index, source in enumerate(saved, start=1):
+        out_name = f"{base_name}_obj{obj_index}"
+        if store is not None:
+            store.alias(out_name, source)
+            shared.append(out_name)
+            continue
+        out_path = os.path.join(output_dir, f"{out_name}.png")
+        if os.path.exists(out_path):
+            os.unlink(out_path)
+        try:
+            os.link(source, out_path)
+        except OSError:
+            shutil.copyfile(source, out_path)
+        shared.append(out_path)
+    metrics.count("duplicates")
+    return shared
 
-        out_name = f"{base_name}_obj{obj_index}.png"
-        out_path = os.path.join(output_dir, out_name)
-        result.save(out_path, "PNG")
-        print(f"  Saved {out_name}")
-        break  # only want to save one product per image
 
-    if obj_index == 0:
-        print("  Only tiny components found; nothing saved.")
+def process_image(image_path, output_dir, cache_dir=None, store_dir=None, **options):
+    """
+    Extract one image for batch mode and return a JSON-serializable result.
+    Errors are reported in the result instead of raised so a batch keeps going.
+    With cache_dir, results go through this process's CutoutCache; with
+    store_dir, cutouts go to this process's CutoutStore. The result carries
+    this image's per-stage metrics.
+    """
+    start = time.perf_counter()
+    result = {"image": image_path, "saved": [], "components": 0, "path": None, "cached": False, "error": None}
+    try:
+        # stdout carries the JSONL results in batch mode
+        with contextlib.redirect_stdout(sys.stderr), metrics.collect() as collected:
+            cache = None
+            if cache_dir:
+                from cutout_cache import open_cache
+
+                cache = open_cache(cache_dir)
+            store = None
+            if store_dir:
+                from cutout_store import open_store
+
+                store = open_store(store_dir)
+            result.update(
+                extract_products_from_image(image_path, output_dir, cache, store, **options)
+            )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - start, 4)
+    result["metrics"] = collected.as_dict()
+    return result
+
+
+def run_batch(paths, output_dir, workers, duplicates=None, **options):
+    """
+    Spread images over a process pool and stream one JSON line per image
+    to stdout as each one finishes. Images in `duplicates` ({path:
+    representative path}) are not extracted; they share their
+    representative's cutouts once it is done. Returns the summed per-stage
+    metrics.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    start = time.perf_counter()
+    failed = 0
+    path_counts = {}
+    totals = metrics.Metrics()
+    duplicates = duplicates or {}
+    saved = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(process_image, path, output_dir, **options)
+            for path in paths
+            if path not in duplicates
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            if result["error"]:
+                failed += 1
+            elif result["path"]:
+                path_counts[result["path"]] = path_counts.get(result["path"], 0) + 1
+                saved[result["image"]] = result["saved"]
+            totals.merge(result["metrics"])
+            print(json.dumps(result), flush=True)
+
+    store = None
+    if options.get("store_dir"):
+        from cutout_store import open_store
+
+        store = open_store(options["store_dir"])
+    for path, representative in duplicates.items():
+        result = {"image": path, "saved": [], "duplicateOf": representative, "error": None}
+        if representative in saved:
+            with contextlib.redirect_stdout(sys.stderr), metrics.collect() as collected:
+                result["saved"] = share_cutouts(saved[representative], path, output_dir, store)
+            totals.merge(collected.as_dict())
+        else:
+            result["error"] = "representative failed"
+            failed += 1
+        print(json.dumps(result), flush=True)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Processed {len(paths)} images with {workers} workers in {elapsed:.1f}s "
+        f"({len(paths) / elapsed:.1f} images/s, {failed} failed)",
+        file=sys.stderr,
+    )
+    print(f"Mask paths: {json.dumps(path_counts)}", file=sys.stderr)
+    return totals
 
 
 def main():
-    import sys
+    import argparse
 
+    parser = argparse.ArgumentParser(description="Extract products from light-background images")
     # Accept input/output dirs from command line or environment
-    input_dir = sys.argv[1] if len(sys.argv) > 1 else os.getenv("INPUT_DIR", "test_images")
-    output_dir = sys.argv[2] if len(sys.argv) > 2 else os.getenv("OUTPUT_DIR", "out")
+    parser.add_argument("input_dir", nargs="?", default=os.getenv("INPUT_DIR", "test_images"))
+    parser.add_argument("output_dir", nargs="?", default=os.getenv("OUTPUT_DIR", "out"))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Process images over a pool of N processes, streaming JSONL results to stdout",
+    )
+    parser.add_argument(
+        "--select",
+        choices=SELECT_POLICIES,
+        default=SELECT_POLICY,
+        help="Which component is saved as the product (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--top-k", type=int, default=TOP_K, help="Components kept by --select top-k"
+    )
+    parser.add_argument(
+        "--downscale",
+        type=int,
+        default=DOWNSCALE,
+        help="Segment on a copy reduced by this factor and refine edges at full res",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="DIR",
+        help="Content-addressed cutout cache; images already extracted are not reprocessed",
+    )
+    parser.add_argument(
+        "--store",
+        metavar="DIR",
+        help="Append cutouts to a packed, memory-mappable store instead of writing PNGs",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="Extract one image per near-duplicate group (perceptual hash, see "
+        "phash_index.py); the others share its cutouts",
+    )
+    parser.add_argument(
+        "--dedupe-distance",
+        type=int,
+        help="Most differing hash bits for --dedupe (default: phash_index.DEDUPE_DISTANCE)",
+    )
+    parser.add_argument(
+        "--compare-downscale",
+        type=int,
+        nargs="+",
+        metavar="FACTOR",
+        help="Report runtime and mask IoU vs. full res for these factors instead of extracting",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Write per-stage times, peak RSS, input pixels and cache hits as JSON to FILE, "
+        "or print them as a METRICS_JSON block with '-' (to stderr with --workers)",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="No per-image chatter on stdout"
+    )
+    parser.add_argument(
+        "--profile", metavar="FILE", help="Run under cProfile, dumping stats to FILE"
+    )
+    parser.add_argument(
+        "--trace-allocations",
+        action="store_true",
+        help="Run under tracemalloc and report the top allocation sites",
+    )
+    args = parser.parse_args()
+
+    input_dir = args.input_dir
+    output_dir = args.output_dir
 
     os.makedirs(output_dir, exist_ok=True)
 
@@ -145,16 +676,92 @@ def main():
         print(f"No images found in {input_dir}")
         return
 
-    print(f"Found {len(image_files)} images to process\n")
+    paths = [os.path.join(input_dir, f) for f in sorted(image_files)]
+    options = {"policy": args.select, "top_k": args.top_k, "downscale": args.downscale}
 
-    for filename in image_files:
-        path = os.path.join(input_dir, filename)
-        try:
-            extract_products_from_image(path, output_dir)
-        except Exception as e:
-            print(f"Error processing {filename}: {e}")
+    if args.compare_downscale:
+        compare_segmentation(paths, args.compare_downscale)
+        return
 
-    print(f"\nDone! Products saved in: {output_dir}/")
+    duplicates = {}
+    if args.dedupe:
+        from phash_index import DEDUPE_DISTANCE, near_duplicate_groups
+
+        distance = args.dedupe_distance if args.dedupe_distance is not None else DEDUPE_DISTANCE
+        duplicates = near_duplicate_groups(paths, distance, args.workers)
+        print(f"{len(duplicates)} near duplicates will share cutouts", file=sys.stderr)
+
+    if args.workers:
+        totals = run_batch(
+            paths,
+            output_dir,
+            args.workers,
+            duplicates,
+            cache_dir=args.cache,
+            store_dir=args.store,
+            **options,
+        )
+        # stdout carries the JSONL results
+        write_metrics(args.metrics, totals.as_dict(), sys.stderr)
+        return
+
+    cache = None
+    if args.cache:
+        from cutout_cache import CutoutCache
+
+        cache = CutoutCache(args.cache)
+    store = None
+    if args.store:
+        from cutout_store import CutoutStore
+
+        store = CutoutStore(args.store)
+
+    with metrics.collect() as collected:
+        with metrics.quiet_stdout(args.quiet), metrics.profiled(
+            args.profile, args.trace_allocations
+        ):
+            print(f"Found {len(image_files)} images to process\n")
+
+            saved = {}
+            # Near duplicates last, once their representatives are extracted
+            for path in [p for p in paths if p not in duplicates] + list(duplicates):
+                filename = os.path.basename(path)
+                try:
+                    representative = duplicates.get(path)
+                    if representative is not None:
+                        if representative in saved:
+                            print(f"Sharing cutouts of {os.path.basename(representative)} with {filename}")
+                            share_cutouts(saved[representative], path, output_dir, store)
+                        continue
+                    result = extract_products_from_image(path, output_dir, cache, store, **options)
+                    saved[path] = result["saved"]
+                except Exception as e:
+                    print(f"Error processing {filename}: {e}")
+
+            print(f"\nDone! Products saved in: {args.store or output_dir}/")
+            if cache is not None:
+                print(f"Cutout cache: {json.dumps(cache.stats())}")
+
+        if cache is not None:
+            collected.extra["cache"] = cache.stats()
+        if store is not None:
+            collected.extra["store"] = store.stats()
+
+    write_metrics(args.metrics, collected.as_dict())
+
+
+def write_metrics(target, report, stream=None):
+    """Write a metrics report to a file, or as a METRICS_JSON block with target '-'."""
+    if not target:
+        return
+    if target == "-":
+        stream = stream or sys.stdout
+        print("\n===METRICS_JSON===", file=stream)
+        print(json.dumps(report), file=stream)
+        print("===METRICS_JSON_END===", file=stream)
+    else:
+        with open(target, "w") as f:
+            json.dump(report, f, indent=2)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Concurrent image downloads for the collage pipeline.
+
+Images are fetched over one pooled requests.Session by a small thread
+pool, and handed back as they complete so the caller can start parsing
+them while the rest are still in flight.
+
+Requirements:
+    pip install requests
+"""
+
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+FETCH_CONCURRENCY = 8  # simultaneous downloads
+FETCH_TIMEOUT = 30  # seconds per request
+
+
+def make_session(concurrency=FETCH_CONCURRENCY):
+    """A requests.Session whose connection pool matches the concurrency limit."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_bytes(session, url, timeout=FETCH_TIMEOUT):
+    """Download one URL into a BytesIO."""
+    response = session.get(url, timeout=timeout)
+    response.raise_for_status()
+    return BytesIO(response.content)
+
+
+def fetch_all(entries, concurrency=FETCH_CONCURRENCY, session=None):
+    """
+    Download every entry's "url" concurrently.
+
+    Yields (entry, data, error) in completion order; data is a BytesIO, or
+    None with the exception in error if that download failed.
+    """
+    session = session or make_session(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(fetch_bytes, session, entry["url"]): entry for entry in entries}
+        for future in as_completed(futures):
+            entry = futures[future]
+            try:
+                yield entry, future.result(), None
+            except Exception as e:
+                yield entry, None, e
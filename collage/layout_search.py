@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Search for the masonry layout that shows the products largest.
+
+plan_masonry picks the column count from the number of items and places
+them greedily in input order. When one column ends up much taller than
+the others, the global scale shrinks every item to fit it, which wastes
+canvas. This module scores many candidate layouts at once (column counts,
+orderings such as tallest-first, and random swaps of the best so far) and
+returns the one with the most product area on the canvas.
+
+Scoring replays plan_masonry's first pass for every candidate in one set
+of NumPy array operations: column-width scaling, greedy shortest-column
+assignment (one vectorized step per item) and the global scale. The
+product area only depends on those, so the score is exact.
+
+Usage:
+    num_cols, order, report = search_layout([(w, h), ...], 3, 800, 1000)
+"""
+
+import sys
+import time
+import numpy as np
+from numpy.random import default_rng  # imported up front: the first import costs ~10ms
+
+LAYOUT_ROUNDS = 16  # swap rounds; always all of them, so results never depend on timing
+# Safety cap only (16 rounds of 100 items take ~20ms): a search cut short by it
+# is logged, since its layout then depends on the machine
+LAYOUT_BUDGET_MS = 250.0
+LAYOUT_SWAP_BATCH = 64  # candidates scored per swap round
+COLUMN_CHOICES = (1, 2, 3, 4, 5)
+MIN_COLUMN_WIDTH = 100  # px; narrower columns are not considered
+VERTICAL_GAP = 20  # same as plan_masonry
+
+
+def score_layouts(
+    sizes,
+    num_cols,
+    orders,
+    canvas_width,
+    canvas_height,
+    outer_padding=40,
+    vertical_gap=VERTICAL_GAP,
+):
+    """
+    Total product area of candidate layouts.
+
+    Args:
+        sizes: (n, 2) array of item (width, height)
+        num_cols: (C,) column count of each candidate
+        orders: (C, n) placement order of each candidate (item indices)
+
+    Returns:
+        (C,) array of summed final item areas in px
+    """
+    num_candidates, num_items = orders.shape
+    col_width = (canvas_width - outer_padding * (num_cols + 1)) // num_cols
+
+    widths = sizes[:, 0][orders]
+    heights = sizes[:, 1][orders]
+    empty = (widths == 0) | (heights == 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.minimum(1.0, col_width[:, None] / widths)
+    base_w = np.where(empty, 0.0, np.floor(widths * scale))
+    base_h = np.where(empty, 0.0, np.floor(heights * scale))
+
+    # Greedy shortest-column assignment, one step per item for all candidates
+    max_cols = int(num_cols.max())
+    unused = np.arange(max_cols)[None, :] >= num_cols[:, None]
+    column_heights = np.where(unused, np.inf, float(outer_padding))
+    rows = np.arange(num_candidates)
+    for step in range(num_items):
+        col = column_heights.argmin(axis=1)
+        column_heights[rows, col] += base_h[:, step] + vertical_gap
+
+    tallest = np.where(unused, -np.inf, column_heights).max(axis=1)
+    content_height = tallest - outer_padding
+    available_height = canvas_height - 2 * outer_padding
+    with np.errstate(divide="ignore"):
+        global_scale = np.where(
+            content_height > 0, np.minimum(1.0, available_height / content_height), 1.0
+        )
+
+    final_w = np.floor(base_w * global_scale[:, None])
+    final_h = np.floor(base_h * global_scale[:, None])
+    return (final_w * final_h).sum(axis=1)
+
+
+def search_layout(
+    sizes,
+    default_cols,
+    canvas_width,
+    canvas_height,
+    outer_padding=40,
+    vertical_gap=VERTICAL_GAP,
+    budget_ms=LAYOUT_BUDGET_MS,
+):
+    """
+    Find the column count and placement order with the most product area.
+
+    The default layout (default_cols, input order) is always a candidate
+    and wins ties, so the result is never smaller than it. The random swaps
+    use a fixed seed and a fixed number of rounds, so the same items give
+    the same layout on any machine (unless budget_ms runs out first).
+
+    Returns:
+        (num_cols, order, report) where order is a list of item indices and
+        report holds the candidate count, rounds run, elapsed time and both areas
+    """
+    start = time.perf_counter()
+    deadline = start + budget_ms / 1000
+    sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+    num_items = len(sizes)
+
+    col_choices = [
+        k
+        for k in COLUMN_CHOICES
+        if k <= max(num_items, 1)
+        and (canvas_width - outer_padding * (k + 1)) // k >= MIN_COLUMN_WIDTH
+    ] or [default_cols]
+
+    identity = np.arange(num_items)
+    aspect = sizes[:, 1] / np.maximum(sizes[:, 0], 1)
+    orderings = [
+        identity,
+        np.argsort(-aspect, kind="stable"),  # tallest first
+        np.argsort(aspect, kind="stable"),  # widest first
+        np.argsort(-sizes[:, 1], kind="stable"),  # largest height first
+    ]
+
+    # Default layout first so it wins ties
+    cols = [default_cols] + [k for k in col_choices for _ in orderings]
+    orders = [identity] + [order for _ in col_choices for order in orderings]
+    cols = np.array(cols)
+    orders = np.stack(orders)
+    scores = score_layouts(
+        sizes, cols, orders, canvas_width, canvas_height, outer_padding, vertical_gap
+    )
+    default_area = float(scores[0])
+    best = int(scores.argmax())
+    best_cols, best_order, best_area = int(cols[best]), orders[best], float(scores[best])
+    evaluated = len(cols)
+
+    # Random pairwise swaps of the best order, half of them also trying
+    # another column count (drawn up front: the draws cost as much as scoring)
+    rng = default_rng(0)
+    half = LAYOUT_SWAP_BATCH // 2
+    swaps = rng.integers(0, num_items, size=(LAYOUT_ROUNDS, 2, LAYOUT_SWAP_BATCH))
+    col_draws = np.asarray(col_choices)[
+        rng.integers(0, len(col_choices), size=(LAYOUT_ROUNDS, LAYOUT_SWAP_BATCH - half))
+    ]
+    rows = np.arange(LAYOUT_SWAP_BATCH)
+    rounds = 0
+    while num_items > 1 and rounds < LAYOUT_ROUNDS:
+        if time.perf_counter() > deadline:
+            print(
+                f"Layout search hit its {budget_ms:g}ms cap after {rounds}/{LAYOUT_ROUNDS} "
+                f"rounds ({num_items} items); the layout may differ between runs",
+                file=sys.stderr,
+            )
+            break
+        a, b = swaps[rounds]
+        swapped = np.tile(best_order, (LAYOUT_SWAP_BATCH, 1))
+        swapped[rows, a] = best_order[b]
+        swapped[rows, b] = best_order[a]
+        swap_cols = np.full(LAYOUT_SWAP_BATCH, best_cols)
+        swap_cols[half:] = col_draws[rounds]
+
+        scores = score_layouts(
+            sizes, swap_cols, swapped, canvas_width, canvas_height, outer_padding, vertical_gap
+        )
+        evaluated += LAYOUT_SWAP_BATCH
+        rounds += 1
+        candidate = int(scores.argmax())
+        if scores[candidate] > best_area:
+            best_cols, best_order = int(swap_cols[candidate]), swapped[candidate]
+            best_area = float(scores[candidate])
+
+    report = {
+        "candidates": evaluated,
+        "rounds": rounds,
+        "elapsedMs": round((time.perf_counter() - start) * 1000, 3),
+        "area": int(best_area),
+        "defaultArea": int(default_area),
+    }
+    return best_cols, best_order.tolist(), report
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing and memory metrics for extract.py and arrange.py.
+
+Pipeline code marks its stages and counts its inputs; both are no-ops
+unless a collection is active, so library callers pay nothing:
+
+    with metrics.stage("resize"):
+        small = img.resize(size)
+    metrics.count("inputPixels", img.width * img.height)
+
+    with metrics.collect() as collected:
+        render(...)
+    print(json.dumps(collected.as_dict()))
+
+Stages may nest (e.g. "load" includes any "extract" done through the
+cutout cache); each records its own total wall time.
+"""
+
+import os
+import re
+import sys
+import time
+import contextlib
+
+PROFILE_TOP = 25  # functions / allocation sites printed by profiled()
+
+_active = None
+
+
+class Metrics:
+    """Stage wall times, counters and extra fields of one collection."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # name -> seconds, in first-seen order
+        self.counters = {}
+        self.extra = {}
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other):
+        """
+        Add the stages and counters of another collection's as_dict() (e.g.
+        from a pool worker), keeping the largest worker peak RSS.
+        """
+        for name, ms in other.get("stagesMs", {}).items():
+            self.add_time(name, ms / 1000)
+        for name, n in other.get("counters", {}).items():
+            self.add_count(name, n)
+        if "peakRssBytes" in other:
+            self.extra["workerPeakRssBytes"] = max(
+                self.extra.get("workerPeakRssBytes", 0), other["peakRssBytes"]
+            )
+
+    def as_dict(self):
+        return {
+            "totalMs": round((time.perf_counter() - self.started) * 1000, 3),
+            "stagesMs": {name: round(s * 1000, 3) for name, s in self.stages.items()},
+            "counters": dict(self.counters),
+            "peakRssBytes": peak_rss(),
+            **self.extra,
+        }
+
+
+@contextlib.contextmanager
+def collect():
+    """Collect stages and counters recorded in this block into a new Metrics."""
+    global _active
+    previous = _active
+    _active = Metrics()
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time this block as stage `name` of the active collection, if any."""
+    if _active is None:
+        yield
+        return
+    collection = _active
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        collection.add_time(name, time.perf_counter() - start)
+
+
+def count(name, n=1):
+    """Add n to counter `name` of the active collection, if any."""
+    if _active is not None:
+        _active.add_count(name, n)
+
+
+def proc_status_bytes(field):
+    """A kB field of /proc/self/status (Linux) in bytes, or None."""
+    try:
+        with open("/proc/self/status") as f:
+            return int(re.search(rf"{field}:\s+(\d+) kB", f.read()).group(1)) * 1024
+    except (OSError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes."""
+    peak = proc_status_bytes("VmHWM")
+    if peak is None:
+        import resource
+
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = maxrss if sys.platform == "darwin" else maxrss * 1024
+    return peak
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter for this process (Linux). Returns success."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def quiet_stdout(enabled):
+    """Discard stdout (the per-image chatter) in this block when enabled."""
+    if not enabled:
+        return contextlib.nullcontext()
+    stack = contextlib.ExitStack()
+    devnull = stack.enter_context(open(os.devnull, "w"))
+    stack.enter_context(contextlib.redirect_stdout(devnull))
+    return stack
+
+
+@contextlib.contextmanager
+def profiled(profile_path=None, trace_allocations=False, top=PROFILE_TOP):
+    """
+    Optionally run the block under cProfile and/or tracemalloc.
+
+    With profile_path, the raw stats are dumped there (for pstats/snakeviz)
+    and the top functions by cumulative time are printed to stderr. With
+    trace_allocations, the top allocation sites are printed to stderr and
+    the traced peak is added to the active collection as tracedPeakBytes
+    (Python and NumPy allocations; PIL's image buffers are not traced).
+    """
+    profiler = None
+    if profile_path:
+        import cProfile
+
+        profiler = cProfile.Profile()
+    if trace_allocations:
+        import tracemalloc
+
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            import pstats
+
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            print(f"Profile written to {profile_path}", file=sys.stderr)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(top)
+
+        if trace_allocations:
+            snapshot = tracemalloc.take_snapshot()
+            _, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            if _active is not None:
+                _active.extra["tracedPeakBytes"] = traced_peak
+            print(f"Traced allocation peak: {traced_peak} bytes; top sites:", file=sys.stderr)
+            for entry in snapshot.statistics("lineno")[:top]:
+                print(f"  {entry}", file=sys.stderr)
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate index of product images by 64-bit perceptual hash.
+
+Many listings reuse the same supplier photo, re-encoded, resized or with a
+slightly different crop, so exact byte hashes (CutoutCache) miss them.
+Each image is hashed with a DCT pHash of its 32x32 grayscale thumbnail
+(transparent cutouts are flattened onto white first), and two images are
+near duplicates when their hashes differ in at most MAX_DISTANCE bits.
+
+Lookups use multi-index hashing: the hash is split into CHUNKS 16-bit
+chunks, and any hash within distance r of the query matches it to within
+r // CHUNKS bits in at least one chunk (pigeonhole). So a query only
+visits the buckets of each chunk value with at most that many bits
+flipped, instead of scanning the catalog. Each chunk's buckets are one
+array of hashes sorted by that chunk plus a 65536-entry table of bucket
+offsets, so clustering the whole catalog (every image as a query at once)
+is a handful of vectorized gathers.
+Identical hashes are collapsed before the search, so one photo reused by
+thousands of listings costs one bucket entry.
+
+Usage:
+    ./ve/bin/python phash_index.py catalog.npz --add images/ --add-store cache/store
+    ./ve/bin/python phash_index.py catalog.npz --find new-item.jpg
+    ./ve/bin/python phash_index.py catalog.npz --cluster --output clusters.json
+    ./ve/bin/python phash_index.py --bench 100000
+"""
+
+import os
+import sys
+import json
+import time
+import functools
+import numpy as np
+from PIL import Image
+from scipy.fft import dctn
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from atomic import atomic_file
+
+MAX_DISTANCE = 8  # bits; re-encoded or resized copies of a photo are usually within 8
+# Sharing one cutout between images is only safe for real copies, so
+# near_duplicate_groups is stricter and confirms each match on the pixels
+DEDUPE_DISTANCE = 6  # bits
+ASPECT_TOLERANCE = 0.05  # most relative difference in width / height
+MEAN_COLOR_DISTANCE = 20.0  # most RGB distance between mean colors (over white)
+HASH_SIZE = 8  # low-frequency DCT block; 8x8 = 64 bits
+THUMB_SIZE = 32
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".bmp", ".gif", ".webp"}
+
+
+def perceptual_hash(img):
+    """64-bit DCT pHash of a PIL image, as a Python int."""
+    if img.format == "JPEG":
+        img.draft("L", (THUMB_SIZE * 2, THUMB_SIZE * 2))
+    if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+        # Flatten cutouts onto white, so a transparent and a white-background
+        # copy of the same product hash alike
+        rgba = img.convert("RGBA")
+        img = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+        img.alpha_composite(rgba)
+    gray = img.convert("L").resize((THUMB_SIZE, THUMB_SIZE), Image.Resampling.LANCZOS)
+
+    coefficients = dctn(np.asarray(gray, dtype=np.float64), norm="ortho")
+    block = coefficients[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term is the mean brightness; leave it out of the median
+    bits = block > np.median(block[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hash_file(path):
+    """(path, hash) of an image file, or (path, None) if it cannot be read."""
+    try:
+        with Image.open(path) as img:
+            return path, perceptual_hash(img)
+    except (OSError, ValueError):
+        return path, None
+
+
+def image_summary(path):
+    """(pixel count, aspect ratio, mean RGB flattened onto white) of an image file."""
+    with Image.open(path) as img:
+        width, height = img.size
+        if img.format == "JPEG":
+            img.draft("RGB", (THUMB_SIZE * 2, THUMB_SIZE * 2))
+        rgba = img.convert("RGBA")
+    flat = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+    flat.alpha_composite(rgba)
+    thumb = flat.convert("RGB").resize((THUMB_SIZE, THUMB_SIZE), Image.Resampling.BOX)
+    mean = np.asarray(thumb, dtype=np.float64).reshape(-1, 3).mean(axis=0)
+    return width * height, width / height, mean
+
+
+def same_product(a, b):
+    """Whether two image_summary results agree on aspect ratio and mean color."""
+    aspect = abs(a[1] - b[1]) / max(a[1], b[1])
+    color = float(np.linalg.norm(a[2] - b[2]))
+    return aspect <= ASPECT_TOLERANCE and color <= MEAN_COLOR_DISTANCE
+
+
+def hash_files(paths, workers=None):
+    """{path: hash} for image files over a process pool; unreadable ones are skipped."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(hash_file, paths, chunksize=64)
+        return {path: value for path, value in results if value is not None}
+
+
+def popcount(values):
+    """Set bits of each uint64."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    bytes_view = values.astype(">u8").view(np.uint8).reshape(-1, 8)
+    return np.unpackbits(bytes_view, axis=1).sum(axis=1)
+
+
+@functools.lru_cache(maxsize=None)
+def flip_masks(max_bits, width=CHUNK_BITS):
+    """Every width-bit mask with at most max_bits bits set (0 first)."""
+    masks = np.arange(1 << width, dtype=np.uint64)
+    masks = masks[popcount(masks) <= max_bits]
+    return masks[np.argsort(popcount(masks), kind="stable")]
+
+
+def chunk_values(hashes, chunk):
+    """The chunk-th CHUNK_BITS-bit slice of each hash, as int64."""
+    shifted = hashes >> np.uint64(chunk * CHUNK_BITS)
+    return (shifted & np.uint64((1 << CHUNK_BITS) - 1)).astype(np.int64)
+
+
+def expand_ranges(lo, hi):
+    """(query index, position) for every position in [lo[i], hi[i]) of every query i."""
+    counts = hi - lo
+    queries = np.repeat(np.arange(len(lo)), counts)
+    starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+    return queries, starts + np.arange(counts.sum())
+
+
+class PhashIndex:
+    """Multi-index over the 64-bit perceptual hashes of a set of image ids."""
+
+    def __init__(self, ids=(), hashes=()):
+        self.ids = list(ids)
+        self.hashes = np.asarray(list(hashes), dtype=np.uint64).reshape(-1)
+        self._tables = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, items):
+        """Add (id, hash) pairs; an id already present gets its new hash."""
+        items = dict(items)
+        keep = [i for i, item_id in enumerate(self.ids) if item_id not in items]
+        self.ids = [self.ids[i] for i in keep] + list(items)
+        self.hashes = np.concatenate(
+            [self.hashes[keep], np.array(list(items.values()), dtype=np.uint64)]
+        )
+        self._tables = None
+
+    def _build(self):
+        """
+        The distinct hashes, each item's distinct-hash index, the items
+        grouped by distinct hash (with each group's offsets), and per chunk
+        the distinct hashes sorted by that chunk with each chunk value's
+        bucket offsets.
+        """
+        if self._tables is None:
+            unique, inverse = np.unique(self.hashes, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            members = np.argsort(inverse, kind="stable")
+            ends = np.cumsum(np.bincount(inverse, minlength=len(unique)))
+            tables = []
+            for chunk in range(CHUNKS):
+                values = chunk_values(unique, chunk)
+                order = np.argsort(values, kind="stable")
+                offsets = np.concatenate(([0], np.cumsum(np.bincount(values, minlength=1 << CHUNK_BITS))))
+                tables.append((order, offsets))
+            self._tables = unique, inverse, (members, ends - np.diff(ends, prepend=0), ends), tables
+        return self._tables
+
+    def _candidates(self, queries, max_distance):
+        """
+        (query index, unique-hash index) pairs within max_distance, found
+        through the chunk buckets and verified on the full hash. A pair can
+        be found through several chunks, so it may repeat.
+        """
+        unique, _, _, tables = self._build()
+        masks = flip_masks(max_distance // CHUNKS).astype(np.int64)
+        found_queries, found_matches = [], []
+        for chunk, (order, offsets) in enumerate(tables):
+            values = chunk_values(queries, chunk)
+            for mask in masks:
+                keys = values ^ mask
+                query_index, positions = expand_ranges(offsets[keys], offsets[keys + 1])
+                match = order[positions]
+                close = popcount(queries[query_index] ^ unique[match]) <= max_distance
+                found_queries.append(query_index[close])
+                found_matches.append(match[close])
+        return np.concatenate(found_queries), np.concatenate(found_matches)
+
+    def find(self, value, max_distance=MAX_DISTANCE):
+        """[(id, distance)] of every image within max_distance of a hash, closest first."""
+        if not self.ids:
+            return []
+        _, _, (members, starts, ends), _ = self._build()
+        _, matches = self._candidates(np.array([value], dtype=np.uint64), max_distance)
+        matches = np.unique(matches)
+        _, positions = expand_ranges(starts[matches], ends[matches])
+        items = members[positions]
+        distances = popcount(self.hashes[items] ^ np.uint64(value))
+        ranked = np.argsort(distances, kind="stable")
+        return [(self.ids[items[i]], int(distances[i])) for i in ranked]
+
+    def clusters(self, max_distance=MAX_DISTANCE):
+        """
+        Groups of ids linked by near-duplicate pairs (single linkage), with
+        more than one member, largest first; each group keeps index order.
+        """
+        if not self.ids:
+            return []
+        unique, inverse, _, _ = self._build()
+        left, right = self._candidates(unique, max_distance)
+        graph = coo_matrix(
+            (np.ones(len(left), dtype=np.int8), (left, right)), shape=(len(unique),) * 2
+        )
+        _, unique_labels = connected_components(graph, directed=False)
+        labels = unique_labels[inverse]
+
+        sizes = np.bincount(labels)
+        order = np.argsort(labels, kind="stable")
+        groups = np.split(order, np.cumsum(sizes)[:-1])
+        groups = [group for group in groups if len(group) > 1]
+        groups.sort(key=len, reverse=True)
+        return [[self.ids[i] for i in group] for group in groups]
+
+    def save(self, path):
+        with atomic_file(path) as f:
+            np.savez(f, ids=np.array(self.ids, dtype=str), hashes=self.hashes)
+
+    @classmethod
+    def load(cls, path):
+        """The index saved at path, or an empty one if there is none yet."""
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path) as data:
+            return cls(data["ids"].tolist(), data["hashes"])
+
+
+def near_duplicate_groups(paths, max_distance=DEDUPE_DISTANCE, workers=None):
+    """
+    {path: representative path} for image files with a near duplicate among
+    paths, for sharing cutouts.
+
+    The single-linkage clusters are only candidates: a chain a~b~c can join
+    a and c however far apart they are. Each cluster is split into groups
+    around a representative, the largest remaining image (the first in
+    paths order among equals) so the shared cutout is the sharpest. A
+    member must be within max_distance of the representative itself and
+    match its aspect ratio and mean color (same_product); the rest form
+    groups of their own.
+    """
+    hashes = hash_files(paths, workers)
+    index = PhashIndex(hashes.keys(), hashes.values())
+    position = {path: i for i, path in enumerate(paths)}
+
+    representatives = {}
+    for cluster in index.clusters(max_distance):
+        summaries = {path: image_summary(path) for path in cluster}
+        remaining = sorted(cluster, key=lambda path: (-summaries[path][0], position[path]))
+        while len(remaining) > 1:
+            representative, candidates = remaining[0], remaining[1:]
+            remaining = []
+            for path in candidates:
+                distance = bin(hashes[path] ^ hashes[representative]).count("1")
+                if distance <= max_distance and same_product(
+                    summaries[path], summaries[representative]
+                ):
+                    representatives[path] = representative
+                else:
+                    remaining.append(path)
+    return representatives
+
+
+def benchmark(count, max_distance=MAX_DISTANCE, seed=0):
+    """Time building, single lookups and clustering on synthetic hashes with planted duplicates."""
+    rng = np.random.default_rng(seed)
+    hashes = rng.integers(0, 2**63, size=count, dtype=np.uint64) * np.uint64(2) + rng.integers(
+        0, 2, size=count, dtype=np.uint64
+    )
+    # A tenth of the catalog reuses another image's photo, with a few bits changed
+    copies = rng.choice(count, size=count // 10, replace=False)
+    sources = rng.choice(count, size=len(copies))
+    flips = np.zeros(len(copies), dtype=np.uint64)
+    for _ in range(max_distance // 2):
+        flips |= np.uint64(1) << rng.integers(0, 64, size=len(copies), dtype=np.uint64)
+    hashes[copies] = hashes[sources] ^ flips
+
+    index = PhashIndex([f"item-{i}" for i in range(count)], hashes)
+    start = time.perf_counter()
+    index._build()
+    built = time.perf_counter()
+    for value in hashes[:100]:
+        index.find(int(value), max_distance)
+    looked_up = time.perf_counter()
+    clusters = index.clusters(max_distance)
+    clustered = time.perf_counter()
+
+    results = {
+        "images": count,
+        "maxDistance": max_distance,
+        "buildMs": round((built - start) * 1000, 1),
+        "findMs": round((looked_up - built) * 1000 / 100, 3),
+        "clusterMs": round((clustered - looked_up) * 1000, 1),
+        "clusters": len(clusters),
+        "duplicates": sum(len(group) - 1 for group in clusters),
+    }
+    print(json.dumps(results, indent=2))
+    return results
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Perceptual-hash index of product images")
+    parser.add_argument("index", nargs="?", help="Index file (.npz); created if missing")
+    parser.add_argument(
+        "--add", nargs="+", metavar="DIR", default=[], help="Hash the images in these directories"
+    )
+    parser.add_argument(
+        "--add-store", metavar="DIR", help="Hash every cutout in a packed store (cutout_store.py)"
+    )
+    parser.add_argument("--find", nargs="+", metavar="IMAGE", help="List near duplicates of these images")
+    parser.add_argument(
+        "--cluster",
+        action="store_true",
+        help="Group the whole index into candidate near-duplicate sets (single linkage, index order)",
+    )
+    parser.add_argument("--output", metavar="FILE", help="Write --cluster results here instead of stdout")
+    parser.add_argument(
+        "--max-distance",
+        type=int,
+        default=MAX_DISTANCE,
+        help="Most differing hash bits for a near duplicate (default: %(default)s)",
+    )
+    parser.add_argument("--workers", type=int, help="Processes for hashing (default: one per core)")
+    parser.add_argument("--bench", type=int, metavar="N", help="Benchmark N synthetic hashes")
+    args = parser.parse_args()
+
+    if args.bench:
+        benchmark(args.bench, args.max_distance)
+        return
+    if not args.index:
+        parser.error("index is required")
+
+    index = PhashIndex.load(args.index)
+
+    if args.add or args.add_store:
+        start = time.perf_counter()
+        paths = [
+            os.path.join(directory, name)
+            for directory in args.add
+            for name in sorted(os.listdir(directory))
+            if os.path.splitext(name.lower())[1] in IMAGE_EXTENSIONS
+        ]
+        added = hash_files(paths, args.workers)
+        if args.add_store:
+            from cutout_store import CutoutStore
+
+            store = CutoutStore(args.add_store)
+            for item_id in store.ids():
+                added[item_id] = perceptual_hash(store.get(item_id))
+        index.add(added.items())
+        index.save(args.index)
+        print(
+            f"Hashed {len(added)} images in {time.perf_counter() - start:.1f}s; "
+            f"index has {len(index)}",
+            file=sys.stderr,
+        )
+
+    if args.find:
+        for path in args.find:
+            _, value = hash_file(path)
+            if value is None:
+                print(f"Warning: could not read {path}", file=sys.stderr)
+                continue
+            matches = [{"id": item_id, "distance": d} for item_id, d in index.find(value, args.max_distance)]
+            print(json.dumps({"image": path, "hash": f"{value:016x}", "matches": matches}))
+
+    if args.cluster:
+        start = time.perf_counter()
+        clusters = index.clusters(args.max_distance)
+        report = {
+            "images": len(index),
+            "maxDistance": args.max_distance,
+            "duplicates": sum(len(group) - 1 for group in clusters),
+            "seconds": round(time.perf_counter() - start, 3),
+            # Single-linkage candidates in index order, with no representative:
+            # near_duplicate_groups (extract.py --dedupe) splits each one
+            # around its largest image and checks every match on the pixels
+            "clusters": clusters,
+        }
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+            print(
+                f"{len(clusters)} clusters, {report['duplicates']} duplicates "
+                f"in {report['seconds']}s -> {args.output}",
+                file=sys.stderr,
+            )
+        else:
+            print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,799 @@
+#!/usr/bin/env python3
+"""
+Durable job queue and runner for collage generation:
+fetch -> extract -> arrange -> encode -> upload.
+
+Jobs live in a SQLite file, so a request to render a collage returns as
+soon as the job is queued, and queued or half-done jobs survive restarts.
+The runner gives every stage its own worker pool (threads for the I/O
+stages, processes for the CPU ones) and only starts a job on a stage when
+the next stage's backlog is below STAGE_BACKLOG jobs per worker, so a slow
+stage holds back the ones before it instead of piling up their output.
+A failed stage is retried with exponential backoff up to MAX_ATTEMPTS.
+
+Each stage works in the job's own directory under the work dir:
+
+    fetch    downloads the manifest's items and inspiration photo
+    extract  replaces each photo by its cutout (when the job asks for it)
+    arrange  lays out and paints the collage, saved as raw pixels
+    encode   encodes it (png, webp, avif or jpeg)
+    upload   hands the file to the sink and records its URL
+
+With a render cache (on by default, under <pipeline-dir>/renders), arrange
+renders and encodes in one step through arrange.render_and_encode, so an
+outfit re-saved with unchanged items and photo is answered from the cache
+without rendering, and encode only passes the file on.
+
+Sinks are chosen with --sink: "dir:PATH" copies into a local directory
+(offline stand-in) and "gcs" uploads to GOOGLE_CLOUD_BUCKET like
+src/lib/google-storage.ts (needs google-cloud-storage, in requirements.txt).
+A sink that can't be opened fails the job at --submit --spawn-runner (and
+a runner started without one fails the queued jobs) rather than leaving
+them queued. A dir: sink returns file:// URLs unless --sink-base-url says
+where PATH is served; the app only accepts http(s) URLs and fails jobs
+with any other (--fail).
+
+Usage:
+    ./ve/bin/python pipeline.py --run [--workers fetch=8,arrange=2] [--sink gcs]
+    ./ve/bin/python pipeline.py --submit manifest.json [--spawn-runner]
+    ./ve/bin/python pipeline.py --status [JOB_ID]
+    ./ve/bin/python pipeline.py --retry JOB_ID
+    ./ve/bin/python pipeline.py --fail JOB_ID --error "why"
+
+The manifest is arrange.py's (items, inspirationUrl) plus optional
+"outfitId", "format", "optimizeLayout" and "extract". --submit and
+--status print one JSON object on stdout.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import sqlite3
+import subprocess
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+import metrics
+from atomic import copy_atomic, write_atomic
+
+PIPELINE_DIR = os.environ.get("COLLAGE_PIPELINE_DIR", os.path.join("temp", "pipeline"))
+STAGES = ("fetch", "extract", "arrange", "encode", "upload")
+STAGE_WORKERS = {"fetch": 4, "extract": 2, "arrange": 2, "encode": 2, "upload": 4}
+THREAD_STAGES = {"fetch", "upload"}  # I/O bound; the rest run in processes
+STAGE_BACKLOG = 2  # jobs per next-stage worker allowed to wait before a stage pauses
+MAX_ATTEMPTS = 4
+BACKOFF_SECONDS = 2.0  # first retry delay; doubles per attempt, with +-25% jitter
+BACKOFF_MAX_SECONDS = 60.0
+POLL_SECONDS = 0.5  # idle wait between queue checks
+RUNNER_STALE_SECONDS = 10  # a runner heartbeat older than this counts as stopped
+
+
+# ---------------------------------------------------------------------------
+# Queue
+# ---------------------------------------------------------------------------
+
+
+class JobQueue:
+    """Jobs, their stage, state and results in one SQLite file."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                outfit_id INTEGER,
+                manifest TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                state TEXT NOT NULL,  -- queued, running, done, failed
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL,
+                error TEXT,
+                data TEXT NOT NULL DEFAULT '{}',  -- stage outputs
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )"""
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (stage, state, next_attempt)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS runner (id INTEGER PRIMARY KEY CHECK (id = 1), pid INTEGER, heartbeat REAL)"
+        )
+
+    def submit(self, manifest):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.db.execute(
+            "INSERT INTO jobs (id, outfit_id, manifest, stage, state, next_attempt, created, updated) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, manifest.get("outfitId"), json.dumps(manifest), STAGES[0], now, now, now),
+        )
+        return job_id
+
+    def claim(self, stage):
+        """Mark the oldest ready job of a stage running and return it, or None."""
+        now = time.time()
+        row = self.db.execute(
+            "UPDATE jobs SET state = 'running', attempts = attempts + 1, updated = ? "
+            "WHERE id = (SELECT id FROM jobs WHERE stage = ? AND state = 'queued' "
+            "AND next_attempt <= ? ORDER BY created LIMIT 1) RETURNING *",
+            (now, stage, now),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def advance(self, job, output):
+        """Record a stage's output and queue the job on the next stage (or finish it)."""
+        data = json.loads(job["data"])
+        data[job["stage"]] = output
+        position = STAGES.index(job["stage"])
+        done = position == len(STAGES) - 1
+        self.db.execute(
+            "UPDATE jobs SET stage = ?, state = ?, attempts = 0, next_attempt = ?, error = NULL, "
+            "data = ?, updated = ? WHERE id = ?",
+            (
+                job["stage"] if done else STAGES[position + 1],
+                "done" if done else "queued",
+                time.time(),
+                json.dumps(data),
+                time.time(),
+                job["id"],
+            ),
+        )
+
+    def fail(self, job, error):
+        """Queue a retry after the backoff delay, or fail the job after MAX_ATTEMPTS."""
+        final = job["attempts"] >= MAX_ATTEMPTS
+        delay = min(BACKOFF_SECONDS * 2 ** (job["attempts"] - 1), BACKOFF_MAX_SECONDS)
+        delay *= random.uniform(0.75, 1.25)
+        self.db.execute(
+            "UPDATE jobs SET state = ?, next_attempt = ?, error = ?, updated = ? WHERE id = ?",
+            ("failed" if final else "queued", time.time() + delay, error, time.time(), job["id"]),
+        )
+        return final
+
+    def retry(self, job_id):
+        """Requeue a failed job on the stage it failed in. Returns whether it was found."""
+        cursor = self.db.execute(
+            "UPDATE jobs SET state = 'queued', attempts = 0, next_attempt = ?, updated = ? "
+            "WHERE id = ? AND state = 'failed'",
+            (time.time(), time.time(), job_id),
+        )
+        return cursor.rowcount > 0
+
+    def reject(self, job_id, error):
+        """
+        Mark a finished job failed, e.g. when its result cannot be used. It
+        goes back to the first stage, so --retry renders it from scratch (the
+        work directory is gone). Returns whether it was found.
+        """
+        cursor = self.db.execute(
+            "UPDATE jobs SET state = 'failed', stage = ?, error = ?, updated = ? "
+            "WHERE id = ? AND state = 'done'",
+            (STAGES[0], error, time.time(), job_id),
+        )
+        return cursor.rowcount > 0
+
+    def abort(self, error, job_id=None):
+        """
+        Fail a queued job (or every queued and running one) before it runs,
+        e.g. when nothing could upload it. Returns how many were failed.
+        """
+        if job_id is None:
+            cursor = self.db.execute(
+                "UPDATE jobs SET state = 'failed', error = ?, updated = ? "
+                "WHERE state IN ('queued', 'running')",
+                (error, time.time()),
+            )
+        else:
+            cursor = self.db.execute(
+                "UPDATE jobs SET state = 'failed', error = ?, updated = ? "
+                "WHERE id = ? AND state = 'queued'",
+                (error, time.time(), job_id),
+            )
+        return cursor.rowcount
+
+    def recover(self):
+        """Requeue jobs left running by a runner that died; returns how many."""
+        cursor = self.db.execute(
+            "UPDATE jobs SET state = 'queued', next_attempt = ? WHERE state = 'running'", (time.time(),)
+        )
+        return cursor.rowcount
+
+    def backlog(self, stage):
+        """Jobs queued or running on a stage."""
+        (count,) = self.db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE stage = ? AND state IN ('queued', 'running')", (stage,)
+        ).fetchone()
+        return count
+
+    def pending(self):
+        (count,) = self.db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'running')"
+        ).fetchone()
+        return count
+
+    def heartbeat(self):
+        self.db.execute(
+            "INSERT OR REPLACE INTO runner (id, pid, heartbeat) VALUES (1, ?, ?)", (os.getpid(), time.time())
+        )
+
+    def clear_heartbeat(self):
+        self.db.execute("DELETE FROM runner")
+
+    def runner_alive(self):
+        row = self.db.execute("SELECT heartbeat FROM runner WHERE id = 1").fetchone()
+        return row is not None and time.time() - row["heartbeat"] < RUNNER_STALE_SECONDS
+
+    def status(self, job_id):
+        """A job's status for the API, or None if there is no such job."""
+        row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row["data"])
+        status = {
+            "jobId": row["id"],
+            "outfitId": row["outfit_id"],
+            "stage": row["stage"],
+            "state": row["state"],
+            "attempts": row["attempts"],
+            "error": row["error"],
+            "createdAt": row["created"],
+            "updatedAt": row["updated"],
+            "stageMs": {stage: output.get("ms") for stage, output in data.items()},
+            "runnerAlive": self.runner_alive(),
+        }
+        if row["state"] == "queued" and row["next_attempt"] > time.time():
+            status["retryInSeconds"] = round(row["next_attempt"] - time.time(), 1)
+        if row["state"] == "done":
+            status["url"] = data["upload"]["url"]
+            status["boundingBoxes"] = data["arrange"]["boundingBoxes"]
+            status["format"] = data["encode"]["format"]
+            status["bytes"] = data["encode"]["bytes"]
+        return status
+
+    def summary(self):
+        """Job counts by stage and state, plus the runner's liveness."""
+        counts = {}
+        for row in self.db.execute("SELECT stage, state, COUNT(*) AS n FROM jobs GROUP BY stage, state"):
+            counts.setdefault(row["stage"], {})[row["state"]] = row["n"]
+        return {"stages": counts, "runnerAlive": self.runner_alive()}
+
+
+# ---------------------------------------------------------------------------
+# Sinks
+# ---------------------------------------------------------------------------
+
+
+class DirectorySink:
+    """Copies uploads into a local directory: the offline stand-in for GCS."""
+
+    def __init__(self, directory, base_url=None):
+        self.directory = os.path.abspath(directory)
+        self.base_url = base_url
+
+    def put(self, local_path, key):
+        destination = os.path.join(self.directory, key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        copy_atomic(local_path, destination)
+        if self.base_url:
+            return f"{self.base_url.rstrip('/')}/{key}"
+        return f"file://{destination}"
+
+
+class GCSSink:
+    """Uploads to GOOGLE_CLOUD_BUCKET with the app's base64 GOOGLE_CLOUD_CREDENTIALS."""
+
+    def __init__(self):
+        import base64
+        from google.cloud import storage
+        from google.oauth2 import service_account
+
+        info = json.loads(base64.b64decode(os.environ["GOOGLE_CLOUD_CREDENTIALS"]))
+        credentials = service_account.Credentials.from_service_account_info(info)
+        self.bucket_name = os.environ["GOOGLE_CLOUD_BUCKET"]
+        client = storage.Client(project=info["project_id"], credentials=credentials)
+        self.bucket = client.bucket(self.bucket_name)
+
+    def put(self, local_path, key):
+        blob = self.bucket.blob(key)
+        blob.cache_control = "public, max-age=31536000"
+        blob.upload_from_filename(local_path)
+        return f"https://storage.googleapis.com/{self.bucket_name}/{key}"
+
+
+def check_sink(spec):
+    """Why a sink from --sink can't be opened, or None if it can."""
+    if spec.startswith("dir:"):
+        return None
+    if spec != "gcs":
+        return f"Unknown sink {spec!r} (expected dir:PATH or gcs)"
+    try:
+        from google.cloud import storage  # noqa: F401
+        from google.oauth2 import service_account  # noqa: F401
+    except ImportError as e:
+        return (
+            "The gcs sink needs google-cloud-storage "
+            f"(./ve/bin/pip install -r requirements.txt): {e}"
+        )
+    missing = [
+        name
+        for name in ("GOOGLE_CLOUD_BUCKET", "GOOGLE_CLOUD_CREDENTIALS")
+        if not os.environ.get(name)
+    ]
+    if missing:
+        return f"The gcs sink needs {' and '.join(missing)}"
+    return None
+
+
+def open_sink(spec, base_url=None):
+    """A sink from --sink: "dir:PATH" or "gcs"; raises ValueError if it can't be opened."""
+    problem = check_sink(spec)
+    if problem:
+        raise ValueError(problem)
+    if spec == "gcs":
+        return GCSSink()
+    return DirectorySink(spec[len("dir:") :], base_url)
+
+
+# ---------------------------------------------------------------------------
+# Stages
+#
+# Each takes the job's work directory, manifest and earlier stage outputs,
+# and returns its own JSON-serializable output. They run in pool workers,
+# so they only touch files, never the queue.
+# ---------------------------------------------------------------------------
+
+_worker_caches = {}
+_worker_sink = None
+
+
+def init_stage_worker(cache_options):
+    """Pool initializer: per-process caches shared by every job in that process."""
+    from arrange import open_caches
+
+    _worker_caches.update(open_caches(**cache_options, keep_resized=True))
+
+
+def stage_fetch(job_dir, manifest, outputs, final_attempt):
+    """
+    Download the items and inspiration photo. Files fetched by an earlier
+    attempt are kept. A failed download fails the attempt, except on the
+    last one, which goes on without it (like arrange.py) if any item is left.
+    """
+    from fetch import fetch_all
+
+    os.makedirs(job_dir, exist_ok=True)
+    items, entries, failures = [], [], []
+    for item in manifest.get("items", []):
+        source = item.get("path") or item.get("url")
+        if not source:
+            continue
+        if item.get("path"):
+            items.append({"itemId": item["itemId"], "path": item["path"]})
+            continue
+        ext = ".png" if source.endswith(".png") else ".jpg"
+        path = os.path.join(job_dir, f"item-{item['itemId']}{ext}")
+        entries.append({"url": source, "path": path, "itemId": item["itemId"]})
+    inspiration = manifest.get("inspiration")
+    if manifest.get("inspirationUrl"):
+        inspiration = os.path.join(job_dir, "inspiration")
+        entries.append({"url": manifest["inspirationUrl"], "path": inspiration, "inspiration": True})
+
+    missing = [entry for entry in entries if not os.path.exists(entry["path"])]
+    for entry, data, error in fetch_all(missing):
+        if error is not None:
+            failures.append(f"{entry['url']}: {error}")
+            continue
+        write_atomic(entry["path"], data.getvalue())
+
+    for entry in entries:
+        if os.path.exists(entry["path"]) and not entry.get("inspiration"):
+            items.append({"itemId": entry["itemId"], "path": entry["path"]})
+    if failures and (not final_attempt or not items):
+        raise IOError(f"{len(failures)} downloads failed: {'; '.join(failures)}")
+    if inspiration and not os.path.exists(inspiration):
+        inspiration = None
+
+    return {"items": items, "inspiration": inspiration, "failed": failures}
+
+
+def stage_extract(job_dir, manifest, outputs, final_attempt):
+    """Replace each item photo by its first cutout, if the job asks for extraction."""
+    fetched = outputs["fetch"]
+    if not manifest.get("extract"):
+        return {"items": fetched["items"], "extracted": 0}
+
+    import extract
+    from PIL import Image
+
+    cutout_cache = _worker_caches.get("cutout")
+    items, extracted = [], 0
+    for item in fetched["items"]:
+        if cutout_cache is not None:
+            cutouts, _, _ = cutout_cache.get_or_extract(item["path"])
+        else:
+            with Image.open(item["path"]) as img:
+                cutouts, _ = extract.extract_cutouts(img)
+        if not cutouts:
+            items.append(item)  # nothing found: the photo as-is
+            continue
+        path = os.path.join(job_dir, f"item-{item['itemId']}.cutout.png")
+        cutouts[0].save(path, "PNG")
+        items.append({"itemId": item["itemId"], "path": path})
+        extracted += 1
+    return {"items": items, "extracted": extracted}
+
+
+def stage_arrange(job_dir, manifest, outputs, final_attempt):
+    """
+    Render the collage and save its pixels raw for the encode stage, or,
+    with a render cache, render (or reuse) and encode it here.
+    """
+    import arrange
+
+    # Local paths only, already extracted: nothing is fetched or cut out here
+    images, _ = arrange.load_manifest_images({"items": outputs["extract"]["items"]})
+    render_cache = _worker_caches.get("render")
+    if render_cache is not None:
+        fmt = manifest.get("format", "png")
+        result = arrange.render_and_encode(
+            images,
+            inspiration=outputs["fetch"]["inspiration"],
+            resize_cache=_worker_caches.get("resize"),
+            render_cache=render_cache,
+            fmt=fmt,
+            optimize_layout=manifest.get("optimizeLayout", False),
+        )
+        if result is None:
+            raise ValueError("No images to arrange")
+        path = os.path.join(job_dir, f"collage{arrange.FORMAT_EXTENSIONS[fmt]}")
+        write_atomic(path, result["data"])
+        return {
+            "encoded": {"path": path, "format": fmt, "bytes": len(result["data"])},
+            "size": [result["width"], result["height"]],
+            "boundingBoxes": result["boundingBoxes"],
+            "cacheHit": result["hit"],
+        }
+
+    collage, bounding_boxes = arrange.render_collage(
+        images,
+        inspiration=outputs["fetch"]["inspiration"],
+        resize_cache=_worker_caches.get("resize"),
+        render_cache=_worker_caches.get("render"),
+        optimize_layout=manifest.get("optimizeLayout", False),
+    )
+    if collage is None:
+        raise ValueError("No images to arrange")
+
+    path = os.path.join(job_dir, "collage.raw")
+    with open(path, "wb") as f:
+        f.write(collage.tobytes())
+    return {
+        "path": path,
+        "mode": collage.mode,
+        "size": [collage.width, collage.height],
+        "boundingBoxes": bounding_boxes,
+    }
+
+
+def stage_encode(job_dir, manifest, outputs, final_attempt):
+    """Encode the raw collage in the job's format (unless arrange already did)."""
+    import arrange
+    from PIL import Image
+
+    arranged = outputs["arrange"]
+    if "encoded" in arranged:
+        return dict(arranged["encoded"])
+    with open(arranged["path"], "rb") as f:
+        collage = Image.frombytes(arranged["mode"], tuple(arranged["size"]), f.read())
+    fmt = manifest.get("format", "png")
+    data = arrange.encode_collage(collage, fmt)
+    path = os.path.join(job_dir, f"collage{arrange.FORMAT_EXTENSIONS[fmt]}")
+    write_atomic(path, data)
+    return {"path": path, "format": fmt, "bytes": len(data)}
+
+
+def stage_upload(job_dir, manifest, outputs, final_attempt):
+    """Hand the encoded collage to the sink; the work directory is removed after."""
+    encoded = outputs["encode"]
+    outfit = manifest.get("outfitId", "x")
+    key = f"collages/outfit-{outfit}-{uuid.uuid4()}{os.path.splitext(encoded['path'])[1]}"
+    url = _worker_sink.put(encoded["path"], key)
+    shutil.rmtree(job_dir, ignore_errors=True)
+    return {"url": url, "key": key}
+
+
+STAGE_FUNCTIONS = {
+    "fetch": stage_fetch,
+    "extract": stage_extract,
+    "arrange": stage_arrange,
+    "encode": stage_encode,
+    "upload": stage_upload,
+}
+
+
+def run_stage(stage, job_dir, manifest, outputs, final_attempt):
+    """
+    Run one stage in a pool worker; returns its output with its time, and
+    the stage's metrics for the process stages (stdout redirection and
+    metrics collection are per process, so thread stages skip them).
+    """
+    start = time.perf_counter()
+    if stage in THREAD_STAGES:
+        output = STAGE_FUNCTIONS[stage](job_dir, manifest, outputs, final_attempt)
+    else:
+        with metrics.quiet_stdout(True), metrics.collect() as collected:
+            output = STAGE_FUNCTIONS[stage](job_dir, manifest, outputs, final_attempt)
+        output["metrics"] = collected.as_dict()
+    output["ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return output
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+
+def parse_workers(spec):
+    """STAGE_WORKERS updated from "fetch=8,arrange=2"."""
+    workers = dict(STAGE_WORKERS)
+    for part in filter(None, (spec or "").split(",")):
+        stage, _, count = part.partition("=")
+        if stage not in workers:
+            raise ValueError(f"Unknown stage {stage!r}")
+        workers[stage] = int(count)
+    return workers
+
+
+def acquire_runner_lock(pipeline_dir):
+    """An exclusive lock on the runner lock file, or None if another runner holds it."""
+    import fcntl
+
+    lock = open(os.path.join(pipeline_dir, "runner.lock"), "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+
+def run(pipeline_dir=PIPELINE_DIR, workers=None, sink=None, cache_options=None, drain=False):
+    """
+    Run jobs until interrupted (or, with drain, until the queue is empty).
+    Returns the number of jobs finished and failed.
+    """
+    global _worker_sink
+
+    workers = workers or dict(STAGE_WORKERS)
+    os.makedirs(pipeline_dir, exist_ok=True)
+    lock = acquire_runner_lock(pipeline_dir)
+    if lock is None:
+        print("Another runner is already running", file=sys.stderr)
+        return {"done": 0, "failed": 0}
+
+    queue = JobQueue(os.path.join(pipeline_dir, "jobs.sqlite"))
+    recovered = queue.recover()
+    if recovered:
+        print(f"Requeued {recovered} jobs left running by a previous runner")
+    _worker_sink = sink or open_sink(f"dir:{os.path.join(pipeline_dir, 'uploads')}")
+    work_dir = os.path.join(pipeline_dir, "work")
+
+    pools = {}
+    for stage in STAGES:
+        if stage in THREAD_STAGES:
+            pools[stage] = ThreadPoolExecutor(max_workers=workers[stage])
+        else:
+            pools[stage] = ProcessPoolExecutor(
+                max_workers=workers[stage],
+                initializer=init_stage_worker,
+                initargs=(cache_options or {},),
+            )
+    running = {}  # future -> (job, started)
+    in_flight = {stage: 0 for stage in STAGES}
+    totals = {"done": 0, "failed": 0}
+    print(f"Runner started: workers {json.dumps(workers)}")
+
+    try:
+        while True:
+            queue.heartbeat()
+
+            # Downstream stages first, so finished work drains before new work starts
+            for position in reversed(range(len(STAGES))):
+                stage = STAGES[position]
+                while in_flight[stage] < workers[stage]:
+                    if position + 1 < len(STAGES):
+                        following = STAGES[position + 1]
+                        if queue.backlog(following) >= STAGE_BACKLOG * workers[following]:
+                            break  # backpressure
+                    job = queue.claim(stage)
+                    if job is None:
+                        break
+                    manifest = json.loads(job["manifest"])
+                    outputs = json.loads(job["data"])
+                    job_dir = os.path.join(work_dir, job["id"])
+                    future = pools[stage].submit(
+                        run_stage, stage, job_dir, manifest, outputs, job["attempts"] >= MAX_ATTEMPTS
+                    )
+                    running[future] = (job, time.perf_counter())
+                    in_flight[stage] += 1
+
+            if not running:
+                if drain and queue.pending() == 0:
+                    break
+                time.sleep(POLL_SECONDS)
+                continue
+
+            finished, _ = wait(running, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job, started = running.pop(future)
+                in_flight[job["stage"]] -= 1
+                label = f"job {job['id'][:8]} (outfit {job['outfit_id']}) {job['stage']}"
+                try:
+                    output = future.result()
+                except Exception as e:
+                    error = f"{job['stage']}: {type(e).__name__}: {e}"
+                    if queue.fail(job, error):
+                        totals["failed"] += 1
+                        print(f"  {label} failed for good: {error}")
+                    else:
+                        print(f"  {label} failed (attempt {job['attempts']}), retrying: {error}")
+                    continue
+                queue.advance(job, output)
+                print(f"  {label} done in {time.perf_counter() - started:.2f}s")
+                if job["stage"] == STAGES[-1]:
+                    totals["done"] += 1
+    except KeyboardInterrupt:
+        print("Stopping; running jobs are requeued on the next start")
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        queue.clear_heartbeat()
+        lock.close()
+
+    return totals
+
+
+def spawn_runner(pipeline_dir, args=()):
+    """Start a detached runner in the background, logging to runner.log."""
+    log = open(os.path.join(pipeline_dir, "runner.log"), "a")
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--run", "--pipeline-dir", pipeline_dir, *args],
+        stdout=log,
+        stderr=log,
+        stdin=subprocess.DEVNULL,
+        start_new_session=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Durable collage job queue and runner")
+    parser.add_argument("--run", action="store_true", help="Run jobs until interrupted")
+    parser.add_argument("--drain", action="store_true", help="With --run, stop once the queue is empty")
+    parser.add_argument("--submit", metavar="FILE", help="Queue a manifest ('-' for stdin); prints its job id")
+    parser.add_argument(
+        "--spawn-runner",
+        action="store_true",
+        help="With --submit, start a background runner if none is alive",
+    )
+    parser.add_argument(
+        "--status", nargs="?", const="", metavar="JOB_ID", help="A job's status, or queue totals"
+    )
+    parser.add_argument("--retry", metavar="JOB_ID", help="Requeue a failed job")
+    parser.add_argument("--fail", metavar="JOB_ID", help="Mark a finished job failed (with --error)")
+    parser.add_argument("--error", default="Rejected", help="Error recorded by --fail")
+    parser.add_argument(
+        "--pipeline-dir",
+        default=PIPELINE_DIR,
+        help="Queue database and work directory (default: %(default)s)",
+    )
+    parser.add_argument("--workers", help="Workers per stage, e.g. fetch=8,arrange=4")
+    parser.add_argument(
+        "--sink",
+        default=os.environ.get("COLLAGE_SINK") or ("gcs" if os.environ.get("GOOGLE_CLOUD_BUCKET") else None),
+        help="Upload sink: dir:PATH or gcs (default: $COLLAGE_SINK, else gcs when "
+        "GOOGLE_CLOUD_BUCKET is set, else dir:<pipeline-dir>/uploads)",
+    )
+    parser.add_argument("--sink-base-url", help="Public URL prefix of a dir: sink")
+    parser.add_argument("--cutout-cache", metavar="DIR", help="CutoutCache for the extract stage")
+    parser.add_argument("--resize-cache-dir", metavar="DIR", help="Shared resized-item cache")
+    parser.add_argument(
+        "--render-cache",
+        metavar="DIR",
+        help="Reuse renders whose inputs are unchanged (default: <pipeline-dir>/renders)",
+    )
+    parser.add_argument("--no-render-cache", action="store_true", help="Always render")
+    args = parser.parse_args()
+    if args.render_cache is None and not args.no_render_cache:
+        args.render_cache = os.path.join(args.pipeline_dir, "renders")
+
+    os.makedirs(args.pipeline_dir, exist_ok=True)
+    queue = JobQueue(os.path.join(args.pipeline_dir, "jobs.sqlite"))
+
+    if args.submit:
+        if args.submit == "-":
+            manifest = json.load(sys.stdin)
+        else:
+            with open(args.submit) as f:
+                manifest = json.load(f)
+        job_id = queue.submit(manifest)
+        if args.spawn_runner and not queue.runner_alive():
+            # Checked here: a runner that can't open its sink exits at once
+            problem = check_sink(args.sink) if args.sink else None
+            if problem:
+                queue.abort(f"upload: {problem}", job_id)
+                print(json.dumps({"jobId": job_id, "state": "failed", "error": f"upload: {problem}"}))
+                return
+            runner_args = []
+            for option, value in (
+                ("--sink", args.sink),
+                ("--sink-base-url", args.sink_base_url),
+                ("--cutout-cache", args.cutout_cache),
+                ("--resize-cache-dir", args.resize_cache_dir),
+                ("--render-cache", args.render_cache),
+            ):
+                if value:
+                    runner_args += [option, value]
+            if args.no_render_cache:
+                runner_args.append("--no-render-cache")
+            spawn_runner(args.pipeline_dir, runner_args)
+        print(json.dumps({"jobId": job_id, "state": "queued"}))
+        return
+
+    if args.status is not None:
+        status = queue.status(args.status) if args.status else queue.summary()
+        if status is None:
+            print(json.dumps({"jobId": args.status, "error": "No such job"}))
+            sys.exit(1)
+        print(json.dumps(status))
+        return
+
+    if args.retry:
+        if not queue.retry(args.retry):
+            print(f"No failed job {args.retry}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(queue.status(args.retry)))
+        return
+
+    if args.fail:
+        if not queue.reject(args.fail, args.error):
+            print(f"No finished job {args.fail}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(queue.status(args.fail)))
+        return
+
+    if args.run:
+        problem = check_sink(args.sink) if args.sink else None
+        if problem:
+            failed = queue.abort(f"upload: {problem}")
+            print(f"Cannot start the runner: {problem} ({failed} queued jobs failed)", file=sys.stderr)
+            sys.exit(1)
+        sink = open_sink(args.sink, args.sink_base_url) if args.sink else None
+        cache_options = {
+            "cutout_dir": args.cutout_cache,
+            "resize_dir": args.resize_cache_dir,
+            "render_dir": args.render_cache,
+        }
+        totals = run(args.pipeline_dir, parse_workers(args.workers), sink, cache_options, args.drain)
+        print(f"Runner stopped: {totals['done']} jobs done, {totals['failed']} failed")
+        return
+
+    parser.error("one of --run, --submit, --status, --retry or --fail is required")
+
+
+if __name__ == "__main__":
+    main()
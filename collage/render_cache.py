@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of finished collages and inspiration panels, keyed by
+input fingerprints.
+
+arrange.py fingerprints a render from the hashes of its input images, the
+layout code and parameters, the canvas size and the encoder settings. A
+render whose fingerprint is already here is returned as-is (encoded bytes
+plus bounding boxes) without touching any pixels. The inspiration panel
+(the photo scaled and centered on its white canvas) is cached under its
+own fingerprint, so editing one product only re-renders the product half.
+
+Like CutoutCache, the cache is LRU-evicted under a byte cap: a render's
+metadata file (or a panel's pixel file) has its mtime touched on every
+hit, and once the cache grows past max_bytes the least recently used
+entries are removed until it is back under EVICT_LOW_WATER of the cap.
+
+Usage:
+    cache = RenderCache("cache/renders")
+    cached = cache.get(fingerprint)  # (data, meta) or None
+"""
+
+import os
+import json
+from PIL import Image
+
+from atomic import write_atomic
+
+RENDER_CACHE_MAX_BYTES = 1024**3  # 1 GiB
+# Evict down to this fraction of max_bytes (see cutout_cache.py)
+EVICT_LOW_WATER = 0.9
+
+
+class RenderCache:
+    """LRU-evicted store of finished collages and inspiration panels by fingerprint."""
+
+    def __init__(self, cache_dir, max_bytes=RENDER_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.panel_hits = 0
+        self.panel_misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self._entries())
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _entries(self):
+        """
+        Yield (file names, mtime, size in bytes) for every complete render
+        and panel. The first name is the one whose mtime is the LRU clock.
+        """
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                names = [name, f"{name[: -len('.json')]}.out"]
+            elif name.startswith("panel-") and name.endswith(".rgba"):
+                names = [name]
+            else:
+                continue
+            try:
+                mtime = os.path.getmtime(self._path(names[0]))
+                size = sum(os.path.getsize(self._path(entry)) for entry in names)
+            except OSError:
+                continue
+            yield names, mtime, size
+
+    def get(self, fingerprint):
+        """Return (encoded bytes, metadata) of a finished render, or None."""
+        try:
+            with open(self._path(f"{fingerprint}.json")) as f:
+                meta = json.load(f)
+            with open(self._path(f"{fingerprint}.out"), "rb") as f:
+                data = f.read()
+            os.utime(self._path(f"{fingerprint}.json"))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return data, meta
+
+    def put(self, fingerprint, data, meta):
+        """Store a finished render; meta holds its bounding boxes, size and format."""
+        size = write_atomic(self._path(f"{fingerprint}.out"), data)
+        # Metadata last: its presence marks the entry complete
+        size += write_atomic(self._path(f"{fingerprint}.json"), json.dumps(meta).encode())
+        self._added(size)
+
+    def get_panel(self, fingerprint, size):
+        """Return a cached RGBA inspiration panel of the given size, or None."""
+        path = self._path(f"panel-{fingerprint}.rgba")
+        try:
+            with open(path, "rb") as f:
+                panel = Image.frombytes("RGBA", size, f.read())
+            os.utime(path)
+        except (OSError, ValueError):
+            self.panel_misses += 1
+            return None
+
+        self.panel_hits += 1
+        return panel
+
+    def put_panel(self, fingerprint, panel):
+        """Store an RGBA inspiration panel as raw pixels."""
+        self._added(write_atomic(self._path(f"panel-{fingerprint}.rgba"), panel.tobytes()))
+
+    def _added(self, size):
+        self.total_bytes += size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache is under its low-water mark."""
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for names, _, size in entries:
+            if total <= self.max_bytes * EVICT_LOW_WATER:
+                break
+            # The LRU file first, so a reader never sees metadata without its render
+            for name in names:
+                try:
+                    os.unlink(self._path(name))
+                except FileNotFoundError:
+                    pass
+            total -= size
+            self.evictions += 1
+        self.total_bytes = total
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "panelHits": self.panel_hits,
+            "panelMisses": self.panel_misses,
+            "evictions": self.evictions,
+            "bytes": self.total_bytes,
+            "maxBytes": self.max_bytes,
+        }
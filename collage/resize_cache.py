@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Cache of LANCZOS-resized product images for the masonry layout.
+
+The final item sizes in a collage come from a small set of column widths
+and global scales, so the same product is resized to the same few sizes
+over and over. Resized copies are kept in memory under a byte budget
+(LRU), keyed by (content hash of the source pixels, target size), and can
+optionally be persisted to disk as raw RGBA so other processes and later
+runs reuse them.
+
+Usage:
+    cache = ResizeCache(max_bytes=256 * 1024**2, cache_dir="cache/resized")
+    small = cache.resize(img, (190, 240))
+"""
+
+import os
+import hashlib
+from collections import OrderedDict
+from PIL import Image
+
+from atomic import write_atomic
+
+RESIZE_CACHE_MAX_BYTES = 256 * 1024**2  # in-memory budget, 256 MiB
+
+
+def image_digest(img):
+    """
+    Content hash of an image's pixels. The result is remembered in
+    img.info so each image is only hashed once (lazily loaded images
+    provide their own file hash there).
+    """
+    digest = img.info.get("digest")
+    if digest is None:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{img.mode}:{img.width}x{img.height}:".encode())
+        h.update(img.tobytes())
+        digest = h.hexdigest()
+        img.info["digest"] = digest
+    return digest
+
+
+class ResizeCache:
+    """In-memory LRU of resized images, optionally backed by a directory."""
+
+    def __init__(self, max_bytes=RESIZE_CACHE_MAX_BYTES, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        digest, (w, h) = key
+        return os.path.join(self.cache_dir, f"{digest}_{w}x{h}.rgba")
+
+    def _remember(self, key, img):
+        size = len(img.getbands()) * img.width * img.height
+        if size > self.max_bytes:
+            return
+        self.entries[key] = img
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, old = self.entries.popitem(last=False)
+            self.total_bytes -= len(old.getbands()) * old.width * old.height
+
+    def resize(self, img, size):
+        """
+        Return img resized to size with LANCZOS as an RGBA image, reusing a
+        cached copy when possible.
+        """
+        size = (int(size[0]), int(size[1]))
+        key = (image_digest(img), size)
+
+        cached = self.entries.get(key)
+        if cached is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return cached
+
+        if self.cache_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, "rb") as f:
+                    resized = Image.frombytes("RGBA", size, f.read())
+                self.disk_hits += 1
+                self._remember(key, resized)
+                return resized
+            except (OSError, ValueError):
+                pass
+
+        self.misses += 1
+        resized = img.resize(size, Image.Resampling.LANCZOS)
+        if resized.mode != "RGBA":
+            resized = resized.convert("RGBA")
+        self._remember(key, resized)
+
+        if self.cache_dir:
+            write_atomic(path, resized.tobytes())
+
+        return resized
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "diskHits": self.disk_hits,
+            "misses": self.misses,
+            "hitRate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "maxBytes": self.max_bytes,
+        }
@@ -0,0 +1,12 @@
+"""
+Tests for the collage pipeline. The modules import each other as siblings
+(they run as scripts from collage/), so that directory goes on sys.path.
+
+Run from collage/:
+    ./ve/bin/python -m pytest tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
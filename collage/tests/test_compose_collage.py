@@ -0,0 +1,73 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from arrange import compose_collage, merge_with_inspiration, paint_masonry, plan_masonry
+from render_cache import RenderCache
+
+
+def cutout(size, seed):
+    """An RGBA product with soft, partly transparent edges like extract.py's."""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (size[1], size[0], 4), dtype=np.uint8)
+    yy, xx = np.mgrid[: size[1], : size[0]]
+    edge = np.minimum.reduce([yy, xx, size[1] - 1 - yy, size[0] - 1 - xx])
+    pixels[..., 3] = np.clip(edge * 40, 0, 255)
+    return Image.fromarray(pixels, "RGBA")
+
+
+@pytest.fixture
+def items():
+    sizes = [(220, 400), (400, 260), (180, 180), (300, 500), (260, 120)]
+    return [(f"item-{i}.png", cutout(size, i)) for i, size in enumerate(sizes, start=1)]
+
+
+def reference(images, layout, canvas, inspiration, **options):
+    """The PIL paste path compose_collage replaces."""
+    collage, boxes = paint_masonry(images, layout, *canvas, **options)
+    if inspiration is not None:
+        collage, boxes = merge_with_inspiration(inspiration, collage, boxes)
+    return collage, boxes
+
+
+def quietly(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+@pytest.mark.parametrize("canvas", [(800, 1000), (600, 600), (580, 630)])
+@pytest.mark.parametrize("inspiration_size", [None, (1080, 1350), (1600, 900)])
+@pytest.mark.parametrize("bg_color", [(255, 255, 255, 255), (240, 236, 228, 255), (250, 250, 250, 0)])
+def test_compose_matches_the_paste_reference(items, canvas, inspiration_size, bg_color):
+    inspiration = None
+    if inspiration_size is not None:
+        inspiration = cutout(inspiration_size, 99).convert("RGB")
+    layout = plan_masonry(items, *canvas)
+
+    composed, composed_boxes = quietly(
+        compose_collage, items, layout, *canvas, inspiration=inspiration, bg_color=bg_color
+    )
+    painted, painted_boxes = quietly(reference, items, layout, canvas, inspiration, bg_color=bg_color)
+
+    assert composed.size == painted.size
+    assert composed_boxes == painted_boxes
+    assert np.array_equal(np.asarray(composed), np.asarray(painted.convert("RGBA")))
+
+
+def test_a_cached_inspiration_panel_paints_the_same_pixels(tmp_path, items):
+    photo = tmp_path / "inspiration.png"
+    cutout((900, 1200), 7).convert("RGB").save(photo)
+    layout = plan_masonry(items)
+    panel_cache = RenderCache(str(tmp_path / "renders"))
+
+    first = quietly(compose_collage, items, layout, inspiration=str(photo), panel_cache=panel_cache)
+    second = quietly(compose_collage, items, layout, inspiration=str(photo), panel_cache=panel_cache)
+    painted = quietly(reference, items, layout, (800, 1000), str(photo))
+
+    assert (panel_cache.panel_misses, panel_cache.panel_hits) == (1, 1)
+    assert np.array_equal(np.asarray(first[0]), np.asarray(painted[0]))
+    assert np.array_equal(np.asarray(second[0]), np.asarray(painted[0]))
+    assert first[1] == second[1] == painted[1]
@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import extract
+from cutout_cache import EVICT_LOW_WATER, USAGE_FILE, CutoutCache, read_source
+
+
+def product_photo(path, color=(200, 40, 40), size=(120, 90)):
+    """A light background with one solid product block in the middle."""
+    pixels = np.full((size[1], size[0], 3), 250, dtype=np.uint8)
+    pixels[20:-20, 30:-30] = color
+    Image.fromarray(pixels).save(path)
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return CutoutCache(str(tmp_path / "cache"))
+
+
+def test_a_cache_hit_reports_the_original_mask_path(tmp_path, cache):
+    photo = product_photo(tmp_path / "item-1.png")
+    out = tmp_path / "out"
+    out.mkdir()
+
+    first = extract.extract_products_from_image(photo, str(out), cache)
+    second = extract.extract_products_from_image(photo, str(out), cache)
+
+    assert (first["path"], first["cached"]) == ("segment", False)
+    assert (second["path"], second["cached"]) == ("segment", True)
+    assert second["saved"] == first["saved"]
+
+
+def test_the_key_changes_with_every_extraction_parameter(monkeypatch, cache):
+    data = b"the same source bytes"
+    keys = {cache.key(data)}
+    for name, value in [
+        ("BORDER_WIDTH", 4),
+        ("COLOR_EPS", 0.08),
+        ("MIN_COMPONENT_PIXELS", 50),
+        ("BG_SAMPLES", 512),
+        ("REFINE_BAND", 2),
+        ("ALPHA_THRESHOLD", 64),
+        ("ALPHA_MIN_TRANSPARENT", 0.05),
+    ]:
+        with monkeypatch.context() as patch:
+            patch.setattr(extract, name, value)
+            keys.add(cache.key(data))
+    keys |= {cache.key(data, policy="central"), cache.key(data, top_k=3), cache.key(data, downscale=2)}
+
+    assert len(keys) == 11
+    assert cache.key(data) == cache.key(data, policy=extract.SELECT_POLICY)
+    assert cache.key(data) != cache.key(b"other source bytes")
+
+
+def test_a_changed_parameter_misses_and_extracts_again(monkeypatch, tmp_path, cache):
+    photo = product_photo(tmp_path / "item-1.png")
+
+    assert cache.get_or_extract(photo)[2] is False
+    assert cache.get_or_extract(photo)[2] is True
+    monkeypatch.setattr(extract, "COLOR_EPS", 0.08)
+    assert cache.get_or_extract(photo)[2] is False
+
+
+def test_opening_a_cache_reads_the_usage_file_not_the_entries(monkeypatch, tmp_path, cache):
+    for index in range(3):
+        cache.get_or_extract(product_photo(tmp_path / f"item-{index}.png", color=(index * 60, 40, 40)))
+    used = cache.usage()
+    assert used == sum(size for _, _, size in cache._entries())
+
+    def scan(self):
+        raise AssertionError("entries scanned")
+
+    monkeypatch.setattr(CutoutCache, "_entries", scan)
+    reopened = CutoutCache(cache.cache_dir)
+
+    assert reopened.stats()["bytes"] == used
+
+
+def test_a_cache_without_a_usage_file_counts_its_entries_once(tmp_path, cache):
+    cache.get_or_extract(product_photo(tmp_path / "item-1.png"))
+    os.unlink(os.path.join(cache.cache_dir, USAGE_FILE))
+
+    cache.get_or_extract(product_photo(tmp_path / "item-2.png", color=(40, 200, 40)))
+
+    assert cache.usage() == sum(size for _, _, size in cache._entries())
+
+
+def test_eviction_removes_the_least_recently_used_entries(tmp_path):
+    cache = CutoutCache(str(tmp_path / "cache"), max_bytes=10**9)
+    photos = [product_photo(tmp_path / f"item-{i}.png", color=(i * 60, 40, 40)) for i in range(4)]
+    keys = []
+    for age, photo in enumerate(photos[:3]):
+        cache.get_or_extract(photo)
+        keys.append(cache.key(read_source(photo)))
+        # Older entries first; a hit would touch the mtime again
+        meta_path = cache._meta_path(keys[-1])
+        os.utime(meta_path, (1000 + age, 1000 + age))
+    os.utime(cache._meta_path(keys[0]), (2000, 2000))  # used most recently
+    entry_size = cache.usage() // 3
+
+    # Room for about three entries: the fourth pushes it over
+    cache.max_bytes = int(entry_size * 3.5)
+    cache.get_or_extract(photos[3])
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.evictions >= 1
+    assert cache.usage() == sum(size for _, _, size in cache._entries())
+    assert cache.usage() <= cache.max_bytes * EVICT_LOW_WATER
@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from cutout_store import CutoutStore
+
+
+def solid(color, size=(12, 8)):
+    return Image.new("RGBA", size, color)
+
+
+def pixel(store, item_id):
+    return store.get(item_id).getpixel((0, 0))
+
+
+def test_put_and_get_round_trip(tmp_path):
+    store = CutoutStore(str(tmp_path))
+    store.put("item-1", solid((10, 20, 30, 255)))
+    store.put("item-2", Image.new("RGB", (5, 7), (1, 2, 3)))
+
+    assert store.ids() == ["item-1", "item-2"]
+    assert pixel(store, "item-1") == (10, 20, 30, 255)
+    assert store.get("item-2").size == (5, 7)
+    assert store.array("item-2").shape == (7, 5, 4)
+    with pytest.raises(KeyError):
+        store.get("missing")
+
+
+def test_later_put_replaces_and_survives_reopen(tmp_path):
+    store = CutoutStore(str(tmp_path))
+    store.put("item-1", solid((1, 1, 1, 255)))
+    store.put("item-1", solid((2, 2, 2, 255)))
+
+    assert pixel(store, "item-1") == (2, 2, 2, 255)
+    assert pixel(CutoutStore(str(tmp_path)), "item-1") == (2, 2, 2, 255)
+
+
+def test_alias_shares_the_block(tmp_path):
+    store = CutoutStore(str(tmp_path))
+    store.put("item-1", solid((5, 6, 7, 255)))
+    store.alias("item-2", "item-1")
+
+    a, b = store.index["item-1"], store.index["item-2"]
+    assert (a["pack"], a["offset"]) == (b["pack"], b["offset"])
+    assert pixel(store, "item-2") == (5, 6, 7, 255)
+    with pytest.raises(KeyError):
+        store.alias("item-3", "missing")
+
+
+def test_compact_drops_dead_blocks_and_keeps_aliases(tmp_path):
+    store = CutoutStore(str(tmp_path))
+    store.put("item-1", solid((1, 0, 0, 255), (64, 64)))
+    store.put("item-1", solid((2, 0, 0, 255), (64, 64)))
+    store.put("item-2", solid((3, 0, 0, 255), (64, 64)))
+    store.alias("item-3", "item-2")
+
+    freed = store.compact()
+
+    assert freed >= 64 * 64 * 4
+    assert store.stats()["liveBytes"] == 2 * 64 * 64 * 4
+    assert [pixel(store, i) for i in ("item-1", "item-2", "item-3")] == [
+        (2, 0, 0, 255),
+        (3, 0, 0, 255),
+        (3, 0, 0, 255),
+    ]
+    a, b = store.index["item-2"], store.index["item-3"]
+    assert (a["pack"], a["offset"]) == (b["pack"], b["offset"])
+
+    reopened = CutoutStore(str(tmp_path))
+    assert reopened.generation == 1
+    assert np.array_equal(reopened.array("item-1"), store.array("item-1"))
+
+
+def test_other_instance_follows_a_compaction(tmp_path):
+    writer = CutoutStore(str(tmp_path))
+    reader = CutoutStore(str(tmp_path))
+    for i in range(5):
+        writer.put(f"item-{i}", solid((i, 0, 0, 255)))
+    writer.put("item-0", solid((100, 0, 0, 255)))
+    reader.refresh()
+    assert pixel(reader, "item-4") == (4, 0, 0, 255)  # maps the old pack
+
+    writer.compact()
+    writer.put("item-5", solid((5, 0, 0, 255)))
+    reader.refresh()
+
+    assert reader.generation == writer.generation
+    assert reader.ids() == writer.ids()
+    assert [pixel(reader, f"item-{i}") for i in range(6)] == [
+        (100, 0, 0, 255),
+        (1, 0, 0, 255),
+        (2, 0, 0, 255),
+        (3, 0, 0, 255),
+        (4, 0, 0, 255),
+        (5, 0, 0, 255),
+    ]
+    assert reader.index == writer.index
+
+
+def test_reader_left_behind_by_two_compactions_recovers(tmp_path):
+    writer = CutoutStore(str(tmp_path))
+    writer.put("item-1", solid((7, 0, 0, 255)))
+    reader = CutoutStore(str(tmp_path))
+
+    writer.compact()
+    writer.compact()  # removes the packs reader's index still points at
+
+    assert pixel(reader, "item-1") == (7, 0, 0, 255)
+    assert reader.generation == 2
+
+
+def test_old_packs_are_kept_for_one_generation(tmp_path):
+    store = CutoutStore(str(tmp_path))
+    store.put("item-1", solid((1, 0, 0, 255)))
+    first_packs = store._packs()
+
+    store.compact()
+    assert set(first_packs) < set(store._packs())
+    store.compact()
+    assert not set(first_packs) & set(store._packs())
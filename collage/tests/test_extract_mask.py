@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from scipy.ndimage import binary_closing, binary_fill_holes, binary_opening
+
+from extract import color_distance_mask, dilate_cross, distance_threshold, erode_cross, fill_holes
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (1, 7), (3, 3), (9, 13), (64, 80)])
+@pytest.mark.parametrize("density", [0.3, 0.6, 0.9])
+def test_cross_morphology_and_hole_fill_match_scipy(shape, density):
+    mask = np.random.default_rng(7).random(shape) < density
+
+    assert np.array_equal(dilate_cross(erode_cross(mask)), binary_opening(mask))
+    assert np.array_equal(erode_cross(dilate_cross(mask)), binary_closing(mask))
+    assert np.array_equal(fill_holes(mask), binary_fill_holes(mask))
+
+
+@pytest.mark.parametrize("bg_color", [(255, 255, 255), (240.5, 239.0, 250.5), (0, 0, 0)])
+def test_color_distance_mask_matches_the_exact_integer_test(bg_color):
+    img = np.random.default_rng(3).integers(0, 256, (37, 41, 3), dtype=np.uint8)
+    bg2, limit = distance_threshold(np.array(bg_color))
+    diff = img.astype(np.int32) * 2 - bg2
+
+    # Several tiles, the last one short
+    mask = color_distance_mask(img, np.array(bg_color), tile_rows=8)
+
+    assert np.array_equal(mask, (diff * diff).sum(axis=2) > limit)
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from phash_index import PhashIndex, near_duplicate_groups
+
+
+def planted_hashes(count, max_distance, seed=0):
+    """Random hashes where a third are copies of others with 0..max_distance + 2 bits flipped."""
+    rng = np.random.default_rng(seed)
+    hashes = [int(value) for value in rng.integers(0, 2**63, size=count, dtype=np.uint64) * 2]
+    for copy in range(0, count, 3):
+        flipped = rng.choice(64, size=rng.integers(0, max_distance + 3), replace=False)
+        hashes[copy] = hashes[(copy * 7 + 1) % count] ^ sum(1 << int(bit) for bit in flipped)
+    return hashes
+
+
+def distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def brute_force_clusters(ids, hashes, max_distance):
+    """Single-linkage groups over every pair, as sets."""
+    parent = list(range(len(ids)))
+
+    def root(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+
+    for i in range(len(ids)):
+        for j in range(i + 1, len(ids)):
+            if distance(hashes[i], hashes[j]) <= max_distance:
+                parent[root(i)] = root(j)
+    groups = {}
+    for i, item_id in enumerate(ids):
+        groups.setdefault(root(i), set()).add(item_id)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+@pytest.mark.parametrize("max_distance", [0, 3, 4, 7, 8])
+def test_find_matches_a_brute_force_scan(max_distance):
+    hashes = planted_hashes(300, max_distance)
+    ids = [f"item-{i}" for i in range(len(hashes))]
+    index = PhashIndex(ids, hashes)
+
+    for value in hashes[:60]:
+        expected = sorted(
+            (distance(value, other), item_id)
+            for item_id, other in zip(ids, hashes)
+            if distance(value, other) <= max_distance
+        )
+        found = index.find(value, max_distance)
+
+        assert sorted((d, item_id) for item_id, d in found) == expected
+        assert [d for _, d in found] == sorted(d for _, d in found)
+
+
+@pytest.mark.parametrize("max_distance", [2, 5, 8])
+def test_clusters_match_brute_force_single_linkage(max_distance):
+    hashes = planted_hashes(240, max_distance, seed=max_distance)
+    # The same photo reused by several listings collapses to one bucket entry
+    hashes[10:14] = [hashes[9]] * 4
+    ids = [f"item-{i}" for i in range(len(hashes))]
+
+    clusters = PhashIndex(ids, hashes).clusters(max_distance)
+
+    assert sorted(map(sorted, clusters)) == sorted(map(sorted, brute_force_clusters(ids, hashes, max_distance)))
+    assert [len(group) for group in clusters] == sorted((len(group) for group in clusters), reverse=True)
+    for group in clusters:
+        assert group == sorted(group, key=ids.index)
+
+
+def test_added_ids_replace_their_old_hash():
+    index = PhashIndex(["a", "b"], [0b1111, 0])
+    index.add([("a", 0b1), ("c", 0b111 << 40)])
+
+    assert sorted(index.ids) == ["a", "b", "c"]
+    assert index.find(0, 1) == [("b", 0), ("a", 1)]
+
+
+def test_near_duplicate_groups_pick_the_largest_copy(tmp_path):
+    rng = np.random.default_rng(1)
+    photo = Image.fromarray(rng.integers(0, 256, (24, 32, 3), dtype=np.uint8)).resize(
+        (640, 480), Image.Resampling.BICUBIC
+    )
+    other = Image.fromarray(rng.integers(0, 256, (24, 32, 3), dtype=np.uint8)).resize(
+        (640, 480), Image.Resampling.BICUBIC
+    )
+    paths = []
+    for name, img in [
+        ("small.png", photo.resize((320, 240))),
+        ("large.png", photo),
+        ("medium.jpg", photo.resize((480, 360))),
+        ("other.png", other),
+    ]:
+        img.save(tmp_path / name)
+        paths.append(str(tmp_path / name))
+
+    groups = near_duplicate_groups(paths, workers=1)
+
+    large = str(tmp_path / "large.png")
+    assert groups == {str(tmp_path / "small.png"): large, str(tmp_path / "medium.jpg"): large}
@@ -0,0 +1,192 @@
+import json
+import sys
+import time
+
+import pytest
+
+import pipeline
+from pipeline import MAX_ATTEMPTS, STAGES, JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite"))
+
+
+def run_to_done(queue, job_id):
+    for stage in STAGES:
+        job = queue.claim(stage)
+        assert job["id"] == job_id
+        output = {"url": "https://example.com/c.png"} if stage == "upload" else {}
+        if stage == "arrange":
+            output = {"boundingBoxes": []}
+        if stage == "encode":
+            output = {"format": "png", "bytes": 10}
+        queue.advance(job, output)
+
+
+def make_ready(queue, job_id):
+    """Skip a job's backoff delay."""
+    queue.db.execute("UPDATE jobs SET next_attempt = 0 WHERE id = ?", (job_id,))
+
+
+def test_job_advances_through_every_stage(queue):
+    job_id = queue.submit({"outfitId": 7, "items": []})
+    assert queue.status(job_id)["state"] == "queued"
+    assert queue.claim("extract") is None  # only its current stage can claim it
+
+    job = queue.claim("fetch")
+    assert job["state"] == "running" and job["attempts"] == 1
+    assert queue.claim("fetch") is None
+    assert queue.backlog("fetch") == 1
+    queue.advance(job, {"items": []})
+    assert queue.status(job_id)["stage"] == "extract"
+
+    for stage in STAGES[1:]:
+        job = queue.claim(stage)
+        assert job["attempts"] == 1  # reset by advance
+        output = {"url": "https://example.com/c.png"} if stage == "upload" else {}
+        if stage == "arrange":
+            output = {"boundingBoxes": [{"itemId": 1}]}
+        if stage == "encode":
+            output = {"format": "webp", "bytes": 42}
+        queue.advance(job, output)
+
+    status = queue.status(job_id)
+    assert status["state"] == "done"
+    assert status["outfitId"] == 7
+    assert status["url"] == "https://example.com/c.png"
+    assert status["boundingBoxes"] == [{"itemId": 1}]
+    assert (status["format"], status["bytes"]) == ("webp", 42)
+    assert queue.pending() == 0
+
+
+def test_failed_attempt_is_retried_after_a_backoff(queue, monkeypatch):
+    monkeypatch.setattr(pipeline.random, "uniform", lambda low, high: 1.0)
+    job_id = queue.submit({})
+
+    for attempt in range(1, MAX_ATTEMPTS):
+        job = queue.claim("fetch")
+        assert job["attempts"] == attempt
+        before = time.time()
+        assert queue.fail(job, "fetch: boom") is False
+
+        status = queue.status(job_id)
+        assert status["state"] == "queued" and status["error"] == "fetch: boom"
+        expected = min(pipeline.BACKOFF_SECONDS * 2 ** (attempt - 1), pipeline.BACKOFF_MAX_SECONDS)
+        assert status["retryInSeconds"] == pytest.approx(expected, abs=0.2)
+        assert queue.claim("fetch") is None  # not before its delay
+        (next_attempt,) = queue.db.execute(
+            "SELECT next_attempt FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        assert next_attempt >= before + expected - 0.01
+        make_ready(queue, job_id)
+
+    job = queue.claim("fetch")
+    assert job["attempts"] == MAX_ATTEMPTS
+    assert queue.fail(job, "fetch: boom") is True
+    assert queue.status(job_id)["state"] == "failed"
+    assert queue.claim("fetch") is None
+
+
+def test_backoff_is_capped(queue, monkeypatch):
+    monkeypatch.setattr(pipeline, "MAX_ATTEMPTS", 20)
+    monkeypatch.setattr(pipeline.random, "uniform", lambda low, high: high)
+    job_id = queue.submit({})
+    queue.db.execute("UPDATE jobs SET attempts = 15 WHERE id = ?", (job_id,))
+    job = queue.claim("fetch")
+    queue.fail(job, "boom")
+    status = queue.status(job_id)
+    assert status["retryInSeconds"] <= pipeline.BACKOFF_MAX_SECONDS * 1.25 + 0.1
+
+
+def test_retry_requeues_a_failed_job_on_its_stage(queue):
+    job_id = queue.submit({})
+    queue.advance(queue.claim("fetch"), {})
+    job = queue.claim("extract")
+    job["attempts"] = MAX_ATTEMPTS
+    queue.fail(job, "extract: boom")
+
+    assert queue.retry("no-such-job") is False
+    assert queue.retry(job_id) is True
+    assert queue.retry(job_id) is False  # only failed jobs
+    job = queue.claim("extract")
+    assert job["id"] == job_id and job["attempts"] == 1
+
+
+def test_recover_requeues_running_jobs(queue):
+    first, second = queue.submit({}), queue.submit({})
+    queue.claim("fetch")
+    queue.claim("fetch")
+    assert queue.claim("fetch") is None
+
+    assert queue.recover() == 2
+    assert {queue.claim("fetch")["id"], queue.claim("fetch")["id"]} == {first, second}
+
+
+def test_reject_fails_a_finished_job_for_a_full_retry(queue):
+    job_id = queue.submit({})
+    assert queue.reject(job_id, "not done yet") is False
+    run_to_done(queue, job_id)
+
+    assert queue.reject(job_id, "Collage URL is not http(s)") is True
+    status = queue.status(job_id)
+    assert (status["state"], status["stage"]) == ("failed", STAGES[0])
+    assert status["error"] == "Collage URL is not http(s)"
+
+    assert queue.retry(job_id) is True
+    assert queue.claim(STAGES[0])["id"] == job_id
+
+
+def test_abort_fails_queued_jobs(queue):
+    first, second, third = queue.submit({}), queue.submit({}), queue.submit({})
+    queue.claim("fetch")  # first is running
+
+    assert queue.abort("no sink", first) == 0  # only a queued job by id
+    assert queue.abort("no sink", second) == 1
+    assert queue.status(second)["state"] == "failed"
+    assert queue.abort("no sink") == 2
+    assert {queue.status(job_id)["state"] for job_id in (first, third)} == {"failed"}
+    assert queue.pending() == 0
+
+
+def test_status_of_unknown_job_and_summary(queue):
+    assert queue.status("missing") is None
+    queue.submit({})
+    assert queue.summary() == {"stages": {"fetch": {"queued": 1}}, "runnerAlive": False}
+    queue.heartbeat()
+    assert queue.runner_alive()
+    queue.clear_heartbeat()
+    assert not queue.runner_alive()
+
+
+def test_gcs_sink_without_its_package_is_reported(monkeypatch):
+    monkeypatch.setitem(sys.modules, "google.cloud", None)
+    assert "google-cloud-storage" in pipeline.check_sink("gcs")
+    with pytest.raises(ValueError):
+        pipeline.open_sink("gcs")
+    assert pipeline.check_sink("dir:/tmp/uploads") is None
+    assert "Unknown sink" in pipeline.check_sink("s3")
+
+
+def test_submit_fails_the_job_when_the_runner_could_not_upload(tmp_path, monkeypatch, capsys):
+    monkeypatch.setitem(sys.modules, "google.cloud", None)
+    monkeypatch.setenv("GOOGLE_CLOUD_BUCKET", "bucket")
+    spawned = []
+    monkeypatch.setattr(pipeline, "spawn_runner", lambda *args: spawned.append(args))
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({"items": []}))
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["pipeline.py", "--pipeline-dir", str(tmp_path), "--submit", str(manifest), "--spawn-runner"],
+    )
+
+    pipeline.main()
+
+    result = json.loads(capsys.readouterr().out)
+    assert result["state"] == "failed"
+    assert "google-cloud-storage" in result["error"]
+    assert spawned == []
+    status = JobQueue(str(tmp_path / "jobs.sqlite")).status(result["jobId"])
+    assert status["state"] == "failed"
@@ -0,0 +1,103 @@
+import contextlib
+import io
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import arrange
+from arrange import LazyImage, render_and_encode, render_fingerprint
+from render_cache import EVICT_LOW_WATER, RenderCache
+
+
+@pytest.fixture
+def photos(tmp_path):
+    """Two product photos and an inspiration photo on disk."""
+    rng = np.random.default_rng(11)
+    paths = {}
+    for name, size in [("item-1.png", (200, 300)), ("item-2.png", (300, 200)), ("inspiration.png", (270, 340))]:
+        Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)).save(tmp_path / name)
+        paths[name] = str(tmp_path / name)
+    return paths
+
+
+def items(photos):
+    return [(name, LazyImage(photos[name])) for name in ("item-1.png", "item-2.png")]
+
+
+def fingerprint(photos, **overrides):
+    args = dict(
+        images=items(photos),
+        inspiration=photos["inspiration.png"],
+        canvas_width=800,
+        canvas_height=1000,
+        fmt="png",
+        encode_options={},
+        optimize_layout=False,
+    )
+    args.update(overrides)
+    return render_fingerprint(**args)
+
+
+def test_the_fingerprint_changes_with_every_input(monkeypatch, tmp_path, photos):
+    base = fingerprint(photos)
+    changed = {
+        fingerprint(photos, images=items(photos)[:1]),
+        fingerprint(photos, images=[("item-9.png", img) for _, img in items(photos)[:1]] + items(photos)[1:]),
+        fingerprint(photos, inspiration=None),
+        fingerprint(photos, canvas_width=600),
+        fingerprint(photos, optimize_layout=True),
+        fingerprint(photos, fmt="webp"),
+        fingerprint(photos, encode_options={"quality": 70}),
+    }
+    # Same name, new pixels
+    Image.new("RGB", (200, 300), (1, 2, 3)).save(tmp_path / "item-1.png")
+    changed.add(fingerprint(photos))
+    # Settings and code are hashed once per process (layout_version)
+    for name, value in [("RENDER_VERSION", arrange.RENDER_VERSION + 1), ("DECODE_REDUCING_GAP", 3.0)]:
+        with monkeypatch.context() as patch:
+            patch.setattr(arrange, name, value)
+            arrange.layout_version.cache_clear()
+            changed.add(fingerprint(photos))
+    arrange.layout_version.cache_clear()
+
+    assert base not in changed
+    assert len(changed) == 10
+
+
+def test_an_unchanged_render_is_served_from_the_cache(monkeypatch, tmp_path, photos):
+    cache = RenderCache(str(tmp_path / "renders"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        first = render_and_encode(items(photos), photos["inspiration.png"], render_cache=cache)
+
+        def no_render(*args, **kwargs):
+            raise AssertionError("rendered again")
+
+        monkeypatch.setattr(arrange, "render_collage", no_render)
+        second = render_and_encode(items(photos), photos["inspiration.png"], render_cache=cache)
+
+    assert (first["hit"], second["hit"]) == (False, True)
+    assert second["data"] == first["data"]
+    assert second["boundingBoxes"] == first["boundingBoxes"]
+    assert cache.panel_misses == 1
+
+
+def test_eviction_drops_the_least_recently_used_renders_and_panels(tmp_path):
+    cache = RenderCache(str(tmp_path / "renders"), max_bytes=10**9)
+    for age, name in enumerate(["a", "b", "c"]):
+        cache.put(name, b"x" * 1000, {"boundingBoxes": []})
+        os.utime(cache._path(f"{name}.json"), (1000 + age, 1000 + age))
+    cache.put_panel("p", Image.new("RGBA", (10, 25)))  # 1000 bytes of pixels
+    os.utime(cache._path("panel-p.rgba"), (999, 999))
+    cache.get("a")  # touches it: now the most recent
+
+    cache.max_bytes = int(cache.total_bytes * 0.7)  # two of the four have to go
+    cache.evict()
+
+    assert cache.get_panel("p", (10, 25)) is None
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.total_bytes <= cache.max_bytes * EVICT_LOW_WATER
+    assert cache.total_bytes == sum(size for _, _, size in cache._entries())
+    assert RenderCache(cache.cache_dir).total_bytes == cache.total_bytes
@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from atomic import atomic_file, copy_atomic, write_atomic
+from resize_cache import ResizeCache, image_digest
+
+
+def noise(size, seed):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], 4), dtype=np.uint8), "RGBA")
+
+
+def test_entries_are_keyed_by_pixels_and_size():
+    cache = ResizeCache()
+    img = noise((64, 48), 1)
+
+    first = cache.resize(img, (32, 24))
+    # Same pixels in a new image object: still a hit
+    assert cache.resize(img.copy(), (32, 24)) is first
+    cache.resize(img, (16, 12))
+    cache.resize(noise((64, 48), 2), (32, 24))
+
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert np.array_equal(np.asarray(first), np.asarray(img.resize((32, 24), Image.Resampling.LANCZOS)))
+
+
+def test_a_digest_in_info_is_trusted_and_remembered():
+    img = noise((8, 8), 3)
+    digest = image_digest(img)
+
+    assert img.info["digest"] == digest
+    assert image_digest(noise((8, 8), 3)) == digest
+    assert image_digest(noise((8, 8), 4)) != digest
+
+
+def test_the_least_recently_used_resizes_go_past_the_byte_budget():
+    entry_bytes = 10 * 10 * 4
+    cache = ResizeCache(max_bytes=entry_bytes * 2)
+    images = [noise((40, 40), seed) for seed in range(3)]
+
+    cache.resize(images[0], (10, 10))
+    cache.resize(images[1], (10, 10))
+    cache.resize(images[0], (10, 10))  # now the most recent
+    cache.resize(images[2], (10, 10))
+
+    assert cache.total_bytes == entry_bytes * 2
+    cache.resize(images[0], (10, 10))
+    assert cache.hits == 2
+    cache.resize(images[1], (10, 10))  # evicted by images[2]
+    assert cache.misses == 4
+
+
+def test_resizes_persist_on_disk_for_other_instances(tmp_path):
+    img = noise((40, 30), 5)
+    ResizeCache(cache_dir=str(tmp_path)).resize(img, (20, 15))
+
+    other = ResizeCache(cache_dir=str(tmp_path))
+    resized = other.resize(img, (20, 15))
+
+    assert other.disk_hits == 1 and other.misses == 0
+    assert np.array_equal(np.asarray(resized), np.asarray(img.resize((20, 15), Image.Resampling.LANCZOS)))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_atomic_writes_replace_the_whole_file_or_nothing(tmp_path):
+    path = str(tmp_path / "entry.json")
+    assert write_atomic(path, b"old") == 3
+
+    with pytest.raises(RuntimeError):
+        with atomic_file(path) as f:
+            f.write(b"partial")
+            raise RuntimeError("writer died")
+
+    assert open(path, "rb").read() == b"old"
+    assert os.listdir(tmp_path) == ["entry.json"]
+
+    copy_atomic(path, str(tmp_path / "copy.json"))
+    assert open(tmp_path / "copy.json", "rb").read() == b"old"
@@ -0,0 +1,59 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from arrange import VARIANTS, LazyImage, render_collage, render_variants
+
+
+@pytest.fixture
+def items(tmp_path):
+    """Lazily loaded product photos of a few shapes, named item-<id>.png."""
+    rng = np.random.default_rng(5)
+    paths = []
+    for item_id, size in enumerate([(300, 500), (400, 300), (250, 250), (500, 700)], start=1):
+        path = tmp_path / f"item-{item_id}.png"
+        pixels = rng.integers(0, 256, (size[1], size[0], 4), dtype=np.uint8)
+        pixels[..., 3] = 255
+        Image.fromarray(pixels, "RGBA").save(path)
+        paths.append(path)
+    return lambda: [(path.name, LazyImage(str(path))) for path in paths]
+
+
+def quietly(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def test_og_is_always_1200x630(tmp_path, items):
+    inspiration = tmp_path / "inspiration.png"
+    Image.new("RGB", (1080, 1350), (90, 120, 150)).save(inspiration)
+
+    without = quietly(render_variants, items(), {"og": VARIANTS["og"]})["og"]
+    merged = quietly(render_variants, items(), {"og": VARIANTS["og"]}, str(inspiration))["og"]
+    panel = quietly(render_collage, items(), canvas_width=580, canvas_height=630)
+
+    assert without[0].size == merged[0].size == (1200, 630)
+    # Without a photo the product panel is centered, boxes and all
+    offset = (1200 - 580) // 2
+    assert [box["x"] for box in without[1]] == [box["x"] + offset for box in panel[1]]
+    assert np.array_equal(np.asarray(without[0])[:, offset : offset + 580], np.asarray(panel[0]))
+    assert (np.asarray(without[0])[:, :offset] == 255).all()
+
+
+def test_each_item_is_decoded_once_and_resized_once_per_variant(monkeypatch, items):
+    decodes = []
+    decode = LazyImage.decode
+    monkeypatch.setattr(LazyImage, "decode", lambda self, size: decodes.append(size) or decode(self, size))
+
+    rendered = quietly(render_variants, items(), VARIANTS)
+
+    assert len(decodes) == len(items())
+    # One resize from the source, so each variant matches its own single render
+    for name in ("panel", "square"):
+        spec = VARIANTS[name]
+        single = quietly(render_collage, items(), canvas_width=spec["width"], canvas_height=spec["height"])
+        assert np.array_equal(np.asarray(rendered[name][0]), np.asarray(single[0]))
+        assert rendered[name][1] == single[1]
@@ -0,0 +1,43 @@
+from io import BytesIO
+
+from arrange import FRAME_HEADER, WorkerStats, read_frame, serve_stream, write_frame
+
+
+def frame(body):
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+def replies(stream_in):
+    out = BytesIO()
+    stats = WorkerStats()
+    serve_stream(BytesIO(stream_in), out, stats, {})
+    out.seek(0)
+    frames = []
+    while (reply := read_frame(out)) is not None:
+        frames.append(reply)
+    return frames, stats
+
+
+def test_malformed_frames_get_error_replies_and_the_worker_keeps_going():
+    frames, stats = replies(
+        frame(b"{not json") + frame(b"[1, 2]") + frame(b"\xff") + frame(b'{"op": "stats", "id": 9}')
+    )
+
+    assert [reply["ok"] for reply in frames] == [False, False, False, True]
+    assert all(reply["error"].startswith("Malformed frame") for reply in frames[:3])
+    assert frames[3]["id"] == 9
+    assert frames[3]["stats"]["errors"] == 3
+    assert stats.errors == 3
+
+
+def test_truncated_frame_ends_the_stream():
+    frames, _ = replies(frame(b'{"op": "stats"}')[:-2])
+    assert frames == []
+
+
+def test_round_trip():
+    stream = BytesIO()
+    write_frame(stream, {"id": 1, "items": []})
+    stream.seek(0)
+    assert read_frame(stream) == {"id": 1, "items": []}
+    assert read_frame(stream) is None
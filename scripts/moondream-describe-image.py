@@ -2,89 +2,536 @@
 """
 Moondream Image Description Script
 Generates costume/outfit descriptions from inspiration photos using moondream-station.
+
+Usage:
+    python moondream-describe-image.py <image_url>
+    python moondream-describe-image.py --batch [<image_url> ...]
+    python moondream-describe-image.py --compare-sizes <image_url> [--sizes 378,768,0]
+
+With --batch, URLs come from the arguments or, if there are none, from
+stdin: one per line, either a bare URL or a JSON object
+{"id": ..., "url": "..."}. One model client and one pooled HTTP session
+serve the whole batch, the next images download while the model works on
+the current one, and one JSON result is printed per line:
+    {"id": ..., "url": "...", "ok": true, "description": "...", "seconds": 4.2}
+    {"id": ..., "url": "...", "ok": false, "stage": "download", "error": "..."}
+where "stage" says which step failed: input, download, decode or query.
+
+Descriptions are cached in SQLite (MOONDREAM_CACHE, default
+~/.cache/characterfit/moondream-descriptions.sqlite), keyed by the SHA-256
+of the image bytes, the prompt and the endpoint, so a photo seen before is
+answered without a model call, whatever URL it came from, and editing the
+prompt misses every old entry. Entries expire after a TTL and the least
+recently used ones are dropped past a size limit. --no-cache skips it and
+--cache-stats prints its entries and hit/miss totals.
+
+Downloads are streamed and refused past --max-bytes, and images are
+decoded straight to a reduced size (JPEG draft mode) and downscaled to at
+most --max-edge px before the query: the model works on small crops
+anyway, so full-resolution uploads only cost latency and memory. The edge
+is part of the cache key. --compare-sizes describes one image at several
+edges and prints each one's latency, payload and similarity to the
+full-resolution answer.
 """
 
 import sys
 import os
+import json
+import time
+import sqlite3
+import hashlib
+import difflib
+import threading
 import requests
 import moondream as md
 from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from PIL import Image
 
-def download_and_open_image(url: str) -> Image.Image:
-    """Download image from URL and return as PIL Image"""
-    try:
-        response = requests.get(url, timeout=30)
+MOONDREAM_ENDPOINT = "http://localhost:2020/v1"
+DOWNLOAD_TIMEOUT = 30  # seconds per image
+DOWNLOAD_CONCURRENCY = 4  # simultaneous downloads in batch mode
+PREFETCH = 8  # images downloaded ahead of the model in batch mode
+MAX_DOWNLOAD_BYTES = 25 * 1024 * 1024  # larger responses are refused
+DOWNLOAD_CHUNK = 64 * 1024
+MAX_EDGE = 768  # px; longest image edge sent to the model (0 = full resolution)
+MAX_PIXELS = 60_000_000  # decoded pixels allowed after draft reduction
+COMPARE_SIZES = (378, 768, 1536, 0)  # --compare-sizes default edges
+
+CACHE_PATH = os.environ.get(
+    "MOONDREAM_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "characterfit", "moondream-descriptions.sqlite"),
+)
+CACHE_TTL_DAYS = 30
+CACHE_MAX_ENTRIES = 20000
+
+PROMPT = """Describe this costume/outfit in detail for someone trying to recreate it. Focus on:
+- Colors and color palette
+- Main clothing pieces (jacket, shirt, pants, dress, etc.)
+- Textures and materials (leather, fabric, metal, etc.)
+- Accessories (jewelry, weapons, props, hats, etc.)
+- Hair and makeup styling
+- Overall aesthetic and vibe
+
+Be specific about visual details like patterns, cuts, and styling."""
+
+def make_session(concurrency: int = DOWNLOAD_CONCURRENCY) -> requests.Session:
+    """A requests.Session whose connection pool matches the download concurrency"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch_bytes(url: str, session=None, max_bytes: int = MAX_DOWNLOAD_BYTES) -> bytes:
+    """Download an image's raw bytes, streamed and capped at max_bytes; raises on failure"""
+    with (session or requests).get(url, timeout=DOWNLOAD_TIMEOUT, stream=True) as response:
         response.raise_for_status()
+        declared = int(response.headers.get("Content-Length") or 0)
+        if declared > max_bytes:
+            raise ValueError(f"image is {declared} bytes, over the {max_bytes} byte limit")
 
-        # Open image and convert to RGB (moondream expects RGB)
-        img = Image.open(BytesIO(response.content))
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+        data = bytearray()
+        for chunk in response.iter_content(DOWNLOAD_CHUNK):
+            data += chunk
+            if len(data) > max_bytes:
+                raise ValueError(f"image is over the {max_bytes} byte limit")
+        return bytes(data)
 
-        return img
+class DecodeError(Exception):
+    """The downloaded bytes could not be opened as an image (or are over MAX_PIXELS)"""
+
+def open_image(data: bytes, max_edge: int = MAX_EDGE) -> Image.Image:
+    """Decode image bytes as an RGB PIL Image no larger than max_edge (0 = full size)"""
+    img = Image.open(BytesIO(data))
+    if max_edge:
+        # JPEGs decode directly at 1/2, 1/4 or 1/8 scale, never below max_edge
+        img.draft("RGB", (max_edge, max_edge))
+    if img.width * img.height > MAX_PIXELS:
+        raise ValueError(f"image is {img.width}x{img.height}, over the {MAX_PIXELS} pixel limit")
+
+    # Convert to RGB (moondream expects RGB)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    if max_edge and max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    return img
+
+def fetch_image(url: str, session=None, max_edge: int = MAX_EDGE) -> Image.Image:
+    """Download image from URL and return it as an RGB PIL Image; raises on failure"""
+    return open_image(fetch_bytes(url, session), max_edge)
+
+def download_image_bytes(url: str, max_bytes: int = MAX_DOWNLOAD_BYTES) -> bytes:
+    """Download image from URL, exiting with an error message on failure"""
+    try:
+        return fetch_bytes(url, max_bytes=max_bytes)
     except Exception as e:
         print(f"Error downloading image: {e}", file=sys.stderr)
         sys.exit(1)
 
-def describe_costume(image_url: str) -> str:
+def download_and_open_image(url: str, max_edge: int = MAX_EDGE) -> Image.Image:
+    """Download image from URL and return as PIL Image"""
+    data = download_image_bytes(url)
+    try:
+        return open_image(data, max_edge)
+    except Exception as e:
+        print(f"Error decoding image: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def sha256_hex(data) -> str:
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.sha256(data).hexdigest()
+
+def prompt_key(prompt: str = PROMPT, max_edge: int = MAX_EDGE) -> str:
+    """Cache key of everything besides the image that shapes the answer"""
+    return sha256_hex(prompt if not max_edge else f"{prompt}\n[max_edge={max_edge}]")
+
+class DescriptionCache:
+    """
+    Descriptions by (image content hash, prompt hash, endpoint) in SQLite.
+
+    Safe to share between threads and between processes (WAL journal).
+    Hit and miss totals are kept in the database too, so they add up over
+    every run, including one-shot calls from the app.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, ttl_days: float = CACHE_TTL_DAYS, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS descriptions (
+                image_hash TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                description TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (image_hash, prompt_hash, endpoint)
+            )"""
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS descriptions_accessed ON descriptions (accessed)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _bump(self, name: str):
+        self.db.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def get(self, image_hash: str, prompt_hash: str, endpoint: str):
+        """Return the cached description, or None if missing or expired"""
+        now = time.time()
+        key = (image_hash, prompt_hash, endpoint)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT description, created FROM descriptions "
+                "WHERE image_hash = ? AND prompt_hash = ? AND endpoint = ?",
+                key,
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                self._bump("misses")
+                return None
+
+            self.db.execute(
+                "UPDATE descriptions SET accessed = ? "
+                "WHERE image_hash = ? AND prompt_hash = ? AND endpoint = ?",
+                (now,) + key,
+            )
+            self.hits += 1
+            self._bump("hits")
+            return row[0]
+
+    def put(self, image_hash: str, prompt_hash: str, endpoint: str, description: str):
+        """Store a description, then drop expired and least recently used entries"""
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO descriptions VALUES (?, ?, ?, ?, ?, ?)",
+                (image_hash, prompt_hash, endpoint, description, now, now),
+            )
+            self.db.execute("DELETE FROM descriptions WHERE created < ?", (now - self.ttl,))
+            self.db.execute(
+                "DELETE FROM descriptions WHERE rowid IN ("
+                "SELECT rowid FROM descriptions ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries, size = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(description)), 0) FROM descriptions"
+            ).fetchone()
+            totals = dict(self.db.execute("SELECT name, value FROM counters").fetchall())
+        return {
+            "path": self.path,
+            "entries": entries,
+            "descriptionBytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "totalHits": totals.get("hits", 0),
+            "totalMisses": totals.get("misses", 0),
+        }
+
+def connect(endpoint: str = MOONDREAM_ENDPOINT):
+    """Client for the local moondream-station"""
+    return md.vl(endpoint=endpoint)
+
+def query_description(model, image: Image.Image, prompt: str = PROMPT) -> str:
+    """Ask the model for a costume description; raises on an empty answer"""
+    result = model.query(image, prompt)
+
+    # Extract the answer
+    description = result.get("answer", "")
+
+    if not description:
+        raise ValueError("Empty response from moondream")
+
+    return description.strip()
+
+def is_connection_error(e: Exception) -> bool:
+    error_msg = str(e).lower()
+    return "connection" in error_msg or "refused" in error_msg
+
+def describe_costume(
+    image_url: str,
+    cache: DescriptionCache = None,
+    max_edge: int = MAX_EDGE,
+    max_bytes: int = MAX_DOWNLOAD_BYTES,
+) -> str:
     """
     Generate detailed costume description using moondream-station.
 
     Args:
         image_url: URL to the inspiration photo
+        cache: DescriptionCache to answer from / store into (optional)
+        max_edge: longest edge sent to the model in px (0 = full resolution)
+        max_bytes: download size limit
 
     Returns:
         Detailed costume description from moondream
     """
-    # Download and open image
-    image = download_and_open_image(image_url)
-
-    # Prepare prompt for moondream
-    prompt = """Describe this costume/outfit in detail for someone trying to recreate it. Focus on:
-- Colors and color palette
-- Main clothing pieces (jacket, shirt, pants, dress, etc.)
-- Textures and materials (leather, fabric, metal, etc.)
-- Accessories (jewelry, weapons, props, hats, etc.)
-- Hair and makeup styling
-- Overall aesthetic and vibe
+    # Download the image; a photo described before is answered from the cache
+    data = download_image_bytes(image_url, max_bytes)
+    key = (sha256_hex(data), prompt_key(PROMPT, max_edge), MOONDREAM_ENDPOINT)
+    if cache is not None:
+        cached = cache.get(*key)
+        if cached is not None:
+            return cached
 
-Be specific about visual details like patterns, cuts, and styling."""
+    try:
+        image = open_image(data, max_edge)
+    except Exception as e:
+        print(f"Error decoding image: {e}", file=sys.stderr)
+        sys.exit(1)
+    del data
 
     # Connect to moondream-station and query
     try:
-        # Connect to local moondream-station
-        model = md.vl(endpoint="http://localhost:2020/v1")
-
-        # Query the model
-        result = model.query(image, prompt)
-
-        # Extract the answer
-        description = result.get("answer", "")
-
-        if not description:
-            raise ValueError("Empty response from moondream")
-
-        return description.strip()
+        description = query_description(connect(), image)
+        if cache is not None:
+            cache.put(*key, description)
+        return description
 
     except Exception as e:
-        error_msg = str(e).lower()
-        if "connection" in error_msg or "refused" in error_msg:
+        if is_connection_error(e):
             print("Error: Could not connect to moondream-station at http://localhost:2020", file=sys.stderr)
             print("Make sure moondream-station is running with: moondream-station", file=sys.stderr)
         else:
             print(f"Error calling moondream API: {e}", file=sys.stderr)
         sys.exit(1)
 
+def read_batch_items(args: list, stream=sys.stdin):
+    """Yield {"id", "url"} items from the arguments, or from stdin lines (URL or JSON)"""
+    if args:
+        for index, url in enumerate(args):
+            yield {"id": index, "url": url}
+        return
+
+    for index, line in enumerate(stream):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                # Reported as that item's error; the rest of the batch still runs
+                yield {"id": index, "url": None, "error": f"Invalid JSON line: {e}"}
+                continue
+            item.setdefault("id", index)
+            yield item
+        else:
+            yield {"id": index, "url": line}
+
+def describe_batch(
+    items,
+    endpoint: str = MOONDREAM_ENDPOINT,
+    out=sys.stdout,
+    cache: DescriptionCache = None,
+    max_edge: int = MAX_EDGE,
+    max_bytes: int = MAX_DOWNLOAD_BYTES,
+) -> dict:
+    """
+    Describe many images with one model client and one pooled session.
+
+    Downloads run in a thread pool up to PREFETCH images ahead of the model,
+    so fetching the next photos overlaps the current query. Cache lookups
+    happen in the download threads, so cached items never reach the model.
+    Results are written to `out` as JSON lines in input order; a failed
+    item is reported in its line and the batch continues.
+
+    Returns counts of described and failed items.
+    """
+    session = make_session()
+    model = connect(endpoint)
+    prompt_hash = prompt_key(PROMPT, max_edge)
+    counts = {"ok": 0, "failed": 0}
+
+    def prepare(url):
+        """(image hash, cached description or None, decoded image or None)"""
+        data = fetch_bytes(url, session, max_bytes)
+        image_hash = sha256_hex(data)
+        if cache is not None:
+            cached = cache.get(image_hash, prompt_hash, endpoint)
+            if cached is not None:
+                return image_hash, cached, None
+        try:
+            return image_hash, None, open_image(data, max_edge)
+        except Exception as e:
+            raise DecodeError(e) from e
+
+    def emit(item, **fields):
+        line = {"id": item.get("id"), "url": item.get("url"), **fields}
+        counts["ok" if fields.get("ok") else "failed"] += 1
+        print(json.dumps(line), file=out, flush=True)
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as pool:
+        pending = deque()
+        items = iter(items)
+
+        def submit_next():
+            item = next(items, None)
+            if item is None:
+                return False
+            if not item.get("url"):
+                pending.append((item, None))
+            else:
+                pending.append((item, pool.submit(prepare, item["url"])))
+            return True
+
+        while len(pending) < PREFETCH and submit_next():
+            pass
+
+        while pending:
+            item, future = pending.popleft()
+            submit_next()
+            start = time.perf_counter()
+
+            if future is None:
+                emit(item, ok=False, stage="input", error=item.get("error", "Missing url"))
+                continue
+            try:
+                image_hash, cached, image = future.result()
+            except DecodeError as e:
+                emit(item, ok=False, stage="decode", error=f"Error decoding image: {e}")
+                continue
+            except Exception as e:
+                emit(item, ok=False, stage="download", error=f"Error downloading image: {e}")
+                continue
+
+            if cached is not None:
+                emit(item, ok=True, description=cached, cached=True, seconds=round(time.perf_counter() - start, 3))
+                continue
+
+            try:
+                description = query_description(model, image)
+                if cache is not None:
+                    cache.put(image_hash, prompt_hash, endpoint, description)
+            except Exception as e:
+                if is_connection_error(e):
+                    error = f"Could not connect to moondream-station at {endpoint}"
+                else:
+                    error = f"Error calling moondream API: {e}"
+                emit(item, ok=False, stage="query", error=error)
+                continue
+
+            emit(
+                item,
+                ok=True,
+                description=description,
+                cached=False,
+                seconds=round(time.perf_counter() - start, 3),
+            )
+
+    return counts
+
+def compare_sizes(image_url: str, sizes=COMPARE_SIZES, endpoint: str = MOONDREAM_ENDPOINT, max_bytes: int = MAX_DOWNLOAD_BYTES) -> list:
+    """
+    Describe one image at each max edge (0 = full resolution) and measure it.
+
+    Each row holds the decode and query times, the decoded size, the image
+    as a JPEG payload, and the word-level similarity (0-1) of the answer to
+    the full-resolution one (or the largest edge tried). The cache is not
+    used.
+    """
+    data = fetch_bytes(image_url, max_bytes=max_bytes)
+    model = connect(endpoint)
+    rows = []
+    for edge in sizes:
+        start = time.perf_counter()
+        image = open_image(data, edge)
+        image.load()
+        decoded = time.perf_counter()
+        description = query_description(model, image)
+        queried = time.perf_counter()
+
+        payload = BytesIO()
+        image.save(payload, format="JPEG", quality=95)
+        rows.append({
+            "maxEdge": edge,
+            "size": list(image.size),
+            "payloadBytes": payload.tell(),
+            "decodeMs": round((decoded - start) * 1000, 1),
+            "queryMs": round((queried - decoded) * 1000, 1),
+            "description": description,
+        })
+
+    reference = max(rows, key=lambda row: row["maxEdge"] or float("inf"))["description"].split()
+    for row in rows:
+        row["similarity"] = round(difflib.SequenceMatcher(None, reference, row["description"].split()).ratio(), 3)
+    return rows
+
 def main():
-    if len(sys.argv) != 2:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Describe costume photos with moondream-station")
+    parser.add_argument("urls", nargs="*", help="Image URL (several, or none to read stdin, with --batch)")
+    parser.add_argument("--batch", action="store_true", help="Describe many images, one JSON line each")
+    parser.add_argument("--no-cache", action="store_true", help="Always query the model")
+    parser.add_argument("--cache", default=CACHE_PATH, help="Description cache database (default: %(default)s)")
+    parser.add_argument("--cache-ttl-days", type=float, default=CACHE_TTL_DAYS, help="Cache entry lifetime (default: %(default)s)")
+    parser.add_argument("--cache-max-entries", type=int, default=CACHE_MAX_ENTRIES, help="Cache size limit (default: %(default)s)")
+    parser.add_argument("--cache-stats", action="store_true", help="Print the cache's entries and hit/miss totals and exit")
+    parser.add_argument("--max-edge", type=int, default=MAX_EDGE, help="Longest image edge sent to the model in px, 0 for full resolution (default: %(default)s)")
+    parser.add_argument("--max-bytes", type=int, default=MAX_DOWNLOAD_BYTES, help="Download size limit (default: %(default)s)")
+    parser.add_argument("--compare-sizes", action="store_true", help="Describe one image at each of --sizes and print latency and similarity")
+    parser.add_argument("--sizes", default=",".join(map(str, COMPARE_SIZES)), help="Max edges for --compare-sizes (default: %(default)s)")
+    args = parser.parse_args()
+
+    cache = None
+    if not args.no_cache:
+        cache = DescriptionCache(args.cache, args.cache_ttl_days, args.cache_max_entries)
+
+    if args.cache_stats:
+        print(json.dumps(cache.stats() if cache else {}))
+        return
+
+    if args.compare_sizes:
+        if len(args.urls) != 1:
+            parser.error("--compare-sizes takes one image URL")
+        sizes = [int(size) for size in args.sizes.split(",")]
+        for row in compare_sizes(args.urls[0], sizes, max_bytes=args.max_bytes):
+            print(json.dumps(row))
+        return
+
+    if args.batch:
+        start = time.perf_counter()
+        counts = describe_batch(
+            read_batch_items(args.urls), cache=cache, max_edge=args.max_edge, max_bytes=args.max_bytes
+        )
+        print(
+            f"Described {counts['ok']} images ({counts['failed']} failed) "
+            f"in {time.perf_counter() - start:.1f}s",
+            file=sys.stderr,
+        )
+        if cache is not None:
+            print(f"Description cache: {json.dumps(cache.stats())}", file=sys.stderr)
+        return
+
+    if len(args.urls) != 1:
         print("Usage: python moondream-describe-image.py <image_url>", file=sys.stderr)
+        print("       python moondream-describe-image.py --batch [<image_url> ...] (or URLs/JSONL on stdin)", file=sys.stderr)
         sys.exit(1)
 
-    image_url = sys.argv[1]
+    image_url = args.urls[0]
 
     # Generate description
-    description = describe_costume(image_url)
+    description = describe_costume(image_url, cache, args.max_edge, args.max_bytes)
 
     # Output to stdout (this will be captured by Node.js)
     print(description)
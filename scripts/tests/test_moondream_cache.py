@@ -0,0 +1,106 @@
+"""
+Tests for the moondream description cache. Run from the repo root:
+    python -m pytest -q scripts/tests
+(needs the script's own dependencies: moondream, requests, pillow)
+"""
+
+import io
+import os
+import importlib.util
+
+import pytest
+
+pytest.importorskip("moondream")
+pytest.importorskip("requests")
+
+from PIL import Image
+
+SCRIPT = os.path.join(os.path.dirname(__file__), "..", "moondream-describe-image.py")
+spec = importlib.util.spec_from_file_location("moondream_describe_image", SCRIPT)
+describe = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(describe)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return describe.DescriptionCache(str(tmp_path / "descriptions.sqlite"), ttl_days=1, max_entries=3)
+
+
+def test_the_prompt_and_edge_are_part_of_the_key():
+    keys = {
+        describe.prompt_key(),
+        describe.prompt_key(describe.PROMPT + " Be brief."),
+        describe.prompt_key(max_edge=378),
+        describe.prompt_key(max_edge=0),
+    }
+    assert len(keys) == 4
+    assert describe.sha256_hex(b"photo") == describe.sha256_hex(b"photo")
+
+
+def test_a_description_is_found_only_under_its_whole_key(cache):
+    cache.put("img", "prompt", "http://a", "a red coat")
+
+    assert cache.get("img", "prompt", "http://a") == "a red coat"
+    assert cache.get("img", "other prompt", "http://a") is None
+    assert cache.get("img", "prompt", "http://b") is None
+    assert cache.get("other img", "prompt", "http://a") is None
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_entries_expire_after_the_ttl(monkeypatch, cache):
+    now = 1_000_000.0
+    monkeypatch.setattr(describe.time, "time", lambda: now)
+    cache.put("img", "prompt", "endpoint", "a red coat")
+
+    now += 86400 + 1
+    assert cache.get("img", "prompt", "endpoint") is None
+
+
+def test_the_least_recently_used_entries_go_past_max_entries(monkeypatch, cache):
+    now = 1_000_000.0
+    monkeypatch.setattr(describe.time, "time", lambda: now)
+    for image_hash in ("a", "b", "c"):
+        now += 1
+        cache.put(image_hash, "prompt", "endpoint", image_hash)
+    now += 1
+    cache.get("a", "prompt", "endpoint")  # now the most recently used
+
+    now += 1
+    cache.put("d", "prompt", "endpoint", "d")
+
+    assert cache.get("b", "prompt", "endpoint") is None
+    assert [cache.get(h, "prompt", "endpoint") for h in "acd"] == ["a", "c", "d"]
+    assert cache.stats()["entries"] == 3
+
+
+def test_totals_add_up_across_instances(cache):
+    cache.put("img", "prompt", "endpoint", "a red coat")
+    cache.get("img", "prompt", "endpoint")
+    other = describe.DescriptionCache(cache.path)
+    other.get("missing", "prompt", "endpoint")
+
+    stats = other.stats()
+    assert (stats["hits"], stats["misses"]) == (0, 1)
+    assert (stats["totalHits"], stats["totalMisses"]) == (1, 1)
+
+
+def test_batch_answers_a_cached_photo_without_the_model(monkeypatch, cache):
+    photo = io.BytesIO()
+    Image.new("RGB", (40, 30), "red").save(photo, "PNG")
+    monkeypatch.setattr(describe, "fetch_bytes", lambda url, session=None, max_bytes=0: photo.getvalue())
+    queries = []
+
+    class Model:
+        def query(self, image, prompt):
+            queries.append(image.size)
+            return {"answer": "a red coat"}
+
+    monkeypatch.setattr(describe, "connect", lambda endpoint=None: Model())
+    out = io.StringIO()
+    items = [{"id": 1, "url": "https://example.com/a.png"}, {"id": 2, "url": "https://example.com/b.png"}]
+
+    describe.describe_batch(items[:1], out=out, cache=cache)
+    describe.describe_batch(items[1:], out=out, cache=cache)
+
+    assert len(queries) == 1
+    assert '"cached": true' in out.getvalue().splitlines()[1]
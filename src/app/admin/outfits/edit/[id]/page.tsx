@@ -4,6 +4,12 @@ import { useState, useEffect } from "react";
 import Link from "next/link";
 import { useParams, useRouter } from "next/navigation";
 
+const COLLAGE_POLL_MS = 1500;
+const COLLAGE_MAX_WAIT_MS = 5 * 60 * 1000;
+// Give up if the job is still queued and no runner has been alive this long
+const COLLAGE_NO_RUNNER_MAX_MS = 30 * 1000;
+const COLLAGE_MAX_STATUS_ERRORS = 3;
+
 interface ClothingItem {
   id: number;
   title: string;
@@ -328,8 +334,54 @@ export default function EditOutfitPage() {
         throw new Error(error.details || "Failed to generate collage");
       }
 
-      const result = await response.json();
-      setCollageUrl(result.collageUrl);
+      // The collage is rendered by the background pipeline; poll until it is uploaded
+      const { jobId } = await response.json();
+      const deadline = Date.now() + COLLAGE_MAX_WAIT_MS;
+      let noRunnerSince: number | null = null;
+      let statusErrors = 0;
+      let done = false;
+      while (!done && Date.now() < deadline) {
+        await new Promise((resolve) => setTimeout(resolve, COLLAGE_POLL_MS));
+        const statusResponse = await fetch(
+          `/api/outfits/${outfitId}/generate-collage?jobId=${jobId}`
+        );
+        const status = await statusResponse.json().catch(() => ({}));
+        if (!statusResponse.ok) {
+          // A 404 is final; anything else may be a transient failure to read the queue
+          if (statusResponse.status === 404 || ++statusErrors >= COLLAGE_MAX_STATUS_ERRORS) {
+            throw new Error(status.details || status.error || "Failed to check collage job");
+          }
+          continue;
+        }
+        statusErrors = 0;
+        if (status.state === "done") {
+          setCollageUrl(status.collageUrl);
+          done = true;
+          continue;
+        }
+        if (status.state === "failed") {
+          throw new Error(status.error || "Collage job failed");
+        }
+        if (status.runnerAlive) {
+          noRunnerSince = null;
+        } else {
+          if (noRunnerSince === null) {
+            noRunnerSince = Date.now();
+          } else if (Date.now() - noRunnerSince > COLLAGE_NO_RUNNER_MAX_MS) {
+            throw new Error(
+              "The collage pipeline runner is not running (see collage/temp/pipeline/runner.log)"
+            );
+          }
+        }
+        setMessage(
+          status.runnerAlive
+            ? `Generating collage (${status.stage}${status.attempts > 1 ? `, attempt ${status.attempts}` : ""})...`
+            : "Collage queued; waiting for the pipeline runner..."
+        );
+      }
+      if (!done) {
+        throw new Error("Timed out waiting for the collage; it may still finish in the background");
+      }
       setMessage("✅ Collage generated successfully!");
     } catch (error) {
       setMessage("❌ Error: " + (error as Error).message);
@@ -245,10 +245,10 @@ function OutfitsListContent() {
     setRegenerationProgress({ current: 0, total: 0, currentOutfitName: "" });
 
     if (failCount === 0) {
-      setMessage(`✅ Successfully regenerated all ${successCount} collages!`);
+      setMessage(`✅ Queued all ${successCount} collages for regeneration!`);
     } else {
       setMessage(
-        `⚠️ Regenerated ${successCount} collages, ${failCount} failed`
+        `⚠️ Queued ${successCount} collages, ${failCount} failed`
       );
     }
 
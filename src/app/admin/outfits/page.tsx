@@ -414,7 +414,7 @@ export default function CreateOutfitPage() {
           await fetch(`/api/outfits/${outfitId}/generate-collage`, {
             method: "POST",
           });
-          setMessage(`✅ Outfit "${result.outfit.name}" created with collage!`);
+          setMessage(`✅ Outfit "${result.outfit.name}" created; collage queued!`);
         } catch (collageError) {
           console.error("Failed to generate collage:", collageError);
           setMessage(
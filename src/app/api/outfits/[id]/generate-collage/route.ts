@@ -2,37 +2,204 @@ import { NextRequest, NextResponse } from "next/server";
 import { db } from "@/db";
 import { outfits, outfitItems, clothingItems } from "@/db/schema";
 import { eq } from "drizzle-orm";
-import { exec } from "child_process";
+import { exec, execFile } from "child_process";
 import { promisify } from "util";
 import fs from "fs/promises";
 import path from "path";
-import https from "https";
-import http from "http";
-import { randomUUID } from "crypto";
-import { uploadToGoogleStorage, deleteFromGoogleStorage } from "@/lib/google-storage";
+import { deleteFromGoogleStorage } from "@/lib/google-storage";
 
 const execAsync = promisify(exec);
+const execFileAsync = promisify(execFile);
+const collagePath = path.join(process.cwd(), "collage");
+// The watcher's status checks start JOB_POLL_MS apart and back off to
+// JOB_POLL_MAX_MS, since each one starts a Python process
+const JOB_POLL_MS = 2000;
+const JOB_POLL_MAX_MS = 30 * 1000;
+const JOB_WATCH_TIMEOUT_MS = 30 * 60 * 1000;
+// Consecutive failures to read the status (exec errors, a locked queue)
+// before the watcher gives up
+const JOB_STATUS_MAX_ERRORS = 5;
+// Layout search (arrange.py --optimize-layout) is opt-in: it changes the
+// layout of existing collages, e.g. column counts
+const COLLAGE_OPTIMIZE_LAYOUT = process.env.COLLAGE_OPTIMIZE_LAYOUT === "true";
+
+type CollageJobStatus = {
+  jobId: string;
+  outfitId: number;
+  stage: string;
+  state: "queued" | "running" | "done" | "failed";
+  attempts: number;
+  error: string | null;
+  runnerAlive: boolean;
+  stageMs: Record<string, number>;
+  url?: string;
+  boundingBoxes?: unknown[];
+};
+
+/**
+ * A job's status from the pipeline queue, or null if there is no such
+ * job. Throws when the status cannot be read, which may be transient.
+ */
+async function getJobStatus(jobId: string): Promise<CollageJobStatus | null> {
+  try {
+    const { stdout } = await execAsync(
+      `cd "${collagePath}" && ./ve/bin/python pipeline.py --status ${jobId}`
+    );
+    return JSON.parse(stdout);
+  } catch (error) {
+    // --status exits 1 with {"error": "No such job"} for an unknown id
+    const stdout = (error as { stdout?: string }).stdout;
+    if (stdout?.includes("No such job")) {
+      return null;
+    }
+    throw error;
+  }
+}
 
-async function downloadImage(url: string, filepath: string): Promise<void> {
-  const file = await fs.open(filepath, "w");
-  const fileStream = file.createWriteStream();
+function isHttpUrl(value: string | undefined) {
+  try {
+    const { protocol } = new URL(value ?? "");
+    return protocol === "http:" || protocol === "https:";
+  } catch {
+    return false;
+  }
+}
 
-  return new Promise((resolve, reject) => {
-    const protocol = url.startsWith("https") ? https : http;
+/**
+ * Point the outfit at a finished job's collage and bounding boxes, once
+ * (later calls see the URL already set). A collage URL browsers cannot
+ * load (e.g. file:// from the pipeline's dir: sink without a base URL) is
+ * never stored: the job is marked failed instead. Returns the status to
+ * report.
+ */
+async function applyFinishedJob(
+  outfitId: number,
+  status: CollageJobStatus
+): Promise<CollageJobStatus> {
+  if (!isHttpUrl(status.url)) {
+    const error = `Collage was uploaded to a non-http(s) URL: ${status.url}`;
+    console.error(`Collage job ${status.jobId} for outfit ${outfitId}: ${error}`);
+    await execFileAsync(
+      "./ve/bin/python",
+      ["pipeline.py", "--fail", status.jobId, "--error", error],
+      { cwd: collagePath }
+    ).catch(() => {
+      // Already marked failed (e.g. by the background watcher)
+    });
+    return { ...status, state: "failed", error };
+  }
 
-    protocol
-      .get(url, (response) => {
-        response.pipe(fileStream);
-        fileStream.on("finish", () => {
-          fileStream.close();
-          resolve();
-        });
-      })
-      .on("error", (err) => {
-        fs.unlink(filepath).catch(() => {});
-        reject(err);
-      });
-  });
+  const [outfit] = await db
+    .select({ imageUrl: outfits.imageUrl })
+    .from(outfits)
+    .where(eq(outfits.id, outfitId))
+    .limit(1);
+
+  if (!outfit || outfit.imageUrl === status.url) {
+    return status;
+  }
+
+  await db
+    .update(outfits)
+    .set({
+      imageUrl: status.url,
+      collageMetadata: status.boundingBoxes ? JSON.stringify(status.boundingBoxes) : null,
+      updatedAt: new Date(),
+    })
+    .where(eq(outfits.id, outfitId));
+  console.log(
+    `Collage for outfit ${outfitId} uploaded to: ${status.url} (stage ms: ${JSON.stringify(status.stageMs)})`
+  );
+  return status;
+}
+
+/**
+ * Follow a queued job in the background so the outfit is updated even if
+ * no client polls GET (e.g. bulk regeneration).
+ */
+async function watchCollageJob(outfitId: number, jobId: string) {
+  const deadline = Date.now() + JOB_WATCH_TIMEOUT_MS;
+  let delay = JOB_POLL_MS;
+  let errors = 0;
+  while (Date.now() < deadline) {
+    await new Promise((resolve) => setTimeout(resolve, delay));
+    delay = Math.min(delay * 1.5, JOB_POLL_MAX_MS);
+
+    let status;
+    try {
+      status = await getJobStatus(jobId);
+      errors = 0;
+    } catch (error) {
+      if (++errors >= JOB_STATUS_MAX_ERRORS) {
+        console.error(`Stopped watching collage job ${jobId} for outfit ${outfitId}:`, error);
+        return;
+      }
+      continue;
+    }
+    if (!status || status.state === "failed") {
+      console.error(`Collage job ${jobId} for outfit ${outfitId} failed: ${status?.error ?? "job not found"}`);
+      return;
+    }
+    if (status.state === "done") {
+      await applyFinishedJob(outfitId, status);
+      return;
+    }
+  }
+  console.error(`Gave up waiting for collage job ${jobId} for outfit ${outfitId}`);
+}
+
+/**
+ * Poll a collage job queued by POST. A finished job's collage is applied
+ * to the outfit here too, in case the background watcher was lost (e.g.
+ * on a dev server reload).
+ */
+export async function GET(
+  request: NextRequest,
+  { params }: { params: Promise<{ id: string }> }
+) {
+  try {
+    const { id } = await params;
+    const outfitId = parseInt(id);
+    const jobId = request.nextUrl.searchParams.get("jobId");
+
+    if (!jobId || !/^[0-9a-f]+$/.test(jobId)) {
+      return NextResponse.json(
+        { error: "jobId is required" },
+        { status: 400 }
+      );
+    }
+
+    let status = await getJobStatus(jobId);
+    if (!status || status.outfitId !== outfitId) {
+      return NextResponse.json(
+        { error: "Job not found" },
+        { status: 404 }
+      );
+    }
+
+    if (status.state === "done") {
+      status = await applyFinishedJob(outfitId, status);
+    }
+
+    return NextResponse.json({
+      jobId,
+      state: status.state,
+      stage: status.stage,
+      attempts: status.attempts,
+      error: status.error,
+      runnerAlive: status.runnerAlive,
+      collageUrl: status.state === "done" ? status.url : null,
+    });
+  } catch (error) {
+    console.error("Error checking collage job:", error);
+    return NextResponse.json(
+      {
+        error: "Failed to check collage job",
+        details: error instanceof Error ? error.message : "Unknown error",
+      },
+      { status: 500 }
+    );
+  }
 }
 
 export async function POST(
@@ -87,91 +254,46 @@ export async function POST(
 
     // Create temp directory for this outfit
     const tempDir = path.join(process.cwd(), "collage", "temp", `outfit-${outfitId}`);
-    const imagesDir = path.join(tempDir, "images");
-
-    await fs.mkdir(imagesDir, { recursive: true });
-
-    // Download all clothing item images
-    console.log(`Downloading ${items.length} images...`);
-    for (let i = 0; i < items.length; i++) {
-      const item = items[i];
-      if (!item.imageUrl) continue;
-
-      const ext = item.imageUrl.endsWith(".png") ? ".png" : ".jpg";
-      const filename = `item-${item.id}${ext}`;
-      const filepath = path.join(imagesDir, filename);
-
-      await downloadImage(item.imageUrl, filepath);
-      console.log(`Downloaded ${filename}`);
-    }
-
-    // Download inspiration photo if it exists
-    let inspirationPhotoPath = null;
-    if (outfit.inspirationPhotoUrl) {
-      try {
-        console.log("Downloading inspiration photo...");
-        const ext = outfit.inspirationPhotoUrl.endsWith(".png") ? ".png" : ".jpg";
-        const inspirationFilename = `inspiration${ext}`;
-        inspirationPhotoPath = path.join(tempDir, inspirationFilename);
-
-        await downloadImage(outfit.inspirationPhotoUrl, inspirationPhotoPath);
-        console.log(`Downloaded inspiration photo`);
-      } catch (error) {
-        console.error("Failed to download inspiration photo:", error);
-        inspirationPhotoPath = null;
-      }
-    }
-
-    // Run arrange.py
-    console.log("Running arrange.py...");
-    const collagePath = path.join(process.cwd(), "collage");
-
-    const collageFilename = `outfit-${outfitId}-${randomUUID()}.png`;
-    const tempCollageOutputPath = path.join(tempDir, collageFilename);
 
-    // Build command with optional --inspiration flag
-    let command = `cd "${collagePath}" && ./ve/bin/python arrange.py "${imagesDir}" "${tempCollageOutputPath}"`;
-    if (inspirationPhotoPath) {
-      command += ` --inspiration "${inspirationPhotoPath}"`;
-    }
-
-    const { stdout } = await execAsync(command);
-
-    // Parse bounding boxes from stdout
-    let boundingBoxes = null;
-    const jsonMatch = stdout.match(/===BOUNDING_BOXES_JSON===([\s\S]*?)===BOUNDING_BOXES_JSON_END===/);
-    if (jsonMatch && jsonMatch[1]) {
-      try {
-        boundingBoxes = JSON.parse(jsonMatch[1].trim());
-        console.log(`Captured ${boundingBoxes.length} bounding boxes`);
-      } catch (error) {
-        console.error("Failed to parse bounding boxes JSON:", error);
-      }
-    }
-
-    // Upload to Google Cloud Storage
-    console.log("Uploading collage to Google Cloud Storage...");
-    const gcsPath = `collages/${collageFilename}`;
-    const collageUrl = await uploadToGoogleStorage(tempCollageOutputPath, gcsPath);
-    console.log(`Uploaded to: ${collageUrl}`);
-
-    // Update outfit with Google Storage URL and collage metadata
-    await db
-      .update(outfits)
-      .set({
-        imageUrl: collageUrl,
-        collageMetadata: boundingBoxes ? JSON.stringify(boundingBoxes) : null,
-        updatedAt: new Date(),
+    await fs.mkdir(tempDir, { recursive: true });
+
+    // Write a manifest of item images; the pipeline fetches them concurrently
+    const manifestPath = path.join(tempDir, "manifest.json");
+    await fs.writeFile(
+      manifestPath,
+      JSON.stringify({
+        outfitId,
+        items: items
+          .filter((item) => item.imageUrl)
+          .map((item) => ({ itemId: item.id, url: item.imageUrl })),
+        inspirationUrl: outfit.inspirationPhotoUrl || null,
+        optimizeLayout: COLLAGE_OPTIMIZE_LAYOUT,
       })
-      .where(eq(outfits.id, outfitId));
+    );
 
-    // Clean up temp directory
+    // Queue the collage on the pipeline (fetch -> extract -> arrange -> encode
+    // -> upload), starting its runner if none is alive; poll GET for the result
+    console.log(`Queueing collage for ${items.length} items...`);
+    const { stdout } = await execAsync(
+      `cd "${collagePath}" && ./ve/bin/python pipeline.py --submit "${manifestPath}" --spawn-runner`
+    );
+    const { jobId } = JSON.parse(stdout);
+
+    // The manifest is stored with the job
     await fs.rm(tempDir, { recursive: true, force: true });
 
-    return NextResponse.json({
-      message: "Collage generated successfully",
-      collageUrl,
+    // Not awaited: the request returns while the job runs
+    watchCollageJob(outfitId, jobId).catch((error) => {
+      console.error(`Error watching collage job ${jobId} for outfit ${outfitId}:`, error);
     });
+
+    return NextResponse.json(
+      {
+        message: "Collage queued",
+        jobId,
+      },
+      { status: 202 }
+    );
   } catch (error) {
     console.error("Error generating collage:", error);
     return NextResponse.json(